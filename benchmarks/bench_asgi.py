@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/6 17:30
+"""ASGI模式下一次完整请求(路由, 读取请求体, 解析校验, 发送响应)的耗时
+
+视图显式使用asgi的parser_factory, 不受run.py中setup_wtph("flask")的影响
+"""
+import asyncio
+import json
+from typing import List
+from urllib.parse import urlencode
+
+from common import benchmark
+from bench_view import Item, make_endpoint, query_fields
+from wtph import Query, Body
+from wtph.asgi import ASGIApp, ASGIView
+from wtph.parsers.asgi import asgi_parser_manager_factory
+
+_loop = asyncio.new_event_loop()
+
+
+def make_app(params: dict, method: str = "GET") -> ASGIApp:
+    app = ASGIApp()
+    view = ASGIView(
+        endpoint=make_endpoint(params, "asgi_view"),
+        path=None,
+        methods={method},
+        parser_factory=asgi_parser_manager_factory,
+    )
+    app.add_url_rule("/bench", view_func=view, methods=[method])
+    return app
+
+
+def in_asgi(app: ASGIApp, method: str = "GET", query: bytes = b"", body: bytes = b"", content_type: bytes = b""):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": "/bench",
+        "query_string": query,
+        "headers": [(b"content-type", content_type)] if content_type else [],
+    }
+
+    async def request():
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        assert sent[0]["status"] == 200, sent
+
+    def call():
+        _loop.run_until_complete(request())
+
+    return call
+
+
+def setup_query(n: int):
+    names = query_fields(n)
+    app = make_app({name: (int, Query(0)) for name in names})
+    return in_asgi(app, query=urlencode({name: i for i, name in enumerate(names)}).encode())
+
+
+def setup_body(n: int):
+    items = [{"id": i, "name": "item-%d" % i, "tags": ["a", "b"]} for i in range(n)]
+    app = make_app({"items": (List[Item], Body(...))}, "POST")
+    return in_asgi(app, "POST", body=json.dumps({"items": items}).encode(), content_type=b"application/json")
+
+
+for _n in (1, 10, 50):
+    benchmark("asgi.query_%d" % _n, group="asgi")(lambda n=_n: setup_query(n))
+
+for _n in (1, 100):
+    benchmark("asgi.body_%d" % _n, group="asgi")(lambda n=_n: setup_body(n))
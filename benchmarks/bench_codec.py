@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/24 17:30
+"""对比json与orjson在请求体, 校验错误与openapi文档上的编解码耗时
+
+python benchmarks/bench_codec.py [-n 2000]
+python benchmarks/run.py -k codec
+"""
+import argparse
+import timeit
+
+from common import benchmark
+from wtph.codec import CODECS
+from wtph.exceptions import ConfigError
+
+RECORDS = {
+    "items": [
+        {"id": i, "name": "item-%d" % i, "price": i * 1.5, "tags": ["a", "b", "c"], "active": i % 2 == 0}
+        for i in range(500)
+    ]
+}
+ERRORS = [
+    {"loc": ["query", "field_%d" % i], "msg": "value is not a valid integer", "type": "type_error.integer"}
+    for i in range(50)
+]
+SPEC = {
+    "openapi": "3.0.2",
+    "info": {"title": "bench", "version": "0.1"},
+    "paths": {
+        "/route_%d" % i: {
+            "get": {
+                "parameters": [
+                    {"name": "q%d" % j, "in": "query", "required": False, "schema": {"type": "integer"}}
+                    for j in range(5)
+                ],
+                "responses": {"200": {"description": "Successful Response"}},
+            }
+        }
+        for i in range(1000)
+    },
+}
+PAYLOADS = {"records": RECORDS, "errors": ERRORS, "spec": SPEC}
+
+
+def register(name: str, codec_class: type, payload_name: str, payload):
+    @benchmark("codec.%s.dumps_%s" % (name, payload_name), group="codec")
+    def dumps():
+        codec = codec_class()
+        return lambda: codec.dumps(payload)
+
+    @benchmark("codec.%s.loads_%s" % (name, payload_name), group="codec")
+    def loads():
+        codec = codec_class()
+        encoded = codec.dumps(payload)
+        return lambda: codec.loads(encoded)
+
+
+for _name, _codec_class in CODECS.items():
+    try:
+        _codec_class()
+    except ConfigError:
+        # 没有安装对应的依赖(例如orjson)时不注册
+        continue
+    for _payload_name, _payload in PAYLOADS.items():
+        register(_name, _codec_class, _payload_name, _payload)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-n", "--number", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    for name, codec_class in CODECS.items():
+        try:
+            codec = codec_class()
+        except ConfigError as e:
+            print("%-8s skipped: %s" % (name, e))
+            continue
+        for payload_name, payload in PAYLOADS.items():
+            encoded = codec.dumps(payload)
+            dumps = timeit.timeit(lambda: codec.dumps(payload), number=args.number)
+            loads = timeit.timeit(lambda: codec.loads(encoded), number=args.number)
+            print("%-8s %-8s dumps %8.1fus  loads %8.1fus  (%d bytes)" % (
+                name, payload_name, dumps / args.number * 1e6, loads / args.number * 1e6, len(encoded)
+            ))
+
+
+if __name__ == '__main__':
+    main()
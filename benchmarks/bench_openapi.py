@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/28 21:05
+"""get_openapi在不同路由数量下的耗时, 以及每个路由注册的耗时"""
+from typing import List, Optional
+
+from flask import Flask
+from pydantic import BaseModel
+
+from common import benchmark
+from wtph import Query, Body, get_openapi
+from wtph.openapi import OpenapiBuilder
+from wtph.cache import model_registry
+from wtph.openapi.utils import SchemaCache
+from wtph.view import View
+
+_counter = [0]
+
+
+class Address(BaseModel):
+    city: str
+    street: Optional[str] = None
+
+
+class User(BaseModel):
+    name: str
+    age: int
+    addresses: List[Address] = []
+
+
+def endpoint(
+        page: int = Query(1, ge=1),
+        size: int = Query(20, le=100),
+        keyword: Optional[str] = Query(None),
+        users: List[User] = Body(...),
+):
+    return {}
+
+
+def make_views(n: int) -> List[View]:
+    views = []
+    for _ in range(n):
+        _counter[0] += 1
+        views.append(View(endpoint=endpoint, path="/openapi/%d" % _counter[0], methods={"POST"}))
+    return views
+
+
+def setup_cold(n: int):
+    views = make_views(n)
+
+    def run():
+        return get_openapi(title="bench", version="0.1", views=views, builder=OpenapiBuilder(SchemaCache()))
+
+    return run
+
+
+def setup_warm(n: int, shared: bool = False):
+    """shared为True时与/openapi.json相同, 不复制缓存的paths与schemas"""
+    views = make_views(n)
+    builder = OpenapiBuilder(SchemaCache())
+    get_openapi(title="bench", version="0.1", views=views, builder=builder)
+
+    def run():
+        return get_openapi(title="bench", version="0.1", views=views, builder=builder, shared=shared)
+
+    return run
+
+
+def setup_register(**view_config):
+    app = Flask("bench_register")
+
+    def run():
+        _counter[0] += 1
+        app.add_url_rule(
+            "/register/%d" % _counter[0],
+            "register_%d" % _counter[0],
+            endpoint,
+            methods=["POST"],
+            view_config=view_config,
+        )
+
+    return run
+
+
+def setup_register_no_intern():
+    register = setup_register()
+
+    def run():
+        model_registry.enabled = False
+        try:
+            register()
+        finally:
+            model_registry.enabled = True
+
+    return run
+
+
+for _n, _repeat in ((10, 5), (1000, 3), (5000, 1)):
+    benchmark("openapi.routes_%d.cold" % _n, group="openapi", number=1, repeat=_repeat)(
+        lambda n=_n: setup_cold(n)
+    )
+    benchmark("openapi.routes_%d.warm" % _n, group="openapi", number=1, repeat=_repeat)(
+        lambda n=_n: setup_warm(n)
+    )
+    benchmark("openapi.routes_%d.warm_shared" % _n, group="openapi", number=1, repeat=_repeat)(
+        lambda n=_n: setup_warm(n, shared=True)
+    )
+
+benchmark("register.route", group="register", number=200, repeat=3)(lambda: setup_register())
+benchmark("register.route_lazy", group="register", number=200, repeat=3)(lambda: setup_register(lazy=True))
+benchmark("register.route_compiled", group="register", number=200, repeat=3)(
+    lambda: setup_register(compiled=True)
+)
+benchmark("register.route_no_intern", group="register", number=200, repeat=3)(lambda: setup_register_no_intern())
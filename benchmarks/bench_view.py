@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/28 20:40
+"""View.__call__相对于直接读取request的flask视图的开销
+
+每次调用都会重新创建请求上下文, bare与wtph两组的差值即为参数解析与校验的开销;
+batch组比较n个独立的WSGI请求与合并为一个批量请求的耗时
+"""
+import inspect
+import io
+import json
+from typing import Callable, List
+from urllib.parse import urlencode
+
+from flask import Flask, request
+from werkzeug.test import run_wsgi_app
+from pydantic import BaseModel
+from werkzeug.test import EnvironBuilder
+
+from common import benchmark, in_request
+from wtph import Query, Header, Form, Body, BatchBody, Depends, Instrumentation
+from wtph.codec import get_codec
+from wtph.multiplex import SubRequest, dispatch_batch
+from wtph.view import View
+
+app = Flask("bench_view")
+_counter = [0]
+
+
+class Item(BaseModel):
+    id: int
+    name: str
+    tags: List[str] = []
+
+
+def make_endpoint(params: dict, name: str = "endpoint") -> Callable:
+    """根据{参数名: (类型, 默认值)}生成一个视图函数"""
+
+    def endpoint(**kwargs):
+        return kwargs
+
+    endpoint.__name__ = endpoint.__qualname__ = name
+    endpoint.__signature__ = inspect.Signature([
+        inspect.Parameter(key, inspect.Parameter.KEYWORD_ONLY, annotation=annotation, default=default)
+        for key, (annotation, default) in params.items()
+    ])
+    return endpoint
+
+
+def make_view(params: dict, method: str = "GET", **options) -> View:
+    _counter[0] += 1
+    path = "/bench/%d" % _counter[0]
+    return View(endpoint=make_endpoint(params, "view_%d" % _counter[0]), path=path, methods={method}, **options)
+
+
+def get_environ(method: str = "GET", query: str = "", data=None, json_data=None, path: str = "/") -> dict:
+    builder = EnvironBuilder(path=path, method=method, query_string=query, data=data, json=json_data)
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def form_body(data: dict) -> bytes:
+    return urlencode(data).encode()
+
+
+def query_fields(n: int) -> List[str]:
+    return ["q%d" % i for i in range(n)]
+
+
+def setup_query(n: int, valid: bool = True, bare: bool = False, instrumented: bool = False, **options):
+    names = query_fields(n)
+    query = urlencode({name: (i if valid else "x") for i, name in enumerate(names)})
+    environ = get_environ(query=query)
+    if bare:
+        def view():
+            args = request.args
+            return {name: int(args.get(name, 0)) for name in names}
+    else:
+        view = make_view({name: (int, Query(0)) for name in names}, **options)
+        if instrumented:
+            view.instrumentation = Instrumentation()
+    return in_request(app, environ, view)
+
+
+def setup_extract_query(n: int, **options):
+    """只计算参数提取, 请求上下文在setup中创建, request.args在第一次调用后被缓存"""
+    names = query_fields(n)
+    environ = get_environ(query=urlencode({name: i for i, name in enumerate(names)}))
+    view = make_view({name: (int, Query(0)) for name in names}, **options)
+    extractor = view.parser_manager._extractor  # noqa
+    ctx = app.request_context(environ)
+
+    def call():
+        with ctx:
+            return extractor()
+
+    return call
+
+
+def setup_header(n: int, bare: bool = False, **options):
+    names = ["x_header_%d" % i for i in range(n)]
+    environ = get_environ()
+    for i, name in enumerate(names):
+        environ["HTTP_" + name.upper()] = str(i)
+    if bare:
+        def view():
+            headers = request.headers
+            return {name: int(headers.get(name.replace("_", "-"), 0)) for name in names}
+    else:
+        view = make_view({name: (int, Header(0)) for name in names}, **options)
+    return in_request(app, environ, view)
+
+
+def setup_form(n: int, bare: bool = False):
+    names = ["f%d" % i for i in range(n)]
+    data = {name: "value-%d" % i for i, name in enumerate(names)}
+    body = form_body(data)
+    environ = get_environ("POST", data=body)
+    environ["CONTENT_TYPE"] = "application/x-www-form-urlencoded"
+    environ["CONTENT_LENGTH"] = str(len(body))
+    if bare:
+        def view():
+            form = request.form
+            return {name: form.get(name) for name in names}
+    else:
+        view = make_view({name: (str, Form(...)) for name in names}, "POST")
+    return in_request(app, environ, view, body)
+
+
+def setup_body(n: int, valid: bool = True, bare: bool = False, batch: bool = False):
+    items = [{"id": i, "name": "item-%d" % i, "tags": ["a", "b"]} for i in range(n)]
+    if not valid:
+        items[-1]["id"] = "x"
+    body = json.dumps({"items": items}).encode()
+    environ = get_environ("POST", data=body)
+    environ["CONTENT_TYPE"] = "application/json"
+    environ["CONTENT_LENGTH"] = str(len(body))
+    if bare:
+        def view():
+            return {"items": request.get_json()["items"]}
+    else:
+        view = make_view({"items": (List[Item], BatchBody(...) if batch else Body(...))}, "POST")
+    return in_request(app, environ, view, body)
+
+
+def make_chain(depth: int) -> Depends:
+    """depth层相互依赖的依赖, 最底层读取一个query参数"""
+
+    def base(q: int = Query(0)):
+        return q
+
+    depend = Depends(base)
+    for i in range(depth - 1):
+        depend = Depends(make_endpoint({"v": (int, depend)}, "chain_%d" % i))
+    return depend
+
+
+def setup_depends_depth(depth: int):
+    environ = get_environ(query="q=1")
+    view = make_view({"v": (int, make_chain(depth))})
+    return in_request(app, environ, view)
+
+
+def setup_depends_fanout(n: int):
+    environ = get_environ(query=urlencode({"q%d" % i: i for i in range(n)}))
+    params = {}
+    for i in range(n):
+        dependency = make_endpoint({"q%d" % i: (int, Query(0))}, "fan_%d" % i)
+        params["d%d" % i] = (dict, Depends(dependency))
+    view = make_view(params)
+    return in_request(app, environ, view)
+
+
+def setup_batch(n: int, batch: bool = False):
+    """n个共享同一个依赖的GET请求, 分别通过WSGI调用或者合并为一个批量请求"""
+    batch_app = Flask("bench_batch_%d_%s" % (n, batch))
+    codec = get_codec("auto")
+
+    def get_user(token: str = Query("anon")):
+        return {"token": token}
+
+    batch_app.add_url_rule("/items", view_func=View(
+        endpoint=make_endpoint({"item_id": (int, Query(...)), "user": (dict, Depends(get_user))}, "items"),
+        path="/items",
+        methods={"GET"},
+    ))
+
+    def batch_view(requests: List[SubRequest] = Body(...)):
+        return batch_app.response_class(dispatch_batch(batch_app, requests, codec), mimetype="application/json")
+
+    batch_app.add_url_rule("/batch", view_func=View(endpoint=batch_view, path="/batch", methods={"POST"}))
+    paths = ["/items?item_id=%d&token=t" % i for i in range(n)]
+    if batch:
+        body = json.dumps({"requests": [{"path": path} for path in paths]}).encode()
+        environ = get_environ("POST", data=body, path="/batch")
+        environ["CONTENT_TYPE"] = "application/json"
+        items = [(environ, body)]
+    else:
+        items = [(get_environ(query=path.partition("?")[2], path="/items"), b"") for path in paths]
+
+    def call():
+        for environ, body in items:
+            env = dict(environ)
+            env["wsgi.input"] = io.BytesIO(body)
+            _, status, _ = run_wsgi_app(batch_app, env, buffered=True)
+            assert status.startswith("200"), status
+
+    return call
+
+
+for _n in (1, 10, 50):
+    benchmark("view.query_%d.bare" % _n, group="view")(lambda n=_n: setup_query(n, bare=True))
+    benchmark("view.query_%d.wtph" % _n, group="view")(lambda n=_n: setup_query(n))
+    benchmark("view.query_%d.wtph_compiled" % _n, group="view")(lambda n=_n: setup_query(n, compiled=True))
+    benchmark("view.query_%d.wtph_instrumented" % _n, group="view")(
+        lambda n=_n: setup_query(n, instrumented=True)
+    )
+    benchmark("view.query_%d.wtph_invalid" % _n, group="view")(lambda n=_n: setup_query(n, valid=False))
+    benchmark("view.query_%d.wtph_invalid_max_errors_1" % _n, group="view")(
+        lambda n=_n: setup_query(n, valid=False, max_errors=1)
+    )
+    benchmark("extract.query_%d.wtph" % _n, group="extract")(lambda n=_n: setup_extract_query(n))
+    benchmark("extract.query_%d.wtph_compiled" % _n, group="extract")(
+        lambda n=_n: setup_extract_query(n, compiled=True)
+    )
+    benchmark("view.header_%d.bare" % _n, group="view")(lambda n=_n: setup_header(n, bare=True))
+    benchmark("view.header_%d.wtph" % _n, group="view")(lambda n=_n: setup_header(n))
+    benchmark("view.header_%d.wtph_compiled" % _n, group="view")(lambda n=_n: setup_header(n, compiled=True))
+    benchmark("view.form_%d.bare" % _n, group="view")(lambda n=_n: setup_form(n, bare=True))
+    benchmark("view.form_%d.wtph" % _n, group="view")(lambda n=_n: setup_form(n))
+
+for _n in (1, 100, 1000):
+    benchmark("view.body_%d.bare" % _n, group="view")(lambda n=_n: setup_body(n, bare=True))
+    benchmark("view.body_%d.wtph" % _n, group="view")(lambda n=_n: setup_body(n))
+    benchmark("view.body_%d.wtph_invalid" % _n, group="view")(lambda n=_n: setup_body(n, valid=False))
+    benchmark("view.body_%d.wtph_batch" % _n, group="view")(lambda n=_n: setup_body(n, batch=True))
+    benchmark("view.body_%d.wtph_batch_invalid" % _n, group="view")(
+        lambda n=_n: setup_body(n, valid=False, batch=True)
+    )
+
+for _n in (1, 5, 10):
+    benchmark("view.depends_depth_%d" % _n, group="view")(lambda n=_n: setup_depends_depth(n))
+    benchmark("view.depends_fanout_%d" % _n, group="view")(lambda n=_n: setup_depends_fanout(n))
+
+for _n in (5, 20):
+    benchmark("batch.get_%d.separate" % _n, group="batch")(lambda n=_n: setup_batch(n))
+    benchmark("batch.get_%d.batch" % _n, group="batch")(lambda n=_n: setup_batch(n, batch=True))
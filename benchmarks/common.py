@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/28 20:10
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+class Benchmark(object):
+    """一个基准测试, func在每次调用时执行一次被测的操作
+
+    :param setup: 返回被测函数, 只在开始时调用一次, 不计入耗时
+    :param number: 每轮调用的次数, 为None时自动调整到每轮至少min_time秒
+    """
+
+    def __init__(
+            self,
+            name: str,
+            setup: Callable[[], Callable[[], object]],
+            *,
+            group: str,
+            number: Optional[int] = None,
+            repeat: int = 5,
+    ):
+        self.name = name
+        self.setup = setup
+        self.group = group
+        self.number = number
+        self.repeat = repeat
+
+    def run(self, min_time: float = 0.1, repeat: Optional[int] = None) -> dict:
+        func = self.setup()
+        repeat = repeat or self.repeat
+        number = self.number
+        if number is None:
+            number = 1
+            while True:
+                elapsed = _timeit(func, number)
+                if elapsed >= min_time:
+                    break
+                number *= 10 if elapsed < min_time / 10 else 2
+        timings = [_timeit(func, number) / number for _ in range(repeat)]
+        return {
+            "group": self.group,
+            "number": number,
+            "repeat": repeat,
+            "min_us": min(timings) * 1e6,
+            "median_us": statistics.median(timings) * 1e6,
+            "mean_us": statistics.mean(timings) * 1e6,
+        }
+
+
+def _timeit(func: Callable, number: int) -> float:
+    timer = time.perf_counter
+    start = timer()
+    for _ in range(number):
+        func()
+    return timer() - start
+
+
+registry: List[Benchmark] = []
+
+
+def benchmark(name: str, *, group: str, number: Optional[int] = None, repeat: int = 5):
+    """注册一个benchmark, 被装饰的函数为setup"""
+
+    def wrapper(setup):
+        registry.append(Benchmark(name, setup, group=group, number=number, repeat=repeat))
+        return setup
+
+    return wrapper
+
+
+def in_request(app, environ: dict, func: Callable, body: bytes = b"") -> Callable[[], object]:
+    """在请求上下文中调用func, 每次调用都重新创建上下文, 保证请求体与form没有被缓存"""
+
+    def call():
+        env = dict(environ)
+        env["wsgi.input"] = io.BytesIO(body)
+        with app.request_context(env):
+            return func()
+
+    return call
+
+
+def get_commit() -> str:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "wtph"], cwd=ROOT)
+    return commit + ("-dirty" if dirty else "")
+
+
+def get_meta() -> dict:
+    import flask
+    import pydantic
+    return {
+        "commit": get_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "flask": flask.__version__ if hasattr(flask, "__version__") else "",
+        "pydantic": pydantic.VERSION,
+    }
+
+
+def save_results(results: Dict[str, dict], path: Optional[str] = None) -> str:
+    meta = get_meta()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, "%s.json" % meta["commit"])
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_results(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_results(base: dict, current: Dict[str, dict], threshold: float = 0.1) -> List[dict]:
+    """按median比较两次的结果, 返回变慢超过threshold的benchmark"""
+    regressions = []
+    for name, result in sorted(current.items()):
+        old = base["results"].get(name)
+        if old is None:
+            continue
+        ratio = result["median_us"] / old["median_us"] if old["median_us"] else 1
+        line = "%-48s %12.2fus -> %12.2fus  %+7.1f%%" % (
+            name, old["median_us"], result["median_us"], (ratio - 1) * 100
+        )
+        if ratio > 1 + threshold:
+            line += "  REGRESSION"
+            regressions.append({"name": name, "ratio": ratio})
+        print(line)
+    return regressions
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/7 10:30
+"""预先加载应用后fork多个worker(与gunicorn --preload相同), 比较调用wtph.freeze()前后每个worker的私有内存
+
+python benchmarks/cow_memory.py                           # 依次运行plain与freeze, 输出对比
+python benchmarks/cow_memory.py --routes 2000 --workers 8 --lazy
+python benchmarks/cow_memory.py --mode freeze             # 只运行一种模式
+
+私有内存为/proc/self/smaps_rollup中的Private_Clean + Private_Dirty, 只支持linux.
+每个worker处理完所有路由的一次请求以及openapi和docs之后调用一次gc.collect(), 与长时间运行后的状态相近
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import List, Optional
+
+from flask import Flask
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wtph  # noqa: E402
+from wtph import Query, Body, Depends, setup_wtph  # noqa: E402
+
+
+class Address(BaseModel):
+    city: str
+    street: Optional[str] = None
+
+
+class User(BaseModel):
+    name: str
+    age: int
+    addresses: List[Address] = []
+
+
+def get_page(page: int = Query(1, ge=1), size: int = Query(20, le=100)):
+    return page, size
+
+
+def make_app(routes: int, lazy: bool) -> Flask:
+    app = Flask(__name__)
+    setup_wtph("flask", app=app, openapi_url="/openapi.json", docs_url="/docs", view_options={"lazy": lazy})
+    for i in range(routes):
+        # 每个路由使用不同的函数, 与真实应用相同, 每个视图生成自己的model
+        def list_users(keyword: Optional[str] = Query(None), page: tuple = Depends(get_page)):
+            return {"keyword": keyword, "page": page}
+
+        def create_users(users: List[User] = Body(...), dry_run: bool = Query(False)):
+            return {"count": len(users), "dry_run": dry_run}
+
+        list_users.__name__ = "list_users_%d" % i
+        create_users.__name__ = "create_users_%d" % i
+        app.get("/users/%d" % i)(list_users)
+        app.post("/users/%d" % i)(create_users)
+    return app
+
+
+def private_memory() -> int:
+    """当前进程私有的内存(字节)"""
+    size = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                size += int(line.split()[1]) * 1024
+    return size
+
+
+def serve(app: Flask, routes: int) -> dict:
+    import gc
+
+    start = private_memory()
+    client = app.test_client()
+    body = {"users": [{"name": "a", "age": 1, "addresses": [{"city": "x"}]}]}
+    for i in range(routes):
+        client.get("/users/%d?keyword=a&page=2" % i)
+        client.post("/users/%d" % i, json=body)
+    client.get("/openapi.json")
+    client.get("/docs")
+    gc.collect()
+    return {"start": start, "end": private_memory()}
+
+
+def run_mode(mode: str, routes: int, workers: int, lazy: bool) -> dict:
+    app = make_app(routes, lazy)
+    report = None
+    if mode == "freeze":
+        report = wtph.freeze()
+    parent = private_memory()
+    children = []
+    for _ in range(workers):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            with os.fdopen(w, "w") as f:
+                f.write(json.dumps(serve(app, routes)))
+            os._exit(0)
+        os.close(w)
+        children.append((pid, r))
+    results = []
+    for pid, r in children:
+        with os.fdopen(r) as f:
+            results.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    return {
+        "mode": mode,
+        "parent": parent,
+        "worker_start": sum(item["start"] for item in results) / len(results),
+        "worker_end": sum(item["end"] for item in results) / len(results),
+        "freeze": report,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--routes", type=int, default=500, help="GET与POST各注册的路由数量")
+    arg_parser.add_argument("--workers", type=int, default=4)
+    arg_parser.add_argument("--lazy", action="store_true", help="视图使用lazy模式, 第一次请求时才构建")
+    arg_parser.add_argument("--mode", choices=["plain", "freeze"], help="只运行一种模式并输出json")
+    args = arg_parser.parse_args()
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        sys.exit("/proc/self/smaps_rollup is not available, only linux is supported")
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.routes, args.workers, args.lazy)))
+        return
+
+    # freeze不能撤销, 每种模式在单独的进程中运行
+    for mode in ("plain", "freeze"):
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            "--mode", mode, "--routes", str(args.routes), "--workers", str(args.workers),
+        ]
+        if args.lazy:
+            command.append("--lazy")
+        result = json.loads(subprocess.check_output(command))
+        print("%-8s parent %8.1fMiB  worker private after fork %8.1fMiB  after requests %8.1fMiB" % (
+            mode,
+            result["parent"] / 1024 / 1024,
+            result["worker_start"] / 1024 / 1024,
+            result["worker_end"] / 1024 / 1024,
+        ))
+
+
+if __name__ == "__main__":
+    main()
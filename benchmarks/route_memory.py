@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/7 15:10
+"""典型签名下每个路由占用的内存(字节)
+
+python benchmarks/route_memory.py                  # 每种签名注册1000个路由
+python benchmarks/route_memory.py --routes 5000 --compiled
+
+total为注册路由前后tracemalloc的差值, 包括pydantic生成的model;
+wtph为View, ParserManager, Parser对象本身以及它们直接持有的容器, 不包括model与字段
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wtph import Query, Body, Header, Depends, setup_wtph  # noqa: E402
+from wtph.parsers.base import ParserManager, Parser  # noqa: E402
+from wtph.view import View  # noqa: E402
+
+_counter = [0]
+
+
+class Item(BaseModel):
+    name: str
+    price: float
+    tags: List[str] = []
+
+
+def get_page(page: int = Query(1, ge=1), size: int = Query(20, le=100)):
+    return page, size
+
+
+def make_query_endpoint():
+    def endpoint(keyword: Optional[str] = Query(None), ids: List[int] = Query([]), page: int = Query(1)):
+        return {}
+    return endpoint
+
+
+def make_body_endpoint():
+    def endpoint(item: Item = Body(...), dry_run: bool = Query(False), token: str = Header(...)):
+        return {}
+    return endpoint
+
+
+def make_depends_endpoint():
+    def endpoint(keyword: Optional[str] = Query(None), page: tuple = Depends(get_page)):
+        return {}
+    return endpoint
+
+
+SIGNATURES = {
+    "query": make_query_endpoint,
+    "body": make_body_endpoint,
+    "depends": make_depends_endpoint,
+}
+
+
+def shallow_size(obj, seen: set) -> int:
+    """对象本身, __dict__以及直接持有的list/tuple/dict/set(递归到容器中的容器)"""
+    if id(obj) in seen:
+        return 0
+    if isinstance(obj, (tuple, frozenset)) and not obj:
+        # 空的tuple与共享的空frozenset不属于某个路由
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            if isinstance(item, (list, tuple, dict, set, frozenset)):
+                size += shallow_size(item, seen)
+        return size
+    if isinstance(obj, dict):
+        for item in obj.values():
+            if isinstance(item, (list, tuple, dict, set, frozenset)):
+                size += shallow_size(item, seen)
+        return size
+    values = []
+    obj_dict = getattr(obj, "__dict__", None)
+    if obj_dict is not None:
+        size += sys.getsizeof(obj_dict)
+        values.extend(obj_dict.values())
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if name not in ("__dict__", "__weakref__"):
+                values.append(getattr(obj, name, None))
+    for value in values:
+        if isinstance(value, (list, tuple, dict, set, frozenset)):
+            size += shallow_size(value, seen)
+    return size
+
+
+def wtph_size(view: View) -> int:
+    seen = set()
+    size = shallow_size(view, seen)
+    managers = [view.parser_manager]
+    while managers:
+        manager: ParserManager = managers.pop()
+        if id(manager) in seen:
+            continue
+        size += shallow_size(manager, seen)
+        parser: Parser
+        for parser in manager._parsers:  # noqa
+            size += shallow_size(parser, seen)
+        managers.extend(manager.depend_parsers)
+    return size
+
+
+def measure(name: str, routes: int, compiled: bool) -> dict:
+    factory = SIGNATURES[name]
+    endpoints = [factory() for _ in range(routes)]
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    views = []
+    for endpoint in endpoints:
+        _counter[0] += 1
+        views.append(View(endpoint=endpoint, path="/%s/%d" % (name, _counter[0]), methods={"POST"}, compiled=compiled))
+    gc.collect()
+    total = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return {
+        "total": total / routes,
+        "wtph": sum(wtph_size(view) for view in views) / routes,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--routes", type=int, default=1000, help="每种签名注册的路由数量")
+    arg_parser.add_argument("--compiled", action="store_true", help="视图使用编译后的参数提取")
+    args = arg_parser.parse_args()
+
+    setup_wtph("flask")
+    for name in SIGNATURES:
+        result = measure(name, args.routes, args.compiled)
+        print("%-10s total %10.0f bytes/route   wtph objects %8.0f bytes/route" % (
+            name, result["total"], result["wtph"]
+        ))
+
+
+if __name__ == "__main__":
+    main()
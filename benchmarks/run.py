@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/28 21:20
+"""运行benchmark并保存为json, 可以与之前提交的结果比较
+
+python benchmarks/run.py                          # 结果保存到benchmarks/results/<commit>.json
+python benchmarks/run.py -k view.query            # 只运行名称包含view.query的benchmark
+python benchmarks/run.py --compare benchmarks/results/abc1234.json --fail-on-regression
+"""
+import argparse
+import sys
+
+import common
+from wtph import setup_wtph
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-k", "--filter", action="append", default=[], help="只运行名称包含该字符串的benchmark")
+    arg_parser.add_argument("-o", "--output", help="结果文件, 默认为benchmarks/results/<commit>.json")
+    arg_parser.add_argument("--min-time", type=float, default=0.1, help="自动调整次数时每轮的最少耗时(秒)")
+    arg_parser.add_argument("--repeat", type=int, help="覆盖每个benchmark的轮数")
+    arg_parser.add_argument("--compare", help="与之前的结果文件比较")
+    arg_parser.add_argument("--threshold", type=float, default=0.1, help="median变慢超过该比例时视为退化")
+    arg_parser.add_argument("--fail-on-regression", action="store_true")
+    args = arg_parser.parse_args()
+
+    setup_wtph("flask")
+    import bench_view  # noqa
+    import bench_openapi  # noqa
+    import bench_asgi  # noqa
+    import bench_codec  # noqa
+
+    results = {}
+    for bench in common.registry:
+        if args.filter and not any(k in bench.name for k in args.filter):
+            continue
+        result = results[bench.name] = bench.run(min_time=args.min_time, repeat=args.repeat)
+        print("%-48s %12.2fus  (median of %d x %d)" % (
+            bench.name, result["median_us"], result["repeat"], result["number"]
+        ))
+    path = common.save_results(results, args.output)
+    print("results written to %s" % path)
+
+    if args.compare:
+        regressions = common.compare_results(common.load_results(args.compare), results, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/8 18:40
+"""管理路由在参数解析之前检查admin_auth"""
+import pytest
+from flask import Flask
+
+from wtph import setup_wtph
+from wtph.config import config
+
+
+@pytest.fixture
+def client():
+    saved_config = dict(config.__dict__)
+    saved_add_url_rule = Flask.add_url_rule
+    app = Flask(__name__)
+    setup_wtph(
+        "flask",
+        app=app,
+        instrumentation=True,
+        profile_url="/_profile",
+        admin_auth=lambda request: request.headers.get("X-Admin") == "yes",
+    )
+    yield app.test_client()
+    Flask.add_url_rule = saved_add_url_rule
+    config.__dict__.clear()
+    config.__dict__.update(saved_config)
+
+
+def test_unauthorized_before_validation(client):
+    # every不合法, 未授权时仍然返回403而不是校验错误
+    assert client.get("/_profile?every=0").status_code == 403
+    assert client.get("/metrics").status_code == 403
+
+
+def test_authorized(client):
+    headers = {"X-Admin": "yes"}
+    assert client.get("/_profile", headers=headers).status_code == 200
+    assert client.get("/_profile?every=0", headers=headers).json[0]["loc"] == ["query", "every"]
+    assert client.get("/metrics", headers=headers).status_code == 200
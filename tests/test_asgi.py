@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/8 17:10
+"""ASGI模式下api()声明的视图与openapi的条件请求"""
+import asyncio
+import json
+
+import pytest
+
+from wtph import Query, api, setup_wtph
+from wtph.asgi import ASGIApp, ASGIView, accept_quality, etag_matches
+from wtph.config import config
+from wtph.exceptions import ConfigError
+from wtph.view import View
+
+
+@pytest.fixture
+def app():
+    saved = dict(config.__dict__)
+    app = ASGIApp()
+    setup_wtph("asgi", app=app)
+    yield app
+    config.__dict__.clear()
+    config.__dict__.update(saved)
+
+
+def call(app: ASGIApp, path: str, query: bytes = b"", headers=()):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": query,
+        "headers": [(key.encode(), value.encode()) for key, value in headers],
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+
+def test_api_uses_asgi_view(app):
+    @api(methods=["GET"])
+    def double(x: int = Query(...)):
+        return {"x": x * 2}
+
+    assert isinstance(double, ASGIView)
+    app.add_url_rule("/double", view_func=double, methods=["GET"])
+    status, _, body = call(app, "/double", b"x=2")
+    assert status == 200 and json.loads(body) == {"x": 4}
+    # 与flask模式相同, 校验错误默认以200返回错误列表
+    status, _, body = call(app, "/double", b"x=a")
+    assert status == 200 and json.loads(body)[0]["loc"] == ["query", "x"]
+
+
+def test_add_url_rule_rejects_flask_view(app):
+    def endpoint(x: int = Query(...)):
+        return {"x": x}
+
+    view = View(endpoint=endpoint, path="/flask", methods={"GET"})
+    with pytest.raises(ConfigError):
+        app.add_url_rule("/flask", view_func=view, methods=["GET"])
+
+
+@pytest.mark.parametrize("header, quality", [
+    ("", 0),
+    ("gzip", 1),
+    ("gzip;q=0", 0),
+    ("deflate, GZIP;q=0.3", 0.3),
+    ("*;q=0.5", 0.5),
+    ("*, gzip;q=0", 0),
+    ("identity", 0),
+])
+def test_accept_quality(header, quality):
+    assert accept_quality(header, "gzip") == quality
+
+
+def test_openapi_conditional_request(app):
+    status, headers, _ = call(app, "/openapi.json", headers=[("accept-encoding", "gzip;q=0")])
+    assert status == 200 and b"content-encoding" not in headers
+    etag = headers[b"etag"].decode()
+    for if_none_match in (etag, "W/" + etag, '"other", ' + etag, "*"):
+        status, _, _ = call(app, "/openapi.json", headers=[("if-none-match", if_none_match)])
+        assert status == 304, if_none_match
+    assert not etag_matches('"other"', etag)
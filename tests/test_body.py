@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/8 15:40
+"""视图与依赖中的Body字段共用一次请求体的解码(流式解析时共用一次扫描)"""
+from flask import Flask
+
+from wtph import Body, Depends
+from wtph.asgi import Request, _request_var
+from wtph.codec import StdlibJSONCodec
+from wtph.config import config
+from wtph.parsers.asgi import asgi_parser_manager_factory
+from wtph.parsers.flask import flask_parser_manager_factory, flask_stream_parser_manager_factory
+from wtph.utils import generate_model_from_callable
+
+
+class CountingCodec(StdlibJSONCodec):
+    def __init__(self):
+        super().__init__()
+        self.loads_calls = 0
+
+    def loads(self, data):
+        self.loads_calls += 1
+        return super().loads(data)
+
+
+def get_a(a: int = Body(...)):
+    return a
+
+
+def get_b(b: int = Body(...)):
+    return b
+
+
+def endpoint(c: int = Body(...), a: int = Depends(get_a), b: int = Depends(get_b)):
+    return {}
+
+
+def make_manager(factory):
+    model, depends = generate_model_from_callable(endpoint, intern=False)
+    return factory(model, depends)
+
+
+def test_body_decoded_once(monkeypatch):
+    codec = CountingCodec()
+    monkeypatch.setattr(config, "codec", codec)
+    manager = make_manager(flask_parser_manager_factory)
+    with Flask(__name__).test_request_context("/", method="POST", json={"a": 1, "b": 2, "c": 3}):
+        data, errors = manager.parse(__depend_cache__={})
+    assert errors == []
+    assert data == {"a": 1, "b": 2, "c": 3}
+    assert codec.loads_calls == 1
+
+
+def test_stream_body_in_dependency():
+    manager = make_manager(flask_stream_parser_manager_factory)
+    with Flask(__name__).test_request_context("/", method="POST", json={"a": 1, "b": 2, "c": 3, "d": 4}):
+        data, errors = manager.parse(__depend_cache__={})
+    assert errors == []
+    assert data == {"a": 1, "b": 2, "c": 3}
+
+
+def test_asgi_body_decoded_once(monkeypatch):
+    codec = CountingCodec()
+    monkeypatch.setattr(config, "codec", codec)
+    manager = make_manager(asgi_parser_manager_factory)
+    request = Request(
+        {"type": "http", "method": "POST", "path": "/", "query_string": b"",
+         "headers": [(b"content-type", b"application/json")]},
+        receive=None,
+    )
+    request._body = b'{"a": 1, "b": 2, "c": 3}'  # noqa
+    token = _request_var.set(request)
+    try:
+        data, errors = manager.parse(__depend_cache__={})
+    finally:
+        _request_var.reset(token)
+    assert errors == []
+    assert data == {"a": 1, "b": 2, "c": 3}
+    assert codec.loads_calls == 1
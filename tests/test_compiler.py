@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/8 10:20
+"""编译后的提取函数与解释执行的parse对各种请求体返回相同的结果"""
+from typing import List
+
+import pytest
+from flask import Flask
+from pydantic import BaseModel
+
+from wtph import Query, Body
+from wtph.params import Param
+from wtph.asgi import Request, _request_var
+from wtph.parsers.asgi import asgi_parser_manager_factory
+from wtph.parsers.base import ParserManagerFactory, Parser
+from wtph.parsers.compiler import compile_extractor
+from wtph.parsers.flask import flask_parser_manager_factory
+from wtph.utils import generate_model_from_callable, SUPPORT_PARAMS
+
+BODIES = [
+    None,
+    b"",
+    b"null",
+    b"1",
+    b'"text"',
+    b"[1, 2]",
+    b"[]",
+    b"{}",
+    b'{"a": 1}',
+    b'{"a": 1, "b": "x", "extra": true}',
+]
+
+
+class Item(BaseModel):
+    name: str
+
+
+def endpoint(q: int = Query(1), ids: List[int] = Query([]), a: int = Body(...), b: str = Body("x"), item: Item = Body(None)):
+    return {}
+
+
+def make_manager(factory: ParserManagerFactory):
+    model, depends = generate_model_from_callable(endpoint, intern=False)
+    return factory(model, depends)
+
+
+def extract_both(manager):
+    compiled = compile_extractor(manager._parsers)  # noqa
+    return manager.extract(), compiled()
+
+
+@pytest.mark.parametrize("body", BODIES)
+def test_flask_extractors_agree(body):
+    app = Flask(__name__)
+    manager = make_manager(flask_parser_manager_factory)
+    kwargs = {"query_string": "q=2&ids=1&ids=2"}
+    if body is not None:
+        kwargs.update(data=body, content_type="application/json")
+    with app.test_request_context("/", method="POST", **kwargs):
+        interpreted, compiled = extract_both(manager)
+    assert interpreted == compiled
+
+
+@pytest.mark.parametrize("body", BODIES)
+def test_asgi_extractors_agree(body):
+    manager = make_manager(asgi_parser_manager_factory)
+    headers = [] if body is None else [(b"content-type", b"application/json")]
+    request = Request(
+        {"type": "http", "method": "POST", "path": "/", "query_string": b"q=2&ids=1&ids=2", "headers": headers},
+        receive=None,
+    )
+    request._body = body or b""  # noqa
+    token = _request_var.set(request)
+    try:
+        interpreted, compiled = extract_both(manager)
+    finally:
+        _request_var.reset(token)
+    assert interpreted == compiled
+
+
+class Env(Param):
+    pass
+
+
+class EnvParser(Parser):
+    """只实现了parse的自定义parser"""
+    param_class = Env
+
+    def parse(self, *args, **kwargs):
+        return {field.alias: "from-env" for field in self.fields}
+
+
+def test_compiled_falls_back_to_parse(monkeypatch):
+    monkeypatch.setattr("wtph.utils.SUPPORT_PARAMS", SUPPORT_PARAMS | {Env})
+    factory = ParserManagerFactory(dict(flask_parser_manager_factory.parser_classes))
+    factory.register_parser(EnvParser)
+
+    def env_endpoint(q: int = Query(1), home: str = Env(...)):
+        return {}
+
+    model, depends = generate_model_from_callable(env_endpoint, intern=False)
+    manager = factory(model, depends)
+    with Flask(__name__).test_request_context("/?q=3"):
+        interpreted, compiled = extract_both(manager)
+    assert interpreted == compiled == {"q": "3", "home": "from-env"}
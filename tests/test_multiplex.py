@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/8 16:30
+"""批量请求中的子请求互相隔离"""
+import json
+
+from flask import Flask, g, request
+
+from wtph.codec import StdlibJSONCodec
+from wtph.multiplex import SubRequest, dispatch_batch
+
+
+def test_sub_requests_do_not_share_g():
+    app = Flask(__name__)
+    teardowns = []
+
+    @app.before_request
+    def load_user():
+        user = request.headers.get("X-User")
+        if user is not None:
+            g.user = user
+
+    @app.teardown_appcontext
+    def teardown(exc):
+        teardowns.append(g.get("user"))
+
+    @app.get("/me")
+    def me():
+        return {"user": g.get("user")}
+
+    sub_requests = [
+        SubRequest(path="/me", headers={"X-User": "alice"}),
+        SubRequest(path="/me"),
+        SubRequest(path="/me", headers={"X-User": "bob"}),
+    ]
+    with app.test_request_context("/batch", method="POST"):
+        g.user = "outer"
+        body = dispatch_batch(app, sub_requests, StdlibJSONCodec())
+        assert g.user == "outer"
+    users = [item["body"]["user"] for item in json.loads(body)["responses"]]
+    assert users == ["alice", None, "bob"]
+    assert teardowns[:3] == ["alice", None, "bob"]
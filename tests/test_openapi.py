@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/8 18:00
+"""修改get_openapi返回的文档不影响缓存"""
+from typing import List
+
+from pydantic import BaseModel
+
+from wtph import Query, Body, get_openapi
+from wtph.config import config
+from wtph.openapi import OpenapiBuilder
+from wtph.parsers.flask import flask_parser_manager_factory
+from wtph.view import View
+
+
+class Item(BaseModel):
+    name: str
+    tags: List[str] = []
+
+
+def endpoint(page: int = Query(1), item: Item = Body(...)):
+    return {}
+
+
+def test_document_is_not_shared_with_cache(monkeypatch):
+    monkeypatch.setattr(config, "parser_factory", flask_parser_manager_factory)
+    views = [View(endpoint=endpoint, path="/items", methods={"GET", "POST"}, response_model=Item)]
+    builder = OpenapiBuilder()
+    first = get_openapi(title="t", version="1", views=views, builder=builder)
+    expected = get_openapi(title="t", version="1", views=views, builder=builder)
+
+    operations = first["paths"]["/items"]
+    assert operations["get"]["parameters"] is not operations["post"]["parameters"]
+    assert operations["get"]["responses"] is not operations["post"]["responses"]
+    for operation in operations.values():
+        operation["security"] = [{"token": []}]
+        operation["parameters"].append({"name": "extra", "in": "query"})
+        operation["responses"]["401"] = {"description": "Unauthorized"}
+    first["components"]["schemas"]["Item"]["properties"].clear()
+
+    assert get_openapi(title="t", version="1", views=views, builder=builder) == expected
@@ -2,12 +2,16 @@
 # @Time: 2021/8/13 21:15
 import typing as t
 
-from .params import Query, Form, Body, Depends
+from .params import Query, Path, Header, Cookie, Form, Body, BatchBody, File, Depends
+from .upload import UploadFile
+from .codec import JSONCodec, get_codec
+from .instrument import Instrumentation
 from .parsers.base import ParserManagerFactory
 from .utils import get_name, generate_model_from_callable
 from .openapi import get_openapi
 from .openapi.docs import get_swagger_ui_html
-from .view import View, api
+from .view import View, AsyncView, api, warm_up, get_build_report, freeze
+from .profiler import start_profiling, stop_profiling
 
 
 def setup_wtph(
@@ -16,8 +20,23 @@ def setup_wtph(
         docs_url: t.Optional[str] = "/docs",
         openapi_extra: t.Optional[dict] = None,
         swagger_extra: t.Optional[dict] = None,
+        view_options: t.Optional[dict] = None,
+        openapi_file: t.Optional[str] = None,
+        codec: t.Union[str, JSONCodec, None] = "auto",
+        instrumentation: t.Union[bool, Instrumentation, None] = None,
+        metrics_url: t.Optional[str] = "/metrics",
+        profile_url: t.Optional[str] = None,
+        profile_dir: t.Optional[str] = None,
+        batch_url: t.Optional[str] = None,
+        batch_max_requests: int = 50,
+        batch_share_dependencies: bool = False,
+        admin_auth: t.Optional[t.Callable[[t.Any], bool]] = None,
         app=None
 ):  # noqa
+    """
+    :param admin_auth: 管理路由(metrics_url, profile_url)的鉴权函数, 接受当前请求, 返回False时响应403;
+        不根据来源地址判断, 反向代理之后所有请求都来自本机. 没有设置时不注册metrics_url, 不能开启profile_url
+    """
     from .config import config
     config.setup(
         mode=mode,
@@ -25,5 +44,16 @@ def setup_wtph(
         docs_url=docs_url,
         openapi_extra=openapi_extra,
         swagger_extra=swagger_extra,
+        view_options=view_options,
+        openapi_file=openapi_file,
+        codec=codec,
+        instrumentation=instrumentation,
+        metrics_url=metrics_url,
+        profile_url=profile_url,
+        profile_dir=profile_dir,
+        batch_url=batch_url,
+        batch_max_requests=batch_max_requests,
+        batch_share_dependencies=batch_share_dependencies,
+        admin_auth=admin_auth,
         app=app,
     )
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/18 21:32
+import argparse
+import sys
+from typing import List, Optional
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m wtph")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    openapi = subparsers.add_parser("openapi", help="export the openapi document of an app")
+    openapi.add_argument("app", help="import string of the app, e.g. 'module:app'")
+    openapi.add_argument("-o", "--output", default="openapi.json", help="output file (default: openapi.json)")
+    openapi.add_argument("--minify", action="store_true", help="write minified json")
+    openapi.add_argument("--gzip", action="store_true", help="write gzip compressed json")
+    openapi.add_argument("--title", default=None, help="override the document title")
+    openapi.add_argument("--version", default=None, help="override the document version")
+
+    args = parser.parse_args(argv)
+    if args.command == "openapi":
+        from .openapi.export import export_openapi
+        path = export_openapi(
+            args.app,
+            args.output,
+            minify=args.minify,
+            compress=args.gzip,
+            title=args.title,
+            version=args.version,
+        )
+        print("openapi document written to %s" % path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
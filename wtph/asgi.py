@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/6 15:40
+import logging
+import re
+import typing as t
+from contextvars import ContextVar
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+
+from .config import Config, config
+from .exceptions import ConfigError
+from .instrument import Instrumentation, Recorder
+from .view import AsyncView, View
+
+logger = logging.getLogger("wtph.asgi")
+
+_missing = object()
+
+
+class MultiValueDict(dict):
+    """每个key保存第一个值, getlist返回所有值, 读取接口与werkzeug的MultiDict相同"""
+
+    def __init__(self, items: t.Iterable[t.Tuple[str, str]] = ()):
+        super().__init__()
+        lists: t.Dict[str, t.List[str]] = {}
+        for key, value in items:
+            values = lists.get(key)
+            if values is None:
+                lists[key] = [value]
+                dict.__setitem__(self, key, value)
+            else:
+                values.append(value)
+        self._lists = lists
+
+    def getlist(self, key: str) -> t.List[str]:
+        return list(self._lists.get(key, ()))
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, detail: t.Optional[str] = None, headers: t.Optional[dict] = None):
+        self.status = status
+        self.detail = detail or HTTPStatus(status).phrase
+        self.headers = headers
+        super().__init__(status, self.detail)
+
+    def get_response(self) -> "Response":
+        return Response(config.codec.dumps({"detail": self.detail}), self.status, self.headers, "application/json")
+
+
+def abort(status: int, detail: t.Optional[str] = None):
+    raise HTTPError(status, detail)
+
+
+def accept_quality(header: str, value: str) -> float:
+    """Accept-*头中value的quality, 具体的值优先于*, 与werkzeug的Accept.quality相同, 不接受时为0"""
+    wildcard = 0.0
+    for item in header.split(","):
+        token, _, params = item.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, param_value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = min(max(float(param_value.strip()), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        if token == value:
+            return quality
+        if token == "*":
+            wildcard = quality
+    return wildcard
+
+
+def etag_matches(header: t.Optional[str], etag: str) -> bool:
+    """If-None-Match是否匹配带引号的etag, 支持*与多个etag, 与werkzeug相同使用弱比较"""
+    if not header:
+        return False
+    for item in header.split(","):
+        item = item.strip()
+        if item == "*":
+            return True
+        if item.startswith("W/"):
+            item = item[2:]
+        if item == etag:
+            return True
+    return False
+
+
+class Request(object):
+    """一次ASGI的http请求, headers/query/cookies/form在第一次访问时解析并缓存"""
+
+    def __init__(self, scope: dict, receive: t.Callable):
+        self.scope = scope
+        self.method: str = scope["method"]
+        self.path: str = scope["path"]
+        self._receive = receive
+        self._body: t.Optional[bytes] = None
+        self._headers: t.Optional[t.Dict[str, str]] = None
+        self._query: t.Optional[MultiValueDict] = None
+        self._cookies: t.Optional[t.Dict[str, str]] = None
+        self._form: t.Optional[MultiValueDict] = None
+        self._json: t.Any = _missing
+
+    @property
+    def headers(self) -> t.Dict[str, str]:
+        """小写的header名称 -> 值, 同名的多个header以逗号连接"""
+        if self._headers is None:
+            headers = {}
+            for key, value in self.scope["headers"]:
+                key = key.decode("latin-1")
+                value = value.decode("latin-1")
+                if key in headers:
+                    value = headers[key] + ("; " if key == "cookie" else ", ") + value
+                headers[key] = value
+            self._headers = headers
+        return self._headers
+
+    @property
+    def query_params(self) -> MultiValueDict:
+        if self._query is None:
+            self._query = MultiValueDict(parse_qsl(self.scope["query_string"].decode("latin-1"), keep_blank_values=True))
+        return self._query
+
+    @property
+    def cookies(self) -> t.Dict[str, str]:
+        if self._cookies is None:
+            cookies = {}
+            for item in self.headers.get("cookie", "").split(";"):
+                key, sep, value = item.partition("=")
+                key = key.strip()
+                if sep and key and key not in cookies:
+                    cookies[key] = value.strip().strip('"')
+            self._cookies = cookies
+        return self._cookies
+
+    @property
+    def mimetype(self) -> str:
+        return self.headers.get("content-type", "").partition(";")[0].strip().lower()
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            raise RuntimeError("request body has not been loaded")
+        return self._body
+
+    @property
+    def json(self) -> t.Any:
+        """用config.codec解码的请求体并缓存, 不是json或者请求体为空时为None, 解码失败返回400"""
+        if self._json is _missing:
+            rj = None
+            mimetype = self.mimetype
+            if (mimetype == "application/json" or mimetype.endswith("+json")) and self.body:
+                try:
+                    rj = config.codec.loads(self.body)
+                except ValueError as e:
+                    raise HTTPError(400, "failed to decode json body: %s" % e)
+            self._json = rj
+        return self._json
+
+    @property
+    def form(self) -> MultiValueDict:
+        """application/x-www-form-urlencoded的请求体, 其他类型为空"""
+        if self._form is None:
+            if self.mimetype == "application/x-www-form-urlencoded":
+                self._form = MultiValueDict(parse_qsl(self.body.decode("utf-8"), keep_blank_values=True))
+            else:
+                self._form = MultiValueDict()
+        return self._form
+
+    async def load_body(self, max_size: t.Optional[int] = None) -> bytes:
+        """读取完整的请求体, 超过max_size时返回413, Content-Length超过时不读取"""
+        if self._body is not None:
+            return self._body
+        content_length = self.headers.get("content-length")
+        if max_size is not None and content_length is not None and content_length.isdigit():
+            if int(content_length) > max_size:
+                raise HTTPError(413)
+        chunks = []
+        size = 0
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "client disconnected")
+            chunk = message.get("body", b"")
+            if chunk:
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise HTTPError(413)
+                chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        self._body = b"".join(chunks)
+        return self._body
+
+
+_request_var: ContextVar[t.Optional[Request]] = ContextVar("wtph_asgi_request", default=None)
+
+
+def get_request() -> Request:
+    """当前正在处理的请求, 只能在ASGIApp分发的视图与依赖中调用"""
+    request = _request_var.get()
+    if request is None:
+        raise RuntimeError("working outside of an asgi request")
+    return request
+
+
+class Response(object):
+    def __init__(
+            self,
+            body: t.Union[bytes, str] = b"",
+            status: int = 200,
+            headers: t.Optional[dict] = None,
+            media_type: t.Optional[str] = None,
+    ):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.body = body
+        self.status = status
+        self.headers: t.Dict[str, str] = dict(headers or {})
+        if media_type is not None:
+            self.headers.setdefault("Content-Type", media_type)
+
+    async def __call__(self, send: t.Callable, head: bool = False):
+        headers = [(b"content-length", str(len(self.body)).encode("latin-1"))]
+        headers.extend(
+            (key.lower().encode("latin-1"), str(value).encode("latin-1")) for key, value in self.headers.items()
+        )
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if head else self.body})
+
+
+def to_response(rv: t.Any) -> Response:
+    """与flask相同, 视图可以返回Response, dict/list(json), str/bytes(html)以及(body, status, headers)"""
+    if isinstance(rv, Response):
+        return rv
+    status = headers = None
+    if isinstance(rv, tuple):
+        if len(rv) == 3:
+            rv, status, headers = rv
+        elif len(rv) == 2:
+            rv, extra = rv
+            if isinstance(extra, (dict, list)):
+                headers = extra
+            else:
+                status = extra
+        else:
+            raise TypeError("view returned a tuple with %d items, expected 2 or 3" % len(rv))
+    if isinstance(rv, Response):
+        response = rv
+    elif isinstance(rv, (dict, list)):
+        response = Response(config.codec.dumps(rv), media_type="application/json")
+    elif isinstance(rv, (str, bytes)):
+        response = Response(rv, media_type="text/html; charset=utf-8")
+    else:
+        raise TypeError("view returned an invalid response type: %s" % type(rv).__name__)
+    if status is not None:
+        response.status = int(status)
+    if headers:
+        response.headers.update(headers)
+    return response
+
+
+class ASGIView(AsyncView):
+    """ASGI模式下的视图, 同步的视图函数与依赖在线程池中执行, 不会阻塞其他连接"""
+    __slots__ = ()
+
+    def make_response(self, rv):
+        if isinstance(rv, Response):
+            return rv
+        extra = ()
+        if isinstance(rv, tuple):
+            rv, extra = rv[0], rv[1:]
+        response = Response(self._response_serializer.serialize(rv), media_type="application/json")
+        if extra:
+            return to_response((response, *extra))
+        return response
+
+    def finish_instrumented(self, instrumentation: Instrumentation, recorder: Recorder, rv):
+        instrumentation.finish(self, recorder)
+        if instrumentation.server_timing:
+            rv = to_response(rv)
+            rv.headers["Server-Timing"] = recorder.server_timing()
+        return rv
+
+    def default_validate_error_handler(self, errors):  # noqa
+        return Response(self.error_template.render(errors), media_type="application/json")
+
+    validate_error_handler = default_validate_error_handler
+
+
+# 与werkzeug的默认converter相同的匹配规则
+_converters: t.Dict[str, t.Tuple[str, t.Callable[[str], t.Any]]] = {
+    "default": (r"[^/]+", str),
+    "string": (r"[^/]+", str),
+    "int": (r"\d+", int),
+    "float": (r"\d+\.\d+", float),
+    "path": (r"[^/].*?", str),
+}
+_rule_re = re.compile(r"<(?:(?P<converter>[a-zA-Z_][a-zA-Z0-9_]*):)?(?P<name>[a-zA-Z_][a-zA-Z0-9_]*)>")
+
+
+class Route(object):
+    def __init__(self, rule: str, view: View, methods: t.Set[str]):
+        self.rule = rule
+        self.view = view
+        self.methods = methods
+        self.converters: t.Dict[str, t.Callable[[str], t.Any]] = {}
+        pattern = []
+        end = 0
+        for match in _rule_re.finditer(rule):
+            converter = match.group("converter") or "default"
+            if converter not in _converters:
+                raise ConfigError("rule: %s, unsupported converter: %s" % (rule, converter))
+            regex, convert = _converters[converter]
+            pattern.append(re.escape(rule[end:match.start()]))
+            pattern.append("(?P<%s>%s)" % (match.group("name"), regex))
+            self.converters[match.group("name")] = convert
+            end = match.end()
+        pattern.append(re.escape(rule[end:]))
+        self.is_static = not self.converters
+        self.regex = re.compile("^%s$" % "".join(pattern))
+
+    def match(self, path: str) -> t.Optional[dict]:
+        match = self.regex.match(path)
+        if match is None:
+            return None
+        try:
+            return {name: self.converters[name](value) for name, value in match.groupdict().items()}
+        except ValueError:
+            return None
+
+
+class ASGIApp(object):
+    """最小的ASGI应用, 按注册顺序匹配路由, 没有变量的路由通过dict直接查找
+
+    路由规则与flask相同(支持default/string/int/float/path), 注册的视图函数都包装为config.async_view_class
+
+    :param max_body_size: 请求体的最大字节数, 超过时返回413
+    """
+
+    def __init__(self, *, max_body_size: t.Optional[int] = 10 * 1024 * 1024):
+        self.max_body_size = max_body_size
+        self.routes: t.List[Route] = []
+        self._static_routes: t.Dict[str, t.List[Route]] = {}
+        self._dynamic_routes: t.List[Route] = []
+        self.startup_handlers: t.List[t.Callable] = []
+        self.shutdown_handlers: t.List[t.Callable] = []
+
+    def add_url_rule(
+            self,
+            rule: str,
+            endpoint: t.Optional[str] = None,
+            view_func: t.Optional[t.Callable] = None,
+            methods: t.Optional[t.Iterable[str]] = None,
+            view_config: t.Optional[dict] = None,
+    ):
+        methods = {method.upper() for method in (methods or ("GET",))}
+        if isinstance(view_func, View) and not isinstance(view_func, ASGIView):
+            # flask模式的View在请求中使用flask的上下文, 返回值也不能被await
+            raise ConfigError("view: %s must be an instance of ASGIView, got %s" % (
+                view_func.name, type(view_func).__name__
+            ))
+        if not isinstance(view_func, View):
+            view_config = {**config.view_options, **(view_config or {})}
+            if endpoint is not None:
+                view_config.setdefault("name", endpoint)
+            view_func = config.async_view_class(endpoint=view_func, path=rule, methods=methods, **view_config)
+        if "GET" in methods:
+            methods.add("HEAD")
+        route = Route(rule, view_func, methods)
+        self.routes.append(route)
+        if route.is_static:
+            self._static_routes.setdefault(rule, []).append(route)
+        else:
+            self._dynamic_routes.append(route)
+        return view_func
+
+    def route(self, rule: str, methods: t.Optional[t.Iterable[str]] = None, **options):
+        def decorator(f):
+            self.add_url_rule(rule, view_func=f, methods=methods, **options)
+            return f
+
+        return decorator
+
+    def get(self, rule: str, **options):
+        return self.route(rule, methods=["GET"], **options)
+
+    def post(self, rule: str, **options):
+        return self.route(rule, methods=["POST"], **options)
+
+    def put(self, rule: str, **options):
+        return self.route(rule, methods=["PUT"], **options)
+
+    def patch(self, rule: str, **options):
+        return self.route(rule, methods=["PATCH"], **options)
+
+    def delete(self, rule: str, **options):
+        return self.route(rule, methods=["DELETE"], **options)
+
+    def on_startup(self, f: t.Callable) -> t.Callable:
+        self.startup_handlers.append(f)
+        return f
+
+    def on_shutdown(self, f: t.Callable) -> t.Callable:
+        self.shutdown_handlers.append(f)
+        return f
+
+    def match(self, path: str, method: str) -> t.Tuple[Route, dict]:
+        allowed = False
+        for route in self._static_routes.get(path, ()):
+            if method in route.methods:
+                return route, {}
+            allowed = True
+        for route in self._dynamic_routes:
+            path_params = route.match(path)
+            if path_params is None:
+                continue
+            if method in route.methods:
+                return route, path_params
+            allowed = True
+        raise HTTPError(405 if allowed else 404)
+
+    async def __call__(self, scope: dict, receive: t.Callable, send: t.Callable):
+        scope_type = scope["type"]
+        if scope_type == "http":
+            await self.handle_http(scope, receive, send)
+        elif scope_type == "lifespan":
+            await self.handle_lifespan(receive, send)
+        elif scope_type == "websocket":
+            await send({"type": "websocket.close", "code": 1000})
+
+    async def handle_http(self, scope: dict, receive: t.Callable, send: t.Callable):
+        request = Request(scope, receive)
+        token = _request_var.set(request)
+        try:
+            try:
+                route, path_params = self.match(request.path, request.method)
+                # 参数解析是同步的, 请求体在分发之前读取
+                await request.load_body(self.max_body_size)
+                response = to_response(await route.view(**path_params))
+            except HTTPError as e:
+                response = e.get_response()
+            except Exception:  # noqa
+                logger.exception("Exception on %s [%s]", request.path, request.method)
+                response = HTTPError(500).get_response()
+            await response(send, head=request.method == "HEAD")
+        finally:
+            _request_var.reset(token)
+
+    async def handle_lifespan(self, receive: t.Callable, send: t.Callable):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                handlers, event = self.startup_handlers, "lifespan.startup"
+            elif message["type"] == "lifespan.shutdown":
+                handlers, event = self.shutdown_handlers, "lifespan.shutdown"
+            else:
+                continue
+            try:
+                for handler in handlers:
+                    rv = handler()
+                    if hasattr(rv, "__await__"):
+                        await rv
+            except Exception as e:  # noqa
+                await send({"type": event + ".failed", "message": str(e)})
+                return
+            await send({"type": event + ".complete"})
+            if event == "lifespan.shutdown":
+                return
+
+
+def asgi_inject(
+        cfg: Config,
+        openapi_url: t.Optional[str] = "/openapi.json",
+        docs_url: t.Optional[str] = "/docs",
+        openapi_extra: t.Optional[dict] = None,
+        swagger_extra: t.Optional[dict] = None,
+        openapi_file: t.Optional[str] = None,
+        metrics_url: t.Optional[str] = "/metrics",
+        profile_url: t.Optional[str] = None,
+        profile_dir: t.Optional[str] = None,  # noqa
+        batch_url: t.Optional[str] = None,
+        batch_max_requests: int = 50,  # noqa
+        batch_share_dependencies: bool = False,  # noqa
+        admin_auth: t.Optional[t.Callable[[t.Any], bool]] = None,
+):
+    from .openapi.docs import get_swagger_ui_html
+    from .openapi.document import OpenapiDocument
+
+    if profile_url or batch_url:
+        raise ConfigError("profile_url and batch_url are only supported in flask mode")
+
+    openapi_extra = openapi_extra or {}
+    openapi_extra.setdefault('title', 'asgi')
+    openapi_extra.setdefault('version', '0.1')
+    cfg.openapi_extra = openapi_extra
+
+    app: t.Optional[ASGIApp] = cfg.app
+    if app is None:
+        return
+    if not isinstance(app, ASGIApp):
+        raise ConfigError("asgi mode requires app to be an instance of wtph.asgi.ASGIApp")
+
+    if openapi_url:
+        openapi_document = OpenapiDocument(openapi_extra, openapi_file=openapi_file)
+        cfg.openapi_document = openapi_document
+
+        @app.get(openapi_url, view_config={"include_in_schema": False})
+        async def get_openapi_json():
+            request = get_request()
+            document = openapi_document.get()
+            gzip_encoding = accept_quality(request.headers.get("accept-encoding", ""), "gzip") > 0
+            etag = '"%s"' % document.get_etag(gzip_encoding)
+            headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache", "ETag": etag}
+            if gzip_encoding:
+                headers["Content-Encoding"] = "gzip"
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return Response(b"", 304, headers)
+            return Response(document.get_body(gzip_encoding), headers=headers, media_type="application/json")
+
+    if openapi_url and docs_url:
+        swagger_extra = swagger_extra or {}
+        swagger_extra.setdefault("title", "asgi")
+
+        docs_html = get_swagger_ui_html(openapi_url, **swagger_extra)
+
+        @app.get(docs_url, view_config={"include_in_schema": False})
+        async def get_docs():
+            return docs_html
+
+    instrumentation = cfg.instrumentation
+    if metrics_url and instrumentation is not None and admin_auth is None:
+        logger.warning("metrics_url: %s is not registered, it requires admin_auth", metrics_url)
+    elif metrics_url and instrumentation is not None:
+        @app.get(metrics_url, view_config={"include_in_schema": False, "instrument": False})
+        async def get_metrics():
+            if not admin_auth(get_request()):
+                abort(403)
+            return Response(instrumentation.render_prometheus(), media_type="text/plain; version=0.0.4")
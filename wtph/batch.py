@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/2 20:18
+from typing import Any, Callable, List, Optional, Tuple, Type, get_origin
+
+from pydantic import BaseModel, Extra, validate_model
+from pydantic.error_wrappers import ErrorWrapper, flatten_errors
+from pydantic.errors import DictError, ListError, MissingError
+from pydantic.fields import ModelField, SHAPE_LIST, SHAPE_SEQUENCE, SHAPE_SINGLETON
+from pydantic.utils import lenient_issubclass
+
+from .params import BatchBody
+
+_missing = object()
+
+
+def _contains_model(field: ModelField) -> bool:
+    if lenient_issubclass(field.type_, BaseModel):
+        return True
+    return any(_contains_model(sub_field) for sub_field in field.sub_fields or ())
+
+
+def _to_dict(value: Any) -> Any:
+    """与BaseModel.dict()相同, 把校验结果中的model转换为dict"""
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, dict):
+        return {k: _to_dict(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return value.__class__(_to_dict(v) for v in value)
+    return value
+
+
+def get_fast_list_type(field: ModelField, config) -> Optional[type]:
+    """List[int]/List[str]等字段的元素类型, 列表中每个值的类型都完全相同时可以跳过pydantic校验"""
+    if (
+            field.shape != SHAPE_LIST or get_origin(field.outer_type_) is not list or
+            not field.sub_fields or len(field.sub_fields) != 1 or
+            field.class_validators or field.pre_validators or field.post_validators
+    ):
+        return None
+    return get_fast_type(field.sub_fields[0], config)
+
+
+def get_fast_type(field: ModelField, config) -> Optional[type]:
+    """值的类型与声明的类型完全相同时可以跳过pydantic校验的字段, 返回对应的类型"""
+    if (
+            field.shape != SHAPE_SINGLETON or field.sub_fields or
+            field.class_validators or field.pre_validators or field.post_validators
+    ):
+        return None
+    type_ = field.outer_type_
+    if type_ is int or type_ is bool:
+        return type_
+    if type_ is float and getattr(config, "allow_inf_nan", True):
+        return type_
+    if type_ is str and not (
+            config.anystr_strip_whitespace or config.anystr_lower or getattr(config, "anystr_upper", False) or
+            config.min_anystr_length or config.max_anystr_length
+    ):
+        return type_
+    return None
+
+
+class _Column(object):
+    """item model中的一个字段, 校验相关的信息只在构建时计算一次"""
+
+    def __init__(self, name: str, field: ModelField, model: Type[BaseModel], fast_validate: bool):
+        config = model.__config__
+        self.name = name
+        self.alias = field.alias
+        self.field = field
+        self.model = model
+        self.fast_type = get_fast_type(field, config)
+        self.fast_list_type = get_fast_list_type(field, config)
+        self.use_default = not (config.validate_all or field.validate_always)
+        self.convert: Optional[Callable] = None if fast_validate or not _contains_model(field) else _to_dict
+
+    def validate(self, value: Any, loc: tuple):
+        """返回(value, error), error为None表示校验通过"""
+        field = self.field
+        if value is _missing:
+            if field.required:
+                return None, ErrorWrapper(MissingError(), loc=loc)
+            value = field.get_default()
+            if self.use_default:
+                return value, None
+        item_type = self.fast_list_type
+        if item_type is not None and type(value) is list and all(type(v) is item_type for v in value):
+            return value, None
+        value, error = field.validate(value, {}, loc=loc, cls=self.model)
+        if error is not None:
+            return None, error
+        if self.convert is not None:
+            value = self.convert(value)
+        return value, None
+
+
+class BatchValidator(object):
+    """按列批量校验List[Model]类型的字段
+
+    每一批(chunk_size个条目)中逐列校验, 值的类型与声明的int/float/str/bool完全相同时直接使用;
+    不创建model实例也不经过.dict()的拷贝. model有validator, root validator或者extra不是ignore时,
+    字段之间可能相互依赖, 退化为逐条通过validate_model校验
+    """
+
+    def __init__(self, field: ModelField, *, fast_validate: bool = False, max_errors: Optional[int] = None):
+        field_info = field.field_info
+        assert isinstance(field_info, BatchBody)
+        model = field.type_
+        if field.shape not in (SHAPE_LIST, SHAPE_SEQUENCE) or not lenient_issubclass(model, BaseModel):
+            raise TypeError("BatchBody field: %s must be declared as List[Model]" % field.name)
+        config = model.__config__
+        self.field = field
+        self.alias = field.alias
+        self.model: Type[BaseModel] = model
+        self.chunk_size = field_info.chunk_size
+        self.columnar = field_info.columnar
+        limits = [n for n in (field_info.max_item_errors, max_errors) if n is not None]
+        self.max_errors = min(limits) if limits else None
+        self.columns = [
+            _Column(name, item_field, model, fast_validate)
+            for name, item_field in model.__fields__.items()
+        ]
+        self.row_wise = bool(
+            model.__validators__ or model.__pre_root_validators__ or model.__post_root_validators__ or
+            config.extra is not Extra.ignore or config.allow_population_by_field_name
+        )
+
+    def validate(self, data: dict) -> Tuple[Any, List[dict]]:
+        """从提取出来的data中校验这个字段, 返回(value, errors), 错误的loc为(alias, 下标, 字段, ...)"""
+        field = self.field
+        items = data.get(self.alias, _missing)
+        if items is _missing:
+            if field.required:
+                return None, self._flatten([ErrorWrapper(MissingError(), loc=(self.alias,))])
+            return field.get_default(), []
+        if items is None and field.allow_none:
+            return None, []
+        if not isinstance(items, (list, tuple)):
+            return None, self._flatten([ErrorWrapper(ListError(), loc=(self.alias,))])
+        if self.row_wise:
+            rows, raw_errors = self._validate_rows(items)
+            if raw_errors:
+                return None, self._flatten(raw_errors)
+            if self.columnar:
+                # extra为allow时每一行的字段可能不同, 以所有出现过的字段为列
+                names = list(dict.fromkeys(name for row in rows for name in row))
+                return {name: [row.get(name) for row in rows] for name in names}, []
+            return rows, []
+        columns, raw_errors = self._validate_columns(items)
+        if raw_errors:
+            return None, self._flatten(raw_errors)
+        if self.columnar:
+            return columns, []
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*columns.values())], []
+
+    def _flatten(self, raw_errors: list) -> List[dict]:
+        errors = list(flatten_errors(raw_errors, self.model.__config__))
+        # 按列校验时错误是按字段排列的, 按条目的下标重新排序
+        errors.sort(key=lambda err: err['loc'][1] if len(err['loc']) > 1 else -1)
+        if self.max_errors is not None:
+            del errors[self.max_errors:]
+        return errors
+
+    def _validate_columns(self, items) -> Tuple[dict, list]:
+        n = len(items)
+        alias = self.alias
+        max_errors = self.max_errors
+        columns = {column.name: [None] * n for column in self.columns}
+        raw_errors = []
+        for start in range(0, n, self.chunk_size):
+            chunk = []
+            for i, item in enumerate(items[start:start + self.chunk_size], start):
+                if isinstance(item, dict):
+                    chunk.append((i, item))
+                else:
+                    raw_errors.append(ErrorWrapper(DictError(), loc=(alias, i)))
+            for column in self.columns:
+                values = columns[column.name]
+                key = column.alias
+                fast_type = column.fast_type
+                for i, item in chunk:
+                    value = item.get(key, _missing)
+                    if type(value) is fast_type:
+                        values[i] = value
+                        continue
+                    value, error = column.validate(value, (alias, i, key))
+                    if error is None:
+                        values[i] = value
+                    else:
+                        raw_errors.append(error)
+            if max_errors is not None and len(raw_errors) >= max_errors:
+                break
+        return columns, raw_errors
+
+    def _validate_rows(self, items) -> Tuple[List[dict], list]:
+        alias = self.alias
+        model = self.model
+        max_errors = self.max_errors
+        converters = [(column.name, column.convert) for column in self.columns if column.convert is not None]
+        rows = []
+        raw_errors = []
+        for start in range(0, len(items), self.chunk_size):
+            for i, item in enumerate(items[start:start + self.chunk_size], start):
+                if not isinstance(item, dict):
+                    raw_errors.append(ErrorWrapper(DictError(), loc=(alias, i)))
+                    continue
+                values, _, error = validate_model(model, item)
+                if error is not None:
+                    raw_errors.append(ErrorWrapper(error, loc=(alias, i)))
+                    continue
+                for name, convert in converters:
+                    if name in values:
+                        values[name] = convert(values[name])
+                rows.append(values)
+            if max_errors is not None and len(raw_errors) >= max_errors:
+                break
+        return rows, raw_errors
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/16 15:32
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Any, Callable, Dict, ForwardRef, Hashable, Iterator, Optional, TYPE_CHECKING, Type, get_args
+
+from pydantic import BaseModel, BaseConfig
+from pydantic.fields import FieldInfo
+
+from .exceptions import ConfigError
+from .utils import get_name
+
+if TYPE_CHECKING:
+    from .params import Depends
+
+_missing = object()
+
+
+class LRUCache(object):
+    """线程安全的LRU缓存, 支持ttl过期并统计命中与未命中次数"""
+
+    def __init__(
+            self,
+            maxsize: Optional[int] = 128,
+            ttl: Optional[float] = None,
+            timer: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _missing)
+            if item is not _missing:
+                value, expires = item
+                if expires is None or expires > self._timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        expires = None if self.ttl is None else self._timer() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, BaseModel):
+        return value.__class__, _freeze(value.__dict__)
+    if isinstance(value, Enum):
+        return value
+    hash(value)
+    return value
+
+
+def make_cache_key(values: dict) -> Optional[Hashable]:
+    """根据依赖校验后的参数生成缓存的key, 参数不可hash时返回None(不缓存)"""
+    try:
+        return _freeze(values)
+    except TypeError:
+        return None
+
+
+_dependency_caches: Dict[Callable, LRUCache] = {}
+_dependency_caches_lock = threading.Lock()
+
+
+def get_dependency_cache(depend: "Depends") -> LRUCache:
+    """返回依赖在应用范围内的缓存, 同一个依赖只有一个缓存, 多次注册时maxsize与ttl必须相同"""
+    with _dependency_caches_lock:
+        cache = _dependency_caches.get(depend.dependency)
+        if cache is None:
+            cache = _dependency_caches[depend.dependency] = LRUCache(depend.maxsize, depend.ttl)
+        elif (cache.maxsize, cache.ttl) != (depend.maxsize, depend.ttl):
+            raise ConfigError("dependency: %s is cached with maxsize=%s, ttl=%s, got maxsize=%s, ttl=%s" % (
+                get_name(depend.dependency), cache.maxsize, cache.ttl, depend.maxsize, depend.ttl
+            ))
+        return cache
+
+
+def get_dependency_cache_stats() -> Dict[str, dict]:
+    return {
+        "%s.%s" % (getattr(dependency, "__module__", ""), get_name(dependency)): cache.stats()
+        for dependency, cache in _dependency_caches.items()
+    }
+
+
+def clear_dependency_caches():
+    for cache in _dependency_caches.values():
+        cache.clear()
+
+
+# 批量请求中各个子请求共享的依赖缓存, 只在shared_dependency_results()中存在
+_shared_caches: ContextVar[Optional[Dict[Callable, LRUCache]]] = ContextVar("wtph_shared_caches", default=None)
+
+
+@contextmanager
+def shared_dependency_results() -> Iterator[Dict[Callable, LRUCache]]:
+    """在这个上下文中, 声明了share_in_batch的依赖以依赖及其校验后的参数为key在多个请求之间共享结果"""
+    caches: Dict[Callable, LRUCache] = {}
+    token = _shared_caches.set(caches)
+    try:
+        yield caches
+    finally:
+        _shared_caches.reset(token)
+
+
+def get_shared_cache(dependency: Callable) -> Optional[LRUCache]:
+    caches = _shared_caches.get()
+    if caches is None:
+        return None
+    cache = caches.get(dependency)
+    if cache is None:
+        cache = caches[dependency] = LRUCache(maxsize=None)
+    return cache
+
+
+def _canonical(value: Any) -> Hashable:
+    """与_freeze相同, 同时保留值的类型, 1, 1.0与True不会生成相同的key"""
+    if isinstance(value, dict):
+        return dict, tuple((_canonical(k), _canonical(v)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return type(value), frozenset(_canonical(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_canonical(v) for v in value)
+    if isinstance(value, BaseModel):
+        return type(value), _canonical(value.__dict__)
+    hash(value)
+    return type(value), value
+
+
+def _has_forward_ref(annotation: Any) -> bool:
+    if isinstance(annotation, (str, ForwardRef)):
+        return True
+    return any(_has_forward_ref(arg) for arg in get_args(annotation))
+
+
+def make_model_key(
+        fields: Dict[str, tuple],
+        config: Optional[Type[BaseConfig]],
+        module: str,
+) -> Optional[Hashable]:
+    """生成的model的规范化签名: 参数名, 类型与Param的所有设置, 不可hash时返回None(不共享)
+
+    类型中有字符串的前向引用时在函数所在的模块中解析, 此时模块也是key的一部分
+    """
+    items = []
+    forward_ref = False
+    try:
+        for name, (annotation, field_info) in fields.items():
+            settings = tuple(_canonical(getattr(field_info, slot)) for slot in FieldInfo.__slots__)
+            extra = _canonical(getattr(field_info, "__dict__", {}))
+            hash(annotation)
+            forward_ref = forward_ref or _has_forward_ref(annotation)
+            items.append((name, annotation, type(field_info), settings, extra))
+    except TypeError:
+        return None
+    return tuple(items), config, module if forward_ref else None
+
+
+class ModelRegistry(object):
+    """以规范化的签名为key保存生成的请求model, 签名相同的视图与依赖共享同一个model, 以及其中的字段与validator
+
+    共享的model名称为第一次生成时的名称. enabled为False时每次都生成新的model
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._models: Dict[Hashable, Type[BaseModel]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def get_or_create(self, key: Optional[Hashable], create: Callable[[], Type[BaseModel]]) -> Type[BaseModel]:
+        if key is None or not self.enabled:
+            return create()
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+            self.misses += 1
+            model = self._models[key] = create()
+            return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._models), "enabled": self.enabled}
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/24 16:48
+import json
+from typing import Any, Union
+
+from pydantic.json import pydantic_encoder
+
+from .exceptions import ConfigError
+
+
+def _default(obj: Any) -> Any:
+    try:
+        return pydantic_encoder(obj)
+    except TypeError:
+        return str(obj)
+
+
+class JSONCodec(object):
+    """请求体解码, 错误响应与openapi文档编码使用的json实现, dumps返回紧凑的utf-8编码的bytes"""
+    name: str
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        raise NotImplementedError
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.name)
+
+
+class StdlibJSONCodec(JSONCodec):
+    name = "json"
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        return self._decoder.decode(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj).encode("utf-8")
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:  # pragma: no cover
+            raise ConfigError("codec 'orjson' requires orjson to be installed: pip install orjson")
+        self._orjson = orjson
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return self._orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._orjson.dumps(obj, default=_default, option=self._option)
+
+
+CODECS = {
+    "json": StdlibJSONCodec,
+    "orjson": OrjsonCodec,
+}
+
+
+def get_codec(codec: Union[str, JSONCodec, None] = "auto") -> JSONCodec:
+    """根据名称返回codec, "auto"时优先使用已经安装的orjson"""
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec is None or codec == "auto":
+        try:
+            return OrjsonCodec()
+        except ConfigError:
+            return StdlibJSONCodec()
+    if codec not in CODECS:
+        raise ConfigError("unknown codec: %s, only support: %s" % (codec, set(CODECS)))
+    return CODECS[codec]()
@@ -1,22 +1,33 @@
 # -*- coding: utf-8 -*-
 # @Time: 2021/9/22 12:23
+import logging
 from functools import wraps
 import typing as t
 
 from .exceptions import ConfigError
+from .codec import JSONCodec, get_codec
+from .instrument import Instrumentation
+
+logger = logging.getLogger("wtph")
 
 if t.TYPE_CHECKING:
     from .parsers.base import ParserManagerFactory
-    from .view import View
+    from .view import View, AsyncView
 
-SUPPORT_MODE = {"flask", }
+SUPPORT_MODE = {"flask", "asgi"}
 
 
 class Config(object):
     def __init__(self):
         self.app = None
         self.view_class = None
+        self.async_view_class = None
         self.parser_factory = None
+        self.view_options = {}
+        self.openapi_extra = None
+        self.openapi_document = None
+        self.codec: JSONCodec = get_codec("json")
+        self.instrumentation: t.Optional[Instrumentation] = None
 
     def customize_setup(
             self,
@@ -25,11 +36,23 @@ class Config(object):
             inject: t.Optional[t.Callable] = None,
             inject_extra: t.Optional[dict] = None,
             view_class: t.Optional["View"] = None,
+            async_view_class: t.Optional["AsyncView"] = None,
+            view_options: t.Optional[dict] = None,
+            codec: t.Union[str, JSONCodec, None] = "auto",
+            instrumentation: t.Union[bool, Instrumentation, None] = None,
     ):
         self.parser_factory = parser_factory
+        self.codec = get_codec(codec)
+        if instrumentation is True:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation or None
+        self.view_options = view_options or {}
         if view_class is None:
             from .view import View as view_class  # noqa
         self.view_class = view_class
+        if async_view_class is None:
+            from .view import AsyncView as async_view_class  # noqa
+        self.async_view_class = async_view_class
         if inject is not None:
             inject(self, **(inject_extra or {}))
 
@@ -37,19 +60,37 @@ class Config(object):
             self,
             mode: str,
             app=None,
+            view_options: t.Optional[dict] = None,
+            codec: t.Union[str, JSONCodec, None] = "auto",
+            instrumentation: t.Union[bool, Instrumentation, None] = None,
             **inject_extra,
     ):
         self.app = app
+        view_class = async_view_class = None
         if mode == "flask":
             from .parsers.flask import flask_parser_manager_factory as parser_factory
             inject = flask_inject
+        elif mode == "asgi":
+            from .parsers.asgi import asgi_parser_manager_factory as parser_factory
+            from .asgi import ASGIView, asgi_inject as inject
+            # 所有视图都在事件循环中分发, 同步的视图函数也使用ASGIView
+            view_class = async_view_class = ASGIView
         else:
             msg = """
                 don't support mode: %s, only support mode: %s
                 you can customize by config.customize_setup()
             """ % (mode, SUPPORT_MODE)
             raise ConfigError(msg)
-        self.customize_setup(parser_factory, inject=inject, inject_extra=inject_extra)  # noqa
+        self.customize_setup(
+            parser_factory,
+            inject=inject,
+            inject_extra=inject_extra,
+            view_class=view_class,
+            async_view_class=async_view_class,
+            view_options=view_options,
+            codec=codec,
+            instrumentation=instrumentation,
+        )  # noqa
 
 
 config = Config()
@@ -61,10 +102,19 @@ def flask_inject(
         docs_url: t.Optional[str] = "/docs",
         openapi_extra: t.Optional[dict] = None,
         swagger_extra: t.Optional[dict] = None,
+        openapi_file: t.Optional[str] = None,
+        metrics_url: t.Optional[str] = "/metrics",
+        profile_url: t.Optional[str] = None,
+        profile_dir: t.Optional[str] = None,
+        batch_url: t.Optional[str] = None,
+        batch_max_requests: int = 50,
+        batch_share_dependencies: bool = False,
+        admin_auth: t.Optional[t.Callable[[t.Any], bool]] = None,
 ):
-    from flask import Flask
-    from .openapi import get_openapi
+    from flask import Flask, request, abort
+    from .utils import is_coroutine_callable
     from .openapi.docs import get_swagger_ui_html
+    from .openapi.document import OpenapiDocument
     flask_add_url_rule = Flask.add_url_rule
 
     @wraps(flask_add_url_rule)
@@ -79,31 +129,130 @@ def flask_inject(
     ):
         if methods is not None and view_func is not None:
             methods = set(methods)
-            view_func = cfg.view_class(endpoint=view_func, path=rule, methods=methods, **(view_config or {}))
+            view_config = {**cfg.view_options, **(view_config or {})}
+            if is_coroutine_callable(view_func):
+                view = cfg.async_view_class(endpoint=view_func, path=rule, methods=methods, **view_config)
+                # flask通过inspect.iscoroutinefunction判断异步视图, 需要注册一个协程函数
+                view_func = view.as_view_func()
+            else:
+                view_func = cfg.view_class(endpoint=view_func, path=rule, methods=methods, **view_config)
         return flask_add_url_rule(app, rule, endpoint, view_func, methods=methods, **options)
 
     Flask.add_url_rule = add_url_rule
 
+    openapi_extra = openapi_extra or {}
+    openapi_extra.setdefault('title', 'flask')
+    openapi_extra.setdefault('version', '0.1')
+    cfg.openapi_extra = openapi_extra
+
+    if profile_url and admin_auth is None:
+        raise ConfigError("profile_url requires admin_auth, a function that authorizes the current request")
+
     flask_app: Flask = cfg.app
     if flask_app is not None:
         if openapi_url:
-            openapi_extra = openapi_extra or {}
-            openapi_extra.setdefault('title', 'flask')
-            openapi_extra.setdefault('version', '0.1')
-            openapi_json = None
+            # openapi_file为`python -m wtph openapi`预先生成的文档, 在第一次请求时读取,
+            # 导入应用生成文档时文件可以还不存在
+            openapi_document = OpenapiDocument(openapi_extra, openapi_file=openapi_file)
+            cfg.openapi_document = openapi_document
 
             @flask_app.get(openapi_url, view_config={"include_in_schema": False})
             def get_openapi_json():
-                nonlocal openapi_json
-                if openapi_json is not None:
-                    return openapi_json
-                openapi_json = get_openapi(**openapi_extra)
-                return openapi_json
+                document = openapi_document.get()
+                gzip_encoding = request.accept_encodings.quality("gzip") > 0
+                response = flask_app.response_class(
+                    document.get_body(gzip_encoding),
+                    mimetype="application/json",
+                )
+                if gzip_encoding:
+                    response.headers["Content-Encoding"] = "gzip"
+                response.vary.add("Accept-Encoding")
+                response.cache_control.no_cache = True
+                response.set_etag(document.get_etag(gzip_encoding))
+                return response.make_conditional(request)
 
         if openapi_url and docs_url:
             swagger_extra = swagger_extra or {}
             swagger_extra.setdefault("title", "flask")
 
+            docs_html = get_swagger_ui_html(openapi_url, **swagger_extra)
+
             @flask_app.get(docs_url, view_config={"include_in_schema": False})
             def get_docs():
-                return get_swagger_ui_html(openapi_url, **swagger_extra)
+                return docs_html
+
+        # 需要admin_auth的路由, 在before_request中检查, 未授权的请求在参数解析之前返回403
+        admin_rules = set()
+
+        if admin_auth is not None:
+            @flask_app.before_request
+            def check_admin_auth():
+                rule = request.url_rule
+                if rule is not None and rule.rule in admin_rules and not admin_auth(request):
+                    abort(403)
+
+        instrumentation = cfg.instrumentation
+        if metrics_url and instrumentation is not None and admin_auth is None:
+            logger.warning("metrics_url: %s is not registered, it requires admin_auth", metrics_url)
+        elif metrics_url and instrumentation is not None:
+            admin_rules.add(metrics_url)
+
+            @flask_app.get(metrics_url, view_config={"include_in_schema": False, "instrument": False})
+            def get_metrics():
+                return flask_app.response_class(
+                    instrumentation.render_prometheus(),
+                    mimetype="text/plain; version=0.0.4",
+                )
+
+        if profile_url:
+            from .params import Query
+            from .profiler import ProfileModes, start_profiling, stop_profiling, get_profilers, find_views
+
+            admin_rules.add(profile_url)
+
+            @flask_app.route(
+                profile_url,
+                methods=["GET", "POST", "DELETE"],
+                view_config={"include_in_schema": False, "instrument": False},
+            )
+            def profile_route(
+                    path: t.Optional[str] = Query(None),
+                    method: t.Optional[str] = Query(None),
+                    every: int = Query(10, ge=1),
+                    mode: ProfileModes = Query(ProfileModes.cprofile),
+            ):
+                """GET查看正在采样的视图, POST开始采样path对应的视图, DELETE停止采样并写入profile_dir"""
+                if request.method == "GET":
+                    profilers = get_profilers(find_views(path, method) if path else None)
+                    items = []
+                    for profiler in profilers:
+                        item = profiler.info()
+                        if path:
+                            item["stats"] = profiler.get_stats_text()
+                        items.append(item)
+                    return {"profilers": items}
+                if not path:
+                    abort(400, "path is required")
+                if request.method == "POST":
+                    try:
+                        profilers = start_profiling(path, method, every=every, mode=mode.value)
+                    except ConfigError as e:
+                        abort(404, str(e))
+                    return {"profilers": [profiler.info() for profiler in profilers]}
+                return {"files": stop_profiling(path, method, output_dir=profile_dir)}
+
+        if batch_url:
+            from .params import Body
+            from .multiplex import SubRequest, dispatch_batch
+
+            @flask_app.post(batch_url, view_config={"include_in_schema": False, "instrument": False})
+            def batch_route(requests: t.List[SubRequest] = Body(..., max_items=batch_max_requests)):
+                """依次执行多个子请求, 在一个响应中返回所有子请求的status, headers与body"""
+                body = dispatch_batch(
+                    flask_app,
+                    requests,
+                    cfg.codec,
+                    share_dependencies=batch_share_dependencies,
+                    exclude_endpoint=request.endpoint,
+                )
+                return flask_app.response_class(body, mimetype="application/json")
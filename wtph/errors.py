@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/12 22:07
+from typing import Iterable, List, Optional
+
+from .codec import JSONCodec, get_codec
+
+
+class ValidationErrorTemplate(object):
+    """预先生成每个loc对应的json片段, 渲染错误时只需要拼接msg, type与ctx"""
+
+    def __init__(self, locations: Iterable[tuple], codec: Optional[JSONCodec] = None):
+        self.codec = codec if codec is not None else get_codec("json")
+        dumps = self.codec.dumps
+        self._prefixes = {
+            loc: b'{"loc":' + dumps(list(loc)) + b',"msg":'
+            for loc in locations
+        }
+
+    def render_error(self, error: dict) -> bytes:
+        dumps = self.codec.dumps
+        prefix = self._prefixes.get(error['loc'])
+        if prefix is None:
+            return dumps(error)
+        rendered = prefix + dumps(error['msg']) + b',"type":' + dumps(error['type'])
+        ctx = error.get('ctx')
+        if ctx:
+            rendered += b',"ctx":' + dumps(ctx)
+        return rendered + b"}"
+
+    def render(self, errors: List[dict]) -> bytes:
+        return b"[" + b",".join([self.render_error(error) for error in errors]) + b"]"
@@ -7,3 +7,11 @@ class TypeCheckException(Exception):
 
 class ConfigError(TypeCheckException):
     pass
+
+
+class BodyParseError(TypeCheckException, ValueError):
+    pass
+
+
+class BodyTooLarge(BodyParseError):
+    pass
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/30 15:22
+import threading
+import time
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .view import View
+
+# 各阶段的名称, 依赖的阶段名称为depend.<依赖函数名>
+PHASES = ("extract", "validate", "endpoint", "response", "error", "total")
+
+
+class Recorder(object):
+    """一次请求中各阶段的耗时(秒)与计数, 同一个阶段多次记录时累加"""
+
+    timer: Callable[[], float] = time.perf_counter
+
+    def __init__(self):
+        self.start = self.timer()
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def add(self, phase: str, seconds: float):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            "%s;dur=%.3f" % (phase, seconds * 1000) for phase, seconds in self.timings.items()
+        )
+
+
+class RouteStats(object):
+    """一个视图的累计统计, 每个阶段记录次数, 总耗时与最大耗时"""
+
+    def __init__(self, path: Optional[str], name: str):
+        self.path = path
+        self.name = name
+        self.requests = 0
+        self.counters: Dict[str, int] = {}
+        self.phases: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def merge(self, recorder: Recorder):
+        with self._lock:
+            self.requests += 1
+            for name, n in recorder.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for phase, seconds in recorder.timings.items():
+                item = self.phases.get(phase)
+                if item is None:
+                    self.phases[phase] = [1, seconds, seconds]
+                else:
+                    item[0] += 1
+                    item[1] += seconds
+                    if seconds > item[2]:
+                        item[2] = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "name": self.name,
+                "requests": self.requests,
+                "counters": dict(self.counters),
+                "phases": {
+                    phase: {"count": count, "sum": total, "max": max_, "avg": total / count}
+                    for phase, (count, total, max_) in self.phases.items()
+                },
+            }
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Instrumentation(object):
+    """视图的计时与计数的钩子, 没有启用时视图只多一次属性判断
+
+    :param server_timing: 是否在响应中添加Server-Timing头
+    :param enabled: 可以在运行时切换, 关闭后不再记录
+    """
+
+    def __init__(self, *, server_timing: bool = False, enabled: bool = True):
+        self.server_timing = server_timing
+        self.enabled = enabled
+        self._stats: Dict["View", RouteStats] = {}
+        self._lock = threading.Lock()
+
+    def start(self, view: "View") -> Recorder:  # noqa
+        return Recorder()
+
+    def finish(self, view: "View", recorder: Recorder):
+        recorder.add("total", recorder.timer() - recorder.start)
+        stats = self._stats.get(view)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.get(view)
+                if stats is None:
+                    stats = self._stats[view] = RouteStats(view.path, view.name)
+        stats.merge(recorder)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self) -> List[dict]:
+        return [stats.snapshot() for stats in list(self._stats.values())]
+
+    def render_prometheus(self) -> str:
+        """以prometheus的文本格式输出累计的统计"""
+        snapshots = self.snapshot()
+        lines = [
+            "# HELP wtph_requests_total Requests handled by wtph views.",
+            "# TYPE wtph_requests_total counter",
+        ]
+        counter_names = set()
+        for item in snapshots:
+            labels = 'path="%s",name="%s"' % (_escape(item["path"]), _escape(item["name"]))
+            item["labels"] = labels
+            lines.append("wtph_requests_total{%s} %d" % (labels, item["requests"]))
+            counter_names.update(item["counters"])
+        for counter in sorted(counter_names):
+            metric = "wtph_%s_total" % counter
+            lines.append("# TYPE %s counter" % metric)
+            for item in snapshots:
+                lines.append("%s{%s} %d" % (metric, item["labels"], item["counters"].get(counter, 0)))
+        lines.append("# HELP wtph_phase_seconds Time spent in each phase of a view.")
+        lines.append("# TYPE wtph_phase_seconds summary")
+        max_lines = ["# TYPE wtph_phase_seconds_max gauge"]
+        for item in snapshots:
+            for phase, phase_stats in sorted(item["phases"].items()):
+                labels = '%s,phase="%s"' % (item["labels"], _escape(phase))
+                lines.append("wtph_phase_seconds_sum{%s} %.9f" % (labels, phase_stats["sum"]))
+                lines.append("wtph_phase_seconds_count{%s} %d" % (labels, phase_stats["count"]))
+                max_lines.append("wtph_phase_seconds_max{%s} %.9f" % (labels, phase_stats["max"]))
+        lines.extend(max_lines)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/3 20:05
+from io import BytesIO
+from typing import Any, Dict, List, Optional, TYPE_CHECKING, Union
+from urllib.parse import unquote
+
+from pydantic import BaseModel, Field
+
+from .cache import shared_dependency_results
+from .codec import JSONCodec
+
+if TYPE_CHECKING:
+    from flask import Flask, Response
+
+# 描述外层请求的body与传输方式的头, 不会被子请求继承
+_SKIP_ENVIRON = {
+    "CONTENT_TYPE",
+    "CONTENT_LENGTH",
+    "HTTP_CONTENT_TYPE",
+    "HTTP_CONTENT_LENGTH",
+    "HTTP_ACCEPT_ENCODING",
+    "HTTP_TRANSFER_ENCODING",
+    "HTTP_IF_MATCH",
+    "HTTP_IF_NONE_MATCH",
+    "HTTP_IF_MODIFIED_SINCE",
+    "HTTP_IF_UNMODIFIED_SINCE",
+    "HTTP_IF_RANGE",
+    "HTTP_RANGE",
+    "werkzeug.request",
+}
+
+
+class SubRequest(BaseModel):
+    """批量请求中的一个子请求, body不为null时以json发送"""
+    method: str = "GET"
+    path: str = Field(..., regex=r"^/")
+    headers: Dict[str, str] = {}
+    body: Any = None
+
+
+def build_environ(base: dict, sub_request: dict, codec: JSONCodec) -> dict:
+    """以外层请求的environ为基础构造子请求的environ, 子请求继承外层请求的认证等头"""
+    environ = {key: value for key, value in base.items() if key not in _SKIP_ENVIRON}
+    path, _, query = sub_request["path"].partition("?")
+    environ["REQUEST_METHOD"] = sub_request["method"].upper()
+    # 与werkzeug相同, PATH_INFO为解码后按latin-1表示的字符串
+    environ["PATH_INFO"] = unquote(path).encode("utf-8").decode("latin-1")
+    environ["QUERY_STRING"] = query
+    data = b""
+    if sub_request.get("body") is not None:
+        data = codec.dumps(sub_request["body"])
+        environ["CONTENT_TYPE"] = "application/json"
+    environ["CONTENT_LENGTH"] = str(len(data))
+    environ["wsgi.input"] = BytesIO(data)
+    for name, value in sub_request.get("headers", {}).items():
+        key = name.upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        environ[key] = value
+    return environ
+
+
+def encode_response(response: "Response", codec: JSONCodec) -> bytes:
+    """子响应编码为{"status", "headers", "body"}, json的body原样拼接, 不再解析一次"""
+    headers = {key: value for key, value in response.headers.items() if key != "Content-Length"}
+    data = response.get_data()
+    if response.is_json:
+        body = data.strip() or b"null"
+    else:
+        body = codec.dumps(data.decode("utf-8", "replace"))
+    return b'{"status":%d,"headers":%s,"body":%s}' % (response.status_code, codec.dumps(headers), body)
+
+
+def dispatch_sub_request(
+        app: "Flask",
+        environ: dict,
+        session=None,
+        exclude_endpoint: Optional[str] = None,
+) -> "Response":
+    """在新的应用上下文与请求上下文中完成子请求的分发, before_request/after_request与错误处理都与普通请求相同
+
+    每个子请求有自己的flask.g, teardown_request与teardown_appcontext在每个子请求结束时执行
+    """
+    from flask.ctx import RequestContext
+
+    app_ctx = app.app_context()
+    ctx = RequestContext(app, environ, session=session)
+    error: Optional[BaseException] = None
+    # 先推入新的应用上下文, RequestContext不会再复用外层请求的应用上下文
+    app_ctx.push()
+    try:
+        ctx.push()
+        try:
+            rule = ctx.request.url_rule
+            if rule is not None and rule.endpoint == exclude_endpoint:
+                return app.make_response(({"detail": "batch requests can not be nested"}, 400))
+            try:
+                return app.full_dispatch_request()
+            except Exception as e:
+                error = e
+                return app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+    finally:
+        app_ctx.pop(error)
+
+
+def dispatch_batch(
+        app: "Flask",
+        sub_requests: List[Union[dict, SubRequest]],
+        codec: JSONCodec,
+        *,
+        share_dependencies: bool = False,
+        exclude_endpoint: Optional[str] = None,
+) -> bytes:
+    """依次执行所有子请求(校验后的SubRequest), 返回{"responses": [...]}, 顺序与sub_requests相同
+
+    share_dependencies为True时, 声明了Depends(share_in_batch=True)的请求范围的依赖在校验后的参数相同时只执行一次,
+    结果在所有子请求中共享; 其他依赖在每个子请求中单独执行, 应用范围的依赖使用自己的缓存
+    """
+    from flask import request, session
+
+    base = request.environ
+    current_session = session._get_current_object()  # noqa
+    responses = []
+
+    def run():
+        for sub_request in sub_requests:
+            # fast_validate时校验结果是SubRequest实例而不是dict
+            if isinstance(sub_request, BaseModel):
+                sub_request = sub_request.dict()
+            environ = build_environ(base, sub_request, codec)
+            response = dispatch_sub_request(app, environ, current_session, exclude_endpoint)
+            responses.append(encode_response(response, codec))
+
+    if share_dependencies:
+        with shared_dependency_results():
+            run()
+    else:
+        run()
+    return b'{"responses":[' + b",".join(responses) + b"]}"
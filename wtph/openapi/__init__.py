@@ -3,16 +3,87 @@
 from collections import defaultdict
 from typing import Optional, Dict, Any, Union, List, Iterable
 
-from pydantic.schema import get_model_name_map
+from pydantic.schema import get_model_name_map, TypeModelSet
 
 from .utils import (
     OpenapiPathHandler,
-    get_views_flat_models,
-    get_views_models_definitions
+    SchemaCache,
+    copy_document,
+    default_schema_cache,
+    get_openapi_path_key,
+    get_views_models_definitions,
 )
 from ..view import View
 
 
+class _ViewOpenapi(object):
+    """一个视图在openapi中的缓存, model的名称没有变化时可以直接复用"""
+
+    def __init__(self, flat_models: TypeModelSet):
+        self.flat_models = flat_models
+        self.model_names: Optional[Dict[Any, str]] = None
+        self.path: Optional[dict] = None
+        self.definitions: Optional[dict] = None
+
+
+class OpenapiBuilder(object):
+    """增量生成openapi的paths与definitions
+
+    每个视图的path与definitions会被缓存, 只有新增的视图或者model名称发生变化(例如新的视图引入了同名的model)
+    的视图才会重新生成
+    """
+
+    def __init__(self, schema_cache: Optional[SchemaCache] = None):
+        self._views: Dict[View, _ViewOpenapi] = {}
+        self.schema_cache = schema_cache if schema_cache is not None else default_schema_cache
+
+    def invalidate(self, view: Optional[View] = None):
+        if view is None:
+            self._views.clear()
+        else:
+            self._views.pop(view, None)
+
+    def _get_entry(self, view: View) -> _ViewOpenapi:
+        entry = self._views.get(view)
+        if entry is None:
+            flat_models = self.schema_cache.get_view_flat_models(view)
+            entry = self._views[view] = _ViewOpenapi(flat_models)
+        return entry
+
+    def build(self, views: Iterable[View]):
+        """返回(paths, definitions)"""
+        views = list(views)
+        entries = [self._get_entry(view) for view in views]
+        # 删除已经不存在的视图
+        for view in set(self._views) - set(views):
+            del self._views[view]
+
+        flat_models = set()
+        for entry in entries:
+            flat_models |= entry.flat_models
+        model_name_map = get_model_name_map(flat_models)
+
+        paths: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        definitions = {}
+        for view, entry in zip(views, entries):
+            model_names = {model: model_name_map[model] for model in entry.flat_models}
+            if entry.model_names != model_names:
+                entry.path = OpenapiPathHandler(
+                    view, model_name_map, schema_cache=self.schema_cache
+                ).get_openapi_path()
+                entry.definitions = get_views_models_definitions(
+                    entry.flat_models, model_name_map, self.schema_cache
+                )
+                entry.model_names = model_names
+            if entry.path:
+                paths[get_openapi_path_key(view.path)].update(entry.path)
+            definitions.update(entry.definitions)
+        return paths, definitions
+
+
+openapi_builder = OpenapiBuilder()
+
+
 def get_openapi(
         *,
         title: str,
@@ -25,7 +96,14 @@ def get_openapi(
         terms_of_service: Optional[str] = None,
         contact: Optional[Dict[str, Union[str, Any]]] = None,
         license_info: Optional[Dict[str, Union[str, Any]]] = None,
+        builder: Optional[OpenapiBuilder] = None,
+        shared: bool = False,
 ):
+    """生成openapi文档
+
+    paths与schemas来自builder的缓存, 默认返回它们的拷贝, 调用方可以修改返回的文档;
+    shared为True时不复制, 返回的文档与缓存共享, 只能用于直接序列化(例如/openapi.json)
+    """
     info = {"title": title, "version": version}
     output: Dict[str, Any] = {"openapi": openapi_version, "info": info}
     if description:
@@ -42,15 +120,12 @@ def get_openapi(
         output["tags"] = tags
     if views is None:
         from ..view import view_set as views
+    if builder is None:
+        builder = openapi_builder
     components: Dict[str, Dict[str, Any]] = {}
-    flat_models = get_views_flat_models(views)
-    model_name_map = get_model_name_map(flat_models)
-    definitions = get_views_models_definitions(flat_models, model_name_map)
-    paths: Dict[str, Dict[str, Any]] = defaultdict(dict)
-    for view in views:
-        path = OpenapiPathHandler(view, model_name_map).get_openapi_path()
-        if path:
-            paths[view.path].update(path)
+    paths, definitions = builder.build(views)
+    if not shared:
+        paths, definitions = copy_document(paths), copy_document(definitions)
     if definitions:
         components["schemas"] = {k: definitions[k] for k in sorted(definitions)}
     if components:
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/20 20:16
+import gzip
+import hashlib
+import threading
+from typing import Optional, Iterable, TYPE_CHECKING
+
+from .export import dump_openapi, load_openapi
+
+if TYPE_CHECKING:
+    from ..view import View
+
+
+class PreparedDocument(object):
+    """预先编码好的json文档, 包含gzip压缩后的内容与根据内容生成的etag"""
+
+    def __init__(self, content: bytes, compressed: Optional[bytes] = None):
+        self.content = content
+        if compressed is None:
+            compressed = gzip.compress(content, compresslevel=6, mtime=0)
+        self.compressed = compressed
+        self.etag = hashlib.sha1(content).hexdigest()
+
+    def get_body(self, gzip_encoding: bool) -> bytes:
+        return self.compressed if gzip_encoding else self.content
+
+    def get_etag(self, gzip_encoding: bool) -> str:
+        # 不同编码的内容是不同的表示, 需要不同的etag
+        return self.etag + "-gzip" if gzip_encoding else self.etag
+
+
+class OpenapiDocument(object):
+    """/openapi.json返回的文档
+
+    指定openapi_file时读取预先生成的文件, 否则通过get_openapi生成, 使用全局的view_set时,
+    注册或者删除视图之后会重新生成
+    """
+
+    def __init__(
+            self,
+            openapi_extra: Optional[dict] = None,
+            *,
+            views: Optional[Iterable["View"]] = None,
+            openapi_file: Optional[str] = None,
+    ):
+        self.openapi_extra = openapi_extra or {}
+        self.openapi_file = openapi_file
+        self._views = views
+        self._prepared: Optional[PreparedDocument] = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_views_version():
+        from ..view import view_set
+        return view_set.version
+
+    def is_stale(self) -> bool:
+        if self._prepared is None:
+            return True
+        if self.openapi_file is not None or self._views is not None:
+            return False
+        return self._version != self._get_views_version()
+
+    def invalidate(self):
+        self._prepared = None
+
+    def prepare(self) -> PreparedDocument:
+        if self.openapi_file is not None:
+            return PreparedDocument(*load_openapi(self.openapi_file))
+        from . import get_openapi
+
+        self._version = self._get_views_version()
+        # 文档只用于编码, 不需要复制缓存的paths与schemas
+        document = get_openapi(views=self._views, shared=True, **self.openapi_extra)
+        return PreparedDocument(dump_openapi(document, minify=True))
+
+    def get(self) -> PreparedDocument:
+        prepared = self._prepared
+        if prepared is not None and not self.is_stale():
+            return prepared
+        with self._lock:
+            if self.is_stale():
+                self._prepared = self.prepare()
+            return self._prepared
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/18 21:10
+import gzip
+import importlib
+import json
+import os
+import sys
+from typing import Any, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..codec import JSONCodec
+
+
+def dump_openapi(document: dict, minify: bool = False, codec: Optional["JSONCodec"] = None) -> bytes:
+    """minify时使用codec(默认为setup_wtph中配置的codec)编码, 否则以缩进2的格式输出"""
+    if minify:
+        if codec is None:
+            from ..config import config
+            codec = config.codec
+        return codec.dumps(document)
+    return json.dumps(document, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def write_openapi(document: dict, path: str, minify: bool = False, compress: bool = False) -> str:
+    """将openapi文档写入path, compress为True时写入gzip压缩后的文件(自动补全.gz后缀), 返回写入的路径"""
+    data = dump_openapi(document, minify)
+    if compress:
+        if not path.endswith(".gz"):
+            path += ".gz"
+        data = gzip.compress(data, compresslevel=9, mtime=0)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def load_openapi(path: str) -> Tuple[bytes, Optional[bytes]]:
+    """读取write_openapi写入的文件, 返回(json, gzip压缩后的json), 文件没有压缩时后者为None"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] == b"\x1f\x8b":
+        return gzip.decompress(data), data
+    return data, None
+
+
+def import_from_string(import_str: str) -> Any:
+    """导入"module:attr"形式的对象, 省略attr时默认为app"""
+    module_name, _, attrs = import_str.partition(":")
+    if not module_name:
+        raise ValueError("import string must be in format '<module>:<attribute>', got: %r" % import_str)
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    obj = importlib.import_module(module_name)
+    for attr in (attrs or "app").split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def export_openapi(
+        import_str: str,
+        output: str,
+        *,
+        minify: bool = False,
+        compress: bool = False,
+        title: Optional[str] = None,
+        version: Optional[str] = None,
+) -> str:
+    """导入应用后生成openapi文档并写入文件, 文档的参数默认与setup_wtph中的openapi_extra相同"""
+    from ..config import config
+    from . import get_openapi
+
+    import_from_string(import_str)
+    openapi_extra = dict(config.openapi_extra or {})
+    openapi_extra.setdefault("title", "flask")
+    openapi_extra.setdefault("version", "0.1")
+    if title is not None:
+        openapi_extra["title"] = title
+    if version is not None:
+        openapi_extra["version"] = version
+    return write_openapi(get_openapi(shared=True, **openapi_extra), output, minify=minify, compress=compress)
@@ -1,14 +1,37 @@
 # -*- coding: utf-8 -*-
 # @Time: 2021/9/21 14:20
 import itertools
-from typing import Iterable
+import re
+import threading
+from typing import Iterable, Dict, Tuple, Optional, Type
 from enum import Enum
 
-from pydantic.schema import get_flat_models_from_model, model_process_schema
+from pydantic.fields import ModelField
+from pydantic import BaseModel
+from pydantic.schema import model_process_schema, field_schema
 from pydantic.schema import TypeModelSet, TypeModelOrEnum
 
 from ..view import View
 from ..parsers.base import ParserManager
+from ..utils import get_header_name
+
+REF_PREFIX = "#/components/schemas/"
+
+_rule_variable_re = re.compile(r"<(?:[^<>:]+:)?([^<>]+)>")
+
+
+def get_openapi_path_key(path: str) -> str:
+    """flask的路由规则转换为openapi的路径, /items/<int:item_id> -> /items/{item_id}"""
+    return _rule_variable_re.sub(r"{\1}", path)
+
+
+def copy_document(obj):
+    """复制文档中的dict与list, 其他值(字符串, 数字等)共享, 比copy.deepcopy快"""
+    if isinstance(obj, dict):
+        return {key: copy_document(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [copy_document(value) for value in obj]
+    return obj
 
 
 def get_name(f) -> str:
@@ -18,21 +41,138 @@ def get_name(f) -> str:
         return f.__class__.__name__
 
 
+def _is_model(type_) -> bool:
+    # BaseModel是ABC, issubclass对不是model的类会遍历所有BaseModel的子类,
+    # 每个视图都会生成新的model与约束类型(例如Query(ge=1)), 直接检查__mro__避免路由数量的平方级开销
+    return isinstance(type_, type) and BaseModel in type_.__mro__
+
+
+def _is_enum(type_) -> bool:
+    return isinstance(type_, type) and Enum in type_.__mro__
+
+
+def get_flat_models_from_field(field: ModelField, known_models: TypeModelSet) -> TypeModelSet:
+    """与pydantic.schema.get_flat_models_from_field相同, 但是不使用issubclass"""
+    flat_models = set()
+    type_ = field.type_
+    pydantic_model = getattr(type_, "__pydantic_model__", None)
+    if _is_model(pydantic_model):
+        type_ = pydantic_model
+    if field.sub_fields and not _is_model(type_):
+        for sub_field in field.sub_fields:
+            flat_models |= get_flat_models_from_field(sub_field, known_models)
+    elif _is_model(type_) and type_ not in known_models:
+        flat_models |= get_flat_models_from_model(type_, known_models)
+    elif _is_enum(type_):
+        flat_models.add(type_)
+    return flat_models
+
+
+def get_flat_models_from_model(model: Type[BaseModel], known_models: Optional[TypeModelSet] = None) -> TypeModelSet:
+    if known_models is None:
+        known_models = set()
+    flat_models = {model}
+    known_models.add(model)
+    for field in model.__fields__.values():
+        flat_models |= get_flat_models_from_field(field, known_models)
+    return flat_models
+
+
+class SchemaCache(object):
+    """缓存model的flat models与schema, 在多次生成openapi之间共享
+
+    schema的key为(model, ref_prefix, 引用到的model的名称), 引用的model名称变化时会重新生成.
+    返回的flat models与schema是共享的, OpenapiBuilder缓存的paths与definitions也直接引用它们,
+    整个生成过程不修改这些对象, get_openapi在返回前复制(shared=True时除外), 调用方修改的是拷贝
+    """
+
+    def __init__(self):
+        self._flat_models: Dict[TypeModelOrEnum, TypeModelSet] = {}
+        self._schemas: Dict[tuple, Tuple[dict, dict, set]] = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._flat_models.clear()
+            self._schemas.clear()
+
+    def get_flat_models(self, model: TypeModelOrEnum) -> TypeModelSet:
+        flat_models = self._flat_models.get(model)
+        if flat_models is None:
+            if isinstance(model, type) and issubclass(model, Enum):
+                flat_models = {model}
+            else:
+                flat_models = get_flat_models_from_model(model)
+            with self._lock:
+                flat_models = self._flat_models.setdefault(model, flat_models)
+        return flat_models
+
+    def get_field_flat_models(self, field: ModelField) -> TypeModelSet:
+        flat_models = self._flat_models.get(field)
+        if flat_models is None:
+            flat_models = get_flat_models_from_field(field, known_models=set())
+            with self._lock:
+                flat_models = self._flat_models.setdefault(field, flat_models)
+        return flat_models
+
+    def get_view_flat_models(self, view: View) -> TypeModelSet:
+        flat_models = self.get_flat_models(view.parser_manager.model)
+        if view.response_serializer is not None:
+            flat_models = flat_models | self.get_field_flat_models(view.response_serializer.field)
+        return flat_models
+
+    def field_schema(self, field: ModelField, model_name_map: dict, ref_prefix: str = REF_PREFIX) -> dict:
+        names = frozenset(
+            (m, model_name_map[m]) for m in self.get_field_flat_models(field) if m in model_name_map
+        )
+        key = (field, ref_prefix, names)
+        result = self._schemas.get(key)
+        if result is None:
+            result = field_schema(field, model_name_map=model_name_map, ref_prefix=ref_prefix)
+            with self._lock:
+                self._schemas[key] = result
+        return result[0]
+
+    def model_process_schema(self, model: TypeModelOrEnum, model_name_map: dict, ref_prefix: str = REF_PREFIX):
+        names = frozenset(
+            (m, model_name_map[m]) for m in self.get_flat_models(model) if m in model_name_map
+        )
+        key = (model, ref_prefix, names)
+        result = self._schemas.get(key)
+        if result is None:
+            result = model_process_schema(model, model_name_map=model_name_map, ref_prefix=ref_prefix)
+            with self._lock:
+                self._schemas[key] = result
+        return result
+
+
+default_schema_cache = SchemaCache()
+
+
 def get_depend_model_field(manager: ParserManager):
-    for parser in manager.depend_parsers:
-        yield from parser.model.__fields__.values()
-        if parser.has_depend_parser():
-            yield from get_depend_model_field(parser)
+    yielded = set()
+    for step in manager.depend_plan:
+        if step.parser in yielded:
+            continue
+        yielded.add(step.parser)
+        yield from step.parser.model.__fields__.values()
 
 
 class OpenapiPathHandler(object):
-    def __init__(self, view: View, model_name_map: dict, ref_prefix: str = "#/components/schemas/"):
+    def __init__(
+            self,
+            view: View,
+            model_name_map: dict,
+            ref_prefix: str = REF_PREFIX,
+            schema_cache: Optional[SchemaCache] = None,
+    ):
         self.view = view
         self.model_name_map = model_name_map
         self.ref_prefix = ref_prefix
+        self.schema_cache = schema_cache if schema_cache is not None else default_schema_cache
 
     def model_process_schema(self, model: TypeModelOrEnum):
-        return model_process_schema(model, model_name_map=self.model_name_map)
+        return self.schema_cache.model_process_schema(model, self.model_name_map, self.ref_prefix)
 
     def get_path_operation_metadata(self, method: str):
         view = self.view
@@ -52,13 +192,8 @@ class OpenapiPathHandler(object):
             self,
             manager: ParserManager,
     ) -> dict:
-        schema = model_process_schema(
-            manager.model,
-            model_name_map=self.model_name_map,
-            ref_prefix=self.ref_prefix
-        )[0]
-        properties: dict = schema['properties']
-        for parser in self.view.parser_manager.depend_parsers:
+        properties = dict(self.model_process_schema(manager.model)[0]['properties'])
+        for parser in dict.fromkeys(step.parser for step in manager.depend_plan):
             schema = self.model_process_schema(parser.model)[0]
             properties.update(schema['properties'])
 
@@ -76,7 +211,7 @@ class OpenapiPathHandler(object):
                 in_ = in_.value
             name = field.alias
             parameters.append({
-                "name": name,
+                "name": get_header_name(field) if in_ == "header" else name,
                 "in": in_,
                 "required": field.required,
                 "schema": properties[name]
@@ -84,38 +219,54 @@ class OpenapiPathHandler(object):
 
         return parameters
 
+    def get_responses(self) -> dict:
+        response = {"description": "Successful Response"}
+        serializer = self.view.response_serializer
+        if serializer is not None:
+            schema = self.schema_cache.field_schema(serializer.field, self.model_name_map, self.ref_prefix)
+            response["content"] = {"application/json": {"schema": schema}}
+        return {"200": response}
+
     def get_openapi_path(self):
         view = self.view
         if not view.include_in_schema and view.path is not None:
             return
         path = {}
+        # 参数与请求方法无关, 只生成一次, 每个方法使用自己的拷贝
+        parameters = self.get_parameters_from_parser_manager(view.parser_manager)
+        responses = self.get_responses()
         for method in view.methods:
             method = method.lower()
             operation = self.get_path_operation_metadata(method)
-            operation['parameters'] = self.get_parameters_from_parser_manager(view.parser_manager)
-            operation['responses'] = {
-                "200": {
-                    "description": "Successful Response",
-                }
-            }
+            operation['parameters'] = copy_document(parameters)
+            operation['responses'] = copy_document(responses)
 
             path[method] = operation
         return path
 
 
-def get_views_flat_models(views: Iterable[View]):
+def get_views_flat_models(views: Iterable[View], schema_cache: Optional[SchemaCache] = None):
+    if schema_cache is None:
+        schema_cache = default_schema_cache
     flag_models = set()
     for view in views:
-        flag_models |= get_flat_models_from_model(view.parser_manager.model)
+        flag_models |= schema_cache.get_view_flat_models(view)
 
     return flag_models
 
 
-def get_views_models_definitions(flat_models: TypeModelSet, model_name_map: dict):
+def get_views_models_definitions(
+        flat_models: TypeModelSet,
+        model_name_map: dict,
+        schema_cache: Optional[SchemaCache] = None,
+):
+    """返回的definitions中的schema与schema_cache共享, 不能修改"""
+    if schema_cache is None:
+        schema_cache = default_schema_cache
     definitions = {}
     for model in flat_models:
-        m_schema, m_definitions, m_nested_models = model_process_schema(
-            model, model_name_map=model_name_map, ref_prefix="#/components/schemas/"
+        m_schema, m_definitions, m_nested_models = schema_cache.model_process_schema(
+            model, model_name_map, REF_PREFIX
         )
         definitions.update(m_definitions)
         model_name = model_name_map[model]
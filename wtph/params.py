@@ -62,6 +62,31 @@ class Query(Param):
     in_ = ParamTypes.query
 
 
+class Path(Param):
+    in_ = ParamTypes.path
+
+    def __init__(self, default: Any = ..., **kwargs: Any):
+        """路由中的变量, 从flask的view_args中读取并校验, 只能是必填的"""
+        if default is not ...:
+            raise ValueError("Path params must be required, default should be ...")
+        super().__init__(default, **kwargs)
+
+
+class Header(Param):
+    in_ = ParamTypes.header
+
+    def __init__(self, default: Any, *, convert_underscores: bool = True, **kwargs: Any):
+        """
+        :param convert_underscores: 没有指定alias时, 把参数名中的_转换为-作为header名称
+        """
+        self.convert_underscores = convert_underscores
+        super().__init__(default, **kwargs)
+
+
+class Cookie(Param):
+    in_ = ParamTypes.cookie
+
+
 class Body(Param):
     pass
 
@@ -70,14 +95,83 @@ class Form(Body):
     pass
 
 
+class File(Param):
+    media_type = "multipart/form-data"
+
+    def __init__(self, default: Any, *, max_size: Optional[int] = None, **kwargs: Any):
+        """multipart/form-data中的文件字段, 类型声明为UploadFile或者List[UploadFile]
+
+        :param max_size: 每个文件的最大字节数, 超过时立即停止读取请求体并返回413
+        """
+        if max_size is not None and max_size < 0:
+            raise ValueError("max_size must be greater than or equal to 0")
+        self.max_size = max_size
+        super().__init__(default, **kwargs)
+
+
+class BatchBody(Body):
+    def __init__(
+            self,
+            default: Any,
+            *,
+            chunk_size: int = 1000,
+            columnar: bool = False,
+            max_item_errors: Optional[int] = None,
+            **kwargs: Any,
+    ):
+        """List[Model]类型的请求体字段, 按列批量校验, 不为每一项创建model实例
+
+        :param chunk_size: 每批校验的条目数量, 每批结束时检查错误数量
+        :param columnar: 为True时返回{字段名: [值, ...]}的列式结果, 否则返回dict的列表
+        :param max_item_errors: 错误数量达到该值后不再校验剩余的条目
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be greater than 0")
+        self.chunk_size = chunk_size
+        self.columnar = columnar
+        self.max_item_errors = max_item_errors
+        super().__init__(default, **kwargs)
+
+
+class DependScopes(Enum):
+    request = "request"
+    app = "app"
+
+
 class Depends:
     def __init__(
-            self, dependency: Callable[..., Any], *, use_cache: bool = True
+            self,
+            dependency: Callable[..., Any],
+            *,
+            use_cache: bool = True,
+            scope: str = "request",
+            ttl: Optional[float] = None,
+            maxsize: Optional[int] = 128,
+            share_in_batch: bool = False,
     ):
+        """
+        :param use_cache: 同一个请求中是否复用依赖的结果
+        :param scope: "request"只在请求内缓存; "app"在应用范围内以依赖及其校验后的参数为key缓存结果
+        :param ttl: scope="app"时缓存的有效秒数, None表示不过期
+        :param maxsize: scope="app"时缓存的最大数量, 超出后淘汰最久未使用的, None表示不限制;
+            同一个依赖在多处声明scope="app"时, ttl与maxsize必须相同
+        :param share_in_batch: 批量请求开启share_dependencies时, 以校验后的参数为key在子请求之间共享结果;
+            只有结果完全由声明的参数决定(不读取request的header, cookie等)的依赖才能开启
+        """
+        scope = DependScopes(scope)
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be greater than 0")
+        if maxsize is not None and maxsize <= 0:
+            raise ValueError("maxsize must be greater than 0")
         self.dependency = dependency
         self.use_cache = use_cache
+        self.scope = scope
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.share_in_batch = share_in_batch
 
     def __repr__(self) -> str:
         attr = getattr(self.dependency, "__name__", type(self.dependency).__name__)
         cache = "" if self.use_cache else ", use_cache=False"
-        return f"{self.__class__.__name__}({attr}{cache})"
+        scope = "" if self.scope is DependScopes.request else ", scope='%s'" % self.scope.value
+        return f"{self.__class__.__name__}({attr}{cache}{scope})"
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/6 16:25
+from typing import List
+
+from pydantic.fields import ModelField
+
+from .base import ParserManagerFactory, ParserManager, Parser, BaseMultiItemParser
+from ..asgi import get_request
+from ..params import Query, Path, Header, Cookie, Body, Form
+from ..utils import is_scalar_sequence_field, get_header_name
+
+asgi_parser_manager_factory = ParserManagerFactory()
+
+
+@asgi_parser_manager_factory.register_parser
+class ASGIQueryParser(BaseMultiItemParser):
+    __slots__ = ()
+    param_class = Query
+
+    def get_source(self, *args, **kwargs):
+        return get_request().query_params
+
+
+@asgi_parser_manager_factory.register_parser
+class ASGIPathParser(Parser):
+    """路由中的变量, ASGIApp以关键字参数传给视图"""
+    __slots__ = ()
+    param_class = Path
+
+    def get_source(self, *args, **kwargs):
+        return kwargs
+
+    def parse(self, *args, **kwargs):
+        source = self.get_source(*args, **kwargs)
+        return {field.alias: source[field.alias] for field in self.fields if field.alias in source}
+
+
+def split_header(headers: dict, key: str) -> List[str]:
+    return [value.strip() for value in headers[key].split(",")]
+
+
+@asgi_parser_manager_factory.register_parser
+class ASGIHeaderParser(Parser):
+    """header名称在注册时转换为小写, 请求时直接查找"""
+    __slots__ = ("field_keys",)
+    param_class = Header
+
+    def __init__(self, fields: List[ModelField], manager: ParserManager):
+        super().__init__(fields, manager)
+        self.field_keys = tuple(
+            (field.alias, get_header_name(field).lower(), is_scalar_sequence_field(field))
+            for field in fields
+        )
+
+    def get_source(self, *args, **kwargs):
+        return get_request().headers
+
+    def get_field_readers(self):
+        return [(alias, split_header if multi else "get", key) for alias, key, multi in self.field_keys]
+
+    def parse(self, *args, **kwargs):
+        data = {}
+        headers = self.get_source(*args, **kwargs)
+        for alias, key, multi in self.field_keys:
+            if key in headers:
+                data[alias] = split_header(headers, key) if multi else headers[key]
+        return data
+
+
+@asgi_parser_manager_factory.register_parser
+class ASGICookieParser(Parser):
+    __slots__ = ()
+    param_class = Cookie
+
+    def get_source(self, *args, **kwargs):
+        return get_request().cookies
+
+    def parse(self, *args, **kwargs):
+        cookies = self.get_source(*args, **kwargs)
+        return {field.alias: cookies[field.alias] for field in self.fields if field.alias in cookies}
+
+
+@asgi_parser_manager_factory.register_parser
+class ASGIFormParser(BaseMultiItemParser):
+    """只支持application/x-www-form-urlencoded"""
+    __slots__ = ()
+    param_class = Form
+
+    def get_source(self, *args, **kwargs):
+        return get_request().form
+
+
+@asgi_parser_manager_factory.register_parser
+class ASGIBodyParser(Parser):
+    __slots__ = ()
+    param_class = Body
+
+    def get_source(self, *args, **kwargs):
+        """json对象之外的请求体(数组, 标量, null)没有可以提取的字段, 返回None"""
+        rj = get_request().json
+        return rj if isinstance(rj, dict) else None
+
+    def parse(self, *args, **kwargs):
+        rj = self.get_source(*args, **kwargs)
+        if rj is None:
+            return {}
+        return {field.alias: rj[field.alias] for field in self.fields if field.alias in rj}
@@ -1,15 +1,28 @@
 # -*- coding: utf-8 -*-
 # @Time: 2021/8/15 18:00
-from typing import Type, List, Optional, TYPE_CHECKING, Any, Callable, Dict
+import asyncio
+from typing import Type, List, Optional, TYPE_CHECKING, Any, Callable, Dict, NamedTuple, Tuple
 
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, ValidationError, validate_model
 from pydantic.fields import FieldInfo, ModelField
 
-from ..utils import generate_model_from_callable, is_scalar_sequence_field, get_name
-from ..params import Depends, Param
+from ..utils import (
+    generate_model_from_callable,
+    is_scalar_sequence_field,
+    get_name,
+    validate_fields,
+    is_coroutine_callable,
+    run_in_threadpool,
+)
+from ..params import Depends, Param, DependScopes, BatchBody
+from ..exceptions import ConfigError
+from ..batch import BatchValidator
+from ..cache import LRUCache, get_dependency_cache, get_shared_cache, make_cache_key
+from .compiler import compile_extractor
 
 if TYPE_CHECKING:
     from pydantic.main import Model  # noqa
+    from ..instrument import Recorder
 
 ParserType = Type["Parser"]
 
@@ -29,37 +42,190 @@ def _check_parser(parser: ParserType):
         raise TypeError("parser(%s).param_class must be a subclass of FieldInfo" % parser)
 
 
+class DependStep(NamedTuple):
+    """依赖执行计划中的一步, edges为(参数名, 子依赖在计划中的下标), cache为应用范围的缓存"""
+    parser: "DependsParser"
+    key: Optional[Callable]
+    edges: Tuple[Tuple[str, int], ...]
+    level: int
+    cache: Optional[LRUCache]
+
+
+_unsolved = object()
+_no_exclude: frozenset = frozenset()
+
+
 class ParserManager(object):
+    # 大量路由时每个视图都有自己的ParserManager, 使用__slots__减少每个实例的内存
+    __slots__ = (
+        "_model",
+        "_from_factory",
+        "_fast_validate",
+        "_max_errors",
+        "_depend_registry",
+        "_parsers",
+        "_alias_parser",
+        "_error_locations",
+        "_batch_validators",
+        "_batch_exclude",
+        "_depends",
+        "_depend_parsers",
+        "_depend_plan",
+        "_depend_edges",
+        "_extractor",
+        "_compiled",
+    )
+
     def __init__(
             self,
             model: Type[BaseModel],
             from_factory: "ParserManagerFactory",
-            name_depend_map: Dict[str, Depends]
+            name_depend_map: Dict[str, Depends],
+            *,
+            fast_validate: bool = False,
+            max_errors: Optional[int] = None,
+            depend_registry: Optional[Dict[Callable, "DependsParser"]] = None,
     ):
         self._model = model
         self._from_factory = from_factory
-        self._parsers = self.get_parsers()
-        self._depend_parsers: List["DependsParser"] = [
-            DependsParser.from_name_depend(name, depend, self)
-            for name, depend in name_depend_map.items()
-        ]
+        self._fast_validate = fast_validate
+        self._max_errors = max_errors
+        # 同一个视图中相同的依赖只会生成一个DependsParser
+        self._depend_registry = depend_registry if depend_registry is not None else {}
+        self._parsers: Tuple[Parser, ...] = tuple(self.get_parsers())
+        # alias -> parser与alias -> 错误的loc, 校验失败时直接查表;
+        # 一个字段可能被多个parser匹配(例如Form是Body的子类), 以先注册的parser为准
+        self._alias_parser: Dict[str, Parser] = {}
+        self._error_locations: Dict[str, tuple] = {}
+        for parser in self._parsers:
+            location = parser.param_class.__name__.lower()
+            for field in parser.fields:
+                self._alias_parser.setdefault(field.alias, parser)
+                self._error_locations.setdefault(field.alias, (location, field.alias))
+        # 没有parser读取的字段在每个请求中都是缺失的, 注册时报错(例如ASGI模式下的File)
+        for field in model.__fields__.values():
+            if field.alias not in self._alias_parser:
+                raise ConfigError("%s param: %s is not supported by the parsers of %s" % (
+                    type(field.field_info).__name__, field.name, get_name(model)
+                ))
+        # BatchBody字段单独按列校验, 不经过model
+        self._batch_validators: Dict[str, BatchValidator] = {
+            field.alias: BatchValidator(field, fast_validate=fast_validate, max_errors=max_errors)
+            for field in model.__fields__.values()
+            if isinstance(field.field_info, BatchBody)
+        }
+        # 没有BatchBody时使用共享的空frozenset
+        self._batch_exclude = frozenset(
+            name for name, field in model.__fields__.items() if field.alias in self._batch_validators
+        ) or _no_exclude
+        self._depends: Tuple[Tuple[str, Depends], ...] = tuple(name_depend_map.items())
+        self._depend_parsers: Tuple["DependsParser", ...] = tuple(
+            self.get_depend_parser(name, depend)
+            for name, depend in self._depends
+        )
+        self._depend_plan: Optional[Tuple[DependStep, ...]] = None
+        self._depend_edges: Tuple[Tuple[str, int], ...] = ()
+        self._extractor: Callable = self.extract
+        self._compiled = False
 
     @property
     def model(self):
         return self._model
 
     @property
-    def depend_parsers(self) -> List["DependsParser"]:
+    def parsers(self) -> Tuple["Parser", ...]:
+        return self._parsers
+
+    @property
+    def depend_parsers(self) -> Tuple["DependsParser", ...]:
         return self._depend_parsers
 
     @property
     def depend_params_name(self) -> List[str]:
-        return [parser.name for parser in self._depend_parsers]
+        return [name for name, _ in self._depends]
 
     @property
     def from_factory(self) -> "ParserManagerFactory":
         return self._from_factory
 
+    @property
+    def depend_registry(self) -> Dict[Callable, "DependsParser"]:
+        return self._depend_registry
+
+    @property
+    def fast_validate(self) -> bool:
+        return self._fast_validate
+
+    @property
+    def max_errors(self) -> Optional[int]:
+        return self._max_errors
+
+    @property
+    def compiled(self) -> bool:
+        return self._compiled
+
+    def get_depend_parser(self, name: str, depend: Depends) -> "DependsParser":
+        parser = self._depend_registry.get(depend.dependency)
+        if parser is None:
+            parser_class = self._from_factory.depend_parser_class
+            parser = parser_class.from_name_depend(name, depend, self)
+        return parser
+
+    @property
+    def depend_plan(self) -> Tuple[DependStep, ...]:
+        """把依赖树展开为拓扑排序后的执行计划, 共享的依赖只会出现一次(use_cache=False的除外)"""
+        if self._depend_plan is None:
+            return self.build_depend_plan()
+        return self._depend_plan
+
+    def build_depend_plan(self) -> Tuple[DependStep, ...]:
+        self._depend_plan, self._depend_edges = self._build_depend_plan()
+        return self._depend_plan
+
+    def _build_depend_plan(self):
+        plan: List[DependStep] = []
+        cached_index: Dict[Callable, int] = {}
+        visiting = set()
+
+        def visit(manager: "ParserManager"):
+            edges = []
+            for (name, depend), parser in zip(manager._depends, manager._depend_parsers):
+                use_cache = depend.use_cache
+                if use_cache and parser.dependency in cached_index:
+                    edges.append((name, cached_index[parser.dependency]))
+                    continue
+                if parser in visiting:
+                    raise ValueError("circular dependency: %s" % get_name(parser.dependency))
+                visiting.add(parser)
+                child_edges = visit(parser)
+                visiting.discard(parser)
+                level = max([plan[index].level + 1 for _, index in child_edges], default=0)
+                plan.append(DependStep(
+                    parser,
+                    parser.dependency if use_cache else None,
+                    tuple(child_edges),
+                    level,
+                    get_dependency_cache(depend) if depend.scope is DependScopes.app else None,
+                ))
+                if use_cache:
+                    cached_index[parser.dependency] = len(plan) - 1
+                edges.append((name, len(plan) - 1))
+            return edges
+
+        edges = tuple(visit(self))
+        return tuple(plan), edges
+
+    def compile(self):
+        """将参数提取编译为直线式的函数, 依赖的parser也会一并编译"""
+        self.compile_extractor()
+        for step in self.depend_plan:
+            step.parser.compile_extractor()
+
+    def compile_extractor(self):
+        if not self._compiled:
+            self._extractor = compile_extractor(self._parsers, get_name(self._model))
+            self._compiled = True
+
     def get_parsers(
             self,
             parser_manager_factory: "ParserManagerFactory" = None
@@ -81,39 +247,229 @@ class ParserManager(object):
     def has_depend_parser(self) -> bool:
         return len(self._depend_parsers) != 0
 
+    def has_async_dependency(self) -> bool:
+        return any(step.parser.is_async for step in self.depend_plan)
+
     def get_parser_by_field_name(self, field_name: str):
-        for parser in self._parsers:
-            for field in parser.fields:
-                if field.alias == field_name:
-                    return parser
-        return None
+        return self._alias_parser.get(field_name)
+
+    def iter_error_locations(self):
+        """返回当前以及所有依赖中可能出现的错误loc"""
+        yield from self._error_locations.values()
+        for step in self.depend_plan:
+            yield from step.parser._error_locations.values()
 
-    def parse(self, *args, __depend_cache__, **kwargs):
+    def extract(self, *args, **kwargs) -> dict:
         data = {}
+        for parser in self._parsers:
+            data.update(parser.parse(*args, **kwargs))
+        return data
+
+    def validate(self, data: dict):
+        """校验提取出来的数据, 返回(values, errors)
+
+        fast_validate时直接校验为values, 不创建model实例也不经过.dict()的递归拷贝,
+        嵌套的model与列表会以校验后的对象传递给视图函数;
+        max_errors不为None时逐个字段校验, 错误数量达到max_errors后不再校验剩余字段
+        """
+        if self._batch_validators:
+            return self.validate_batch(data)
+        if self._max_errors is not None:
+            values, errors = validate_fields(self._model, data, self._max_errors)
+            if errors:
+                return data, errors
+            if not self._fast_validate:
+                values = self._model.construct(**values).dict()
+            return values, []
+        if self._fast_validate:
+            values, _, error = validate_model(self._model, data)
+            if error is not None:
+                return data, error.errors()
+            return values, []
+        try:
+            return self._model(**data).dict(), []
+        except ValidationError as e:
+            return data, e.errors()
+
+    def validate_batch(self, data: dict):
+        """BatchBody字段由BatchValidator校验, 其他字段逐个字段校验"""
+        max_errors = self._max_errors
+        batch_values = {}
         errors = []
-        if self.has_common_parser():
-            for parser in self._parsers:
-                data.update(parser.parse(*args, **kwargs))
-            try:
-                data = self._model(**data).dict()
-            except ValidationError as e:
-                errors_ = e.errors()
-                for err in errors_:
-                    field_name = err['loc'][0]
-                    parser = self.get_parser_by_field_name(field_name)
-                    assert parser is not None
-                    err['loc'] = (parser.param_class.__name__.lower(), field_name)
+        for alias, validator in self._batch_validators.items():
+            value, errors_ = validator.validate(data)
+            if errors_:
                 errors.extend(errors_)
-        if self.has_depend_parser():
-            for parser in self._depend_parsers:
-                result, errors_ = parser.parse(*args, __depend_cache__=__depend_cache__, **kwargs)
-                if errors_:
-                    errors.extend(errors_)
-                data[parser.name] = result
+            else:
+                batch_values[validator.field.name] = value
+        values, errors_ = validate_fields(self._model, data, max_errors, exclude=self._batch_exclude)
+        errors.extend(errors_)
+        if errors:
+            if max_errors is not None:
+                del errors[max_errors:]
+            return data, errors
+        if not self._fast_validate:
+            values = self._model.construct(**values).dict()
+        values.update(batch_values)
+        return values, []
+
+    def parse_common(self, *args, __recorder__: Optional["Recorder"] = None, **kwargs):
+        """提取并校验当前model中的字段(不包括依赖), 返回(values, errors)"""
+        if not self.has_common_parser():
+            return {}, []
+        if __recorder__ is None:
+            data, errors = self.validate(self._extractor(*args, **kwargs))
+        else:
+            timer = __recorder__.timer
+            start = timer()
+            extracted = self._extractor(*args, **kwargs)
+            end = timer()
+            data, errors = self.validate(extracted)
+            __recorder__.add("extract", end - start)
+            __recorder__.add("validate", timer() - end)
+        if errors:
+            error_locations = self._error_locations
+            batch_validators = self._batch_validators
+            for err in errors:
+                loc = err['loc']
+                if batch_validators and loc[0] in batch_validators:
+                    # 批量校验的错误保留条目的下标与字段
+                    err['loc'] = error_locations[loc[0]] + tuple(loc[1:])
+                else:
+                    err['loc'] = error_locations[loc[0]]
+        return data, errors
+
+    def _prepare_step(self, step: DependStep, results: list, errors: list, *args, **kwargs):
+        """提取校验依赖的参数并填充子依赖的结果, 返回None表示这个依赖不能执行"""
+        data, errors_ = step.parser.parse_common(*args, **kwargs)
+        if errors_:
+            errors.extend(errors_)
+            return None
+        for name, index in step.edges:
+            result = results[index]
+            if result is _unsolved:
+                return None
+            data[name] = result
+        return data
+
+    def solve_dependencies(
+            self,
+            *args,
+            __depend_cache__,
+            errors: list,
+            __recorder__: Optional["Recorder"] = None,
+            **kwargs
+    ) -> list:
+        """按执行计划依次执行依赖, 返回与计划对应的结果列表"""
+        plan = self.depend_plan
+        max_errors = self._max_errors
+        results = [_unsolved] * len(plan)
+        for i, step in enumerate(plan):
+            if max_errors is not None and len(errors) >= max_errors:
+                break
+            key = step.key
+            if key is not None and key in __depend_cache__:
+                results[i] = __depend_cache__[key]
+                if __recorder__ is not None:
+                    __recorder__.count("depend_cache_hits")
+                continue
+            data = self._prepare_step(step, results, errors, *args, __recorder__=__recorder__, **kwargs)
+            if data is None:
+                continue
+            cache = step.cache
+            if cache is None and key is not None and step.parser.share_in_batch:
+                cache = get_shared_cache(key)
+            if __recorder__ is None:
+                results[i] = step.parser.call(data, cache)
+            else:
+                timer = __recorder__.timer
+                start = timer()
+                results[i] = step.parser.call(data, cache, __recorder__)
+                __recorder__.add(step.parser.phase, timer() - start)
+            if key is not None:
+                __depend_cache__[key] = results[i]
+        return results
+
+    async def solve_dependencies_async(
+            self,
+            *args,
+            __depend_cache__,
+            errors: list,
+            __recorder__: Optional["Recorder"] = None,
+            **kwargs
+    ) -> list:
+        """与solve_dependencies相同, 同一层级(互不依赖)的依赖通过asyncio.gather并发执行"""
+        plan = self.depend_plan
+        max_errors = self._max_errors
+        results = [_unsolved] * len(plan)
+
+        async def solve(i: int, step: DependStep):
+            key = step.key
+            if key is not None and key in __depend_cache__:
+                results[i] = __depend_cache__[key]
+                if __recorder__ is not None:
+                    __recorder__.count("depend_cache_hits")
+                return
+            data = self._prepare_step(step, results, errors, *args, __recorder__=__recorder__, **kwargs)
+            if data is None:
+                return
+            cache = step.cache
+            if cache is None and key is not None and step.parser.share_in_batch:
+                cache = get_shared_cache(key)
+            if __recorder__ is None:
+                result = await step.parser.call_async(data, cache)
+            else:
+                # 并发执行时记录的是每个依赖自己的耗时, 总和可能大于实际的墙钟时间
+                timer = __recorder__.timer
+                start = timer()
+                result = await step.parser.call_async(data, cache, __recorder__)
+                __recorder__.add(step.parser.phase, timer() - start)
+            results[i] = result
+            if key is not None:
+                __depend_cache__[key] = result
+
+        levels: Dict[int, list] = {}
+        for i, step in enumerate(plan):
+            levels.setdefault(step.level, []).append((i, step))
+        for level in sorted(levels):
+            if max_errors is not None and len(errors) >= max_errors:
+                break
+            steps = levels[level]
+            if len(steps) == 1:
+                await solve(*steps[0])
+            else:
+                await asyncio.gather(*[solve(i, step) for i, step in steps])
+        return results
+
+    def parse(self, *args, __depend_cache__, __recorder__: Optional["Recorder"] = None, **kwargs):
+        data, errors = self.parse_common(*args, __recorder__=__recorder__, **kwargs)
+        max_errors = self._max_errors
+        if self.has_depend_parser() and (max_errors is None or len(errors) < max_errors):
+            results = self.solve_dependencies(
+                *args, __depend_cache__=__depend_cache__, errors=errors, __recorder__=__recorder__, **kwargs
+            )
+            for name, index in self._depend_edges:
+                data[name] = results[index]
+        if max_errors is not None and len(errors) > max_errors:
+            del errors[max_errors:]
+        return data, errors
+
+    async def parse_async(self, *args, __depend_cache__, __recorder__: Optional["Recorder"] = None, **kwargs):
+        data, errors = self.parse_common(*args, __recorder__=__recorder__, **kwargs)
+        max_errors = self._max_errors
+        if self.has_depend_parser() and (max_errors is None or len(errors) < max_errors):
+            results = await self.solve_dependencies_async(
+                *args, __depend_cache__=__depend_cache__, errors=errors, __recorder__=__recorder__, **kwargs
+            )
+            for name, index in self._depend_edges:
+                data[name] = results[index]
+        if max_errors is not None and len(errors) > max_errors:
+            del errors[max_errors:]
         return data, errors
 
 
 class DependsParser(ParserManager):
+    __slots__ = ("_name", "_depend", "_dependency", "_is_async", "_phase", "_parent")
     __depend_parser__ = True
 
     def __init__(
@@ -124,12 +480,27 @@ class DependsParser(ParserManager):
             parent: "ParserManager",
             from_factory: "ParserManagerFactory",
             name_depend_map: Dict[str, Depends],
+            *,
+            fast_validate: bool = False,
+            max_errors: Optional[int] = None,
     ):
+        # name, depend与parent为第一次使用这个依赖的位置, 依赖在同一个视图中是共享的
         self._name = name
         self._depend = depend
         self._dependency = depend.dependency
+        self._is_async = is_coroutine_callable(depend.dependency)
+        self._phase = "depend.%s" % get_name(depend.dependency)
         self._parent = parent
-        super().__init__(model, from_factory, name_depend_map)
+        # 先注册再解析子依赖, 循环依赖会在生成执行计划时报错而不是无限递归
+        parent.depend_registry[self._dependency] = self
+        super().__init__(
+            model,
+            from_factory,
+            name_depend_map,
+            fast_validate=fast_validate,
+            max_errors=max_errors,
+            depend_registry=parent.depend_registry,
+        )
 
     @property
     def name(self):
@@ -139,6 +510,23 @@ class DependsParser(ParserManager):
     def parent(self):
         return self._parent
 
+    @property
+    def dependency(self) -> Callable:
+        return self._dependency
+
+    @property
+    def is_async(self) -> bool:
+        return self._is_async
+
+    @property
+    def share_in_batch(self) -> bool:
+        return self._depend.share_in_batch
+
+    @property
+    def phase(self) -> str:
+        """记录耗时时使用的阶段名称"""
+        return self._phase
+
     @classmethod
     def from_name_depend(
             cls,
@@ -156,21 +544,41 @@ class DependsParser(ParserManager):
             from_factory=from_factory,
             name_depend_map=name_depend_map,
             model=model,
+            fast_validate=parent.fast_validate,
+            max_errors=parent.max_errors,
         )
 
-    def parse(self, *args, __depend_cache__, **kwargs):
-        use_cache = self._depend.use_cache
-        dependency = self._dependency
-        key = dependency
-
-        if use_cache and key in __depend_cache__:
-            return __depend_cache__[key]
-
-        data, errors = super().parse(*args, __depend_cache__=__depend_cache__, **kwargs)
-        result = dependency(**data)
-        if use_cache:
-            __depend_cache__[key] = result
-        return result, errors
+    def call(self, data: dict, cache: Optional[LRUCache] = None, recorder: Optional["Recorder"] = None):
+        """调用依赖, cache不为None时以校验后的参数为key跨请求缓存结果"""
+        if cache is None:
+            return self._dependency(**data)
+        key = make_cache_key(data)
+        if key is None:
+            return self._dependency(**data)
+        result = cache.get(key, _unsolved)
+        if result is _unsolved:
+            result = self._dependency(**data)
+            cache.set(key, result)
+        elif recorder is not None:
+            recorder.count("depend_cache_hits")
+        return result
+
+    async def call_async(self, data: dict, cache: Optional[LRUCache] = None, recorder: Optional["Recorder"] = None):
+        key = None if cache is None else make_cache_key(data)
+        if key is not None:
+            result = cache.get(key, _unsolved)
+            if result is not _unsolved:
+                if recorder is not None:
+                    recorder.count("depend_cache_hits")
+                return result
+        if self._is_async:
+            result = await self._dependency(**data)
+        else:
+            # 同步的依赖在线程池中执行, 不阻塞事件循环
+            result = await run_in_threadpool(self._dependency, **data)
+        if key is not None:
+            cache.set(key, result)
+        return result
 
 
 class ParserManagerFactory(object):
@@ -189,15 +597,20 @@ class ParserManagerFactory(object):
         self.parser_classes[name.lower()] = parser
         return parser
 
-    def __call__(self, model: Type[BaseModel], name_depend_map) -> ParserManager:
-        return ParserManager(model, self, name_depend_map)
+    def __call__(self, model: Type[BaseModel], name_depend_map, **options) -> ParserManager:
+        manager = ParserManager(model, self, name_depend_map, **options)
+        # 注册时生成依赖的执行计划, 循环依赖在这里就会报错
+        manager.build_depend_plan()
+        return manager
 
 
 class Parser(object):
+    """子类中实例的属性需要声明在__slots__中, 没有声明__slots__的子类与普通的类相同"""
+    __slots__ = ("fields", "manager")
     param_class: Type[Param]
 
     def __init__(self, fields: List[ModelField], manager: ParserManager):
-        self.fields = fields
+        self.fields: Tuple[ModelField, ...] = tuple(fields)
         self.manager = manager
 
     def has_parser(self) -> bool:
@@ -212,8 +625,19 @@ class Parser(object):
 
         return cls(fields, parser_manager)
 
+    def get_source(self, *args, **kwargs) -> Any:
+        """返回字段所在的数据源, 为None时表示本次请求没有数据"""
+        raise NotImplementedError
+
+    def get_field_readers(self):
+        """返回(alias, reader)或者(alias, reader, key), 用于编译
+
+        reader为"get", "getlist"或者接受(source, key)的函数, key为数据源中的key, 默认与alias相同
+        """
+        return [(field.alias, "get") for field in self.fields]
+
     def parse(self, *args, **kwargs):
-        raise NotImplemented
+        raise NotImplementedError
 
 
 def single_get(obj, key) -> Any:
@@ -225,19 +649,39 @@ def multi_get(obj, key) -> Any:
 
 
 class BaseMultiItemParser(Parser):
+    __slots__ = ("field_getters",)
     single_get = staticmethod(single_get)
     multi_get = staticmethod(multi_get)
 
     def __init__(self, fields: List[ModelField], manager: ParserManager):  # noqa
         self.manager = manager
-        field_getters = []
-        for field in fields:
-            if is_scalar_sequence_field(field):
-                field_getters.append((field, self.multi_get))
-            else:
-                field_getters.append((field, self.single_get))
-        self.field_getters = field_getters
-        self.fields = fields
+        self.field_getters = tuple(
+            (field, self.multi_get if is_scalar_sequence_field(field) else self.single_get)
+            for field in fields
+        )
+        self.fields = tuple(fields)
 
     def has_parser(self) -> bool:
         return len(self.field_getters) != 0
+
+    def get_field_readers(self):
+        readers = []
+        for field, getter in self.field_getters:
+            if getter is single_get:
+                readers.append((field.alias, "get"))
+            elif getter is multi_get:
+                readers.append((field.alias, "getlist"))
+            else:
+                readers.append((field.alias, getter))
+        return readers
+
+    def parse(self, *args, **kwargs):
+        data = {}
+        source = self.get_source(*args, **kwargs)
+        if source is None:
+            return data
+        for field, getter in self.field_getters:
+            if field.alias in source:
+                data[field.alias] = getter(source, field.alias)
+
+        return data
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/9 20:41
+from typing import Callable, List, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .base import Parser
+
+# 以dict保存每个key的值列表的类型(例如werkzeug的MultiDict), 编译后的函数直接通过dict.get读取
+_list_dict_types: Set[type] = set()
+
+
+def register_list_dict(cls: type) -> type:
+    """注册一个dict的子类, 它的每个value都是该key的值列表, getlist返回列表的拷贝, [key]返回第一个值"""
+    if not issubclass(cls, dict):
+        raise TypeError("%s must be a subclass of dict" % cls)
+    _list_dict_types.add(cls)
+    return cls
+
+
+def _overrides_get_source(parser: "Parser") -> bool:
+    from .base import Parser
+    return type(parser).get_source is not Parser.get_source
+
+
+def _emit_readers(lines: List[str], namespace: dict, i: int, source: str, readers: list, indent: str, lists: bool):
+    """lists为True时source是注册过的list dict"""
+    for j, item in enumerate(readers):
+        alias, reader = item[0], item[1]
+        name = repr(alias)
+        # 数据源中的key可以与alias不同, 例如header在environ中的key
+        key = repr(item[2]) if len(item) > 2 else name
+        if lists and reader in ("get", "getlist"):
+            lines.append("%svalue = _dict_get(%s, %s)" % (indent, source, key))
+            lines.append("%sif value:" % indent)
+            lines.append("%s    data[%s] = %s" % (indent, name, "value[0]" if reader == "get" else "list(value)"))
+            continue
+        lines.append("%sif %s in %s:" % (indent, key, source))
+        if reader == "get":
+            lines.append("%s    data[%s] = %s[%s]" % (indent, name, source, key))
+        elif reader == "getlist":
+            lines.append("%s    data[%s] = %s.getlist(%s)" % (indent, name, source, key))
+        else:
+            # 自定义的getter, 保持与解释执行相同的语义
+            getter = "getter_%d_%d" % (i, j)
+            namespace[getter] = reader
+            lines.append("%s    data[%s] = %s(%s, %s)" % (indent, name, getter, source, key))
+
+
+def compile_extractor(parsers: List["Parser"], label: str = "extract") -> Callable:
+    """将多个parser编译成一个直线式的提取函数
+
+    每个parser只取一次数据源, 每个alias只读取一次, 生成的函数与ParserManager.extract返回相同的dict;
+    没有实现get_source的parser(只实现了parse)直接调用parse
+    """
+    namespace = {"_dict_get": dict.get, "_list_dict_types": frozenset(_list_dict_types)}
+    lines = ["def extract(*args, **kwargs):", "    data = {}"]
+    for i, parser in enumerate(parsers):
+        if not _overrides_get_source(parser):
+            namespace["parse_%d" % i] = parser.parse
+            lines.append("    data.update(parse_%d(*args, **kwargs))" % i)
+            continue
+        source = "source_%d" % i
+        readers = parser.get_field_readers()
+        namespace["get_%s" % source] = parser.get_source
+        lines.append("    %s = get_%s(*args, **kwargs)" % (source, source))
+        lines.append("    if %s is not None:" % source)
+        if namespace["_list_dict_types"] and any(item[1] in ("get", "getlist") for item in readers):
+            lines.append("        if type(%s) in _list_dict_types:" % source)
+            _emit_readers(lines, namespace, i, source, readers, " " * 12, True)
+            lines.append("        else:")
+            _emit_readers(lines, namespace, i, source, readers, " " * 12, False)
+        else:
+            _emit_readers(lines, namespace, i, source, readers, " " * 8, False)
+    lines.append("    return data")
+    code = "\n".join(lines)
+    exec(compile(code, "<wtph compiled %s>" % label, "exec"), namespace)
+    func = namespace["extract"]
+    func.__source__ = code
+    return func
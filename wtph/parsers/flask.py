@@ -1,51 +1,338 @@
 # -*- coding: utf-8 -*-
 # @Time: 2021/8/17 21:52
+from typing import Any, Dict, List, Optional
+
 from flask import request
+from pydantic.fields import ModelField
+from werkzeug.datastructures import FileStorage, MultiDict, ImmutableMultiDict
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.formparser import MultiPartParser
 
-from .base import ParserManagerFactory, Parser, BaseMultiItemParser
-from ..params import Query, Body, Form
+from .base import ParserManagerFactory, ParserManager, Parser, BaseMultiItemParser, DependsParser
+from .compiler import register_list_dict
+from .stream import JSONObjectScanner
+from ..exceptions import BodyParseError, BodyTooLarge
+from ..params import Query, Path, Header, Cookie, Body, Form, File
+from ..upload import UploadFile
+from ..utils import is_scalar_sequence_field, get_header_name, get_environ_key
+from ..config import config
 
 flask_parser_manager_factory = ParserManagerFactory()
 
+# request.args/form/cookies/files默认的类型, 编译后的提取函数直接读取它们的值列表
+register_list_dict(MultiDict)
+register_list_dict(ImmutableMultiDict)
+
 
 @flask_parser_manager_factory.register_parser
 class FlaskQueryParser(BaseMultiItemParser):
+    __slots__ = ()
     param_class = Query
 
-    def parse(self):
+    def get_source(self, *args, **kwargs):
+        return request.args
+
+
+@flask_parser_manager_factory.register_parser
+class FlaskPathParser(Parser):
+    """路由中的变量, flask以关键字参数传给视图"""
+    __slots__ = ()
+    param_class = Path
+
+    def get_source(self, *args, **kwargs):
+        return kwargs
+
+    def parse(self, *args, **kwargs):
+        source = self.get_source(*args, **kwargs)
+        return {field.alias: source[field.alias] for field in self.fields if field.alias in source}
+
+
+def split_header(environ: dict, key: str) -> List[str]:
+    """WSGI把同名的多个header合并为逗号分隔的一个值"""
+    return [value.strip() for value in environ[key].split(",")]
+
+
+@flask_parser_manager_factory.register_parser
+class FlaskHeaderParser(Parser):
+    """直接从environ读取header, environ的key在注册时计算, 请求时不再转换header名称"""
+    __slots__ = ("field_keys",)
+    param_class = Header
+
+    def __init__(self, fields: List[ModelField], manager: ParserManager):
+        super().__init__(fields, manager)
+        self.field_keys = tuple(
+            (field.alias, get_environ_key(get_header_name(field)), is_scalar_sequence_field(field))
+            for field in fields
+        )
+
+    def get_source(self, *args, **kwargs):
+        return request.environ
+
+    def get_field_readers(self):
+        return [(alias, split_header if multi else "get", key) for alias, key, multi in self.field_keys]
+
+    def parse(self, *args, **kwargs):
         data = {}
-        args = request.args
-        for field, getter in self.field_getters:
-            if field.alias in args:
-                data[field.alias] = getter(args, field.alias)
+        environ = self.get_source(*args, **kwargs)
+        for alias, key, multi in self.field_keys:
+            if key in environ:
+                data[alias] = split_header(environ, key) if multi else environ[key]
+        return data
+
+
+@flask_parser_manager_factory.register_parser
+class FlaskCookieParser(BaseMultiItemParser):
+    __slots__ = ()
+    param_class = Cookie
+
+    def get_source(self, *args, **kwargs):
+        return request.cookies
 
+
+class _LimitedReader(object):
+    def __init__(self, stream, max_size: Optional[int]):
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BodyTooLarge("request body exceeds %s bytes" % self.max_size)
         return data
 
 
+class UploadMultiPartParser(MultiPartParser):
+    """文件直接写入UploadFile, 声明了max_size的字段超出时立即中止解析"""
+
+    def __init__(self, limits: Dict[str, Optional[int]], spool_size: int, **kwargs):
+        super().__init__(**kwargs)
+        self.limits = limits
+        self.spool_size = spool_size
+
+    def start_file_streaming(self, event, total_content_length):
+        return UploadFile(
+            event.name,
+            event.filename,
+            event.headers.get("content-type"),
+            event.headers,
+            max_size=self.limits.get(event.name),
+            spool_size=self.spool_size,
+        )
+
+
+@flask_parser_manager_factory.register_parser
+class FlaskFileParser(BaseMultiItemParser):
+    """流式解析multipart/form-data, 文件写入spool_size以内在内存, 超过后在临时文件中的UploadFile
+
+    解析结果写入request.form与request.files的缓存, 同一个请求中的Form字段与request.files可以直接使用;
+    需要在FlaskFormParser之前注册, 否则request.form会先按werkzeug的默认方式解析整个请求体
+    """
+    __slots__ = ("limits",)
+    param_class = File
+    max_size: Optional[int] = None
+    spool_size: int = 1024 * 1024
+    chunk_size: int = 64 * 1024
+
+    def __init__(self, fields: List[ModelField], manager: ParserManager):  # noqa
+        self.manager = manager
+        self.fields = tuple(fields)
+        self.limits = {field.alias: field.field_info.max_size for field in fields}
+        self.field_getters = tuple(
+            (field, self.get_uploads if is_scalar_sequence_field(field) else self.get_upload)
+            for field in fields
+        )
+
+    def load_form_data(self):
+        max_size = self.max_size
+        content_length = request.content_length
+        if max_size is not None and content_length is not None and content_length > max_size:
+            raise RequestEntityTooLarge()
+        boundary = request.mimetype_params.get("boundary", "").encode("latin1")
+        if not boundary:
+            raise BadRequest("missing multipart boundary")
+        parser = UploadMultiPartParser(
+            self.limits,
+            self.spool_size,
+            max_form_memory_size=request.max_form_memory_size,
+            cls=request.parameter_storage_class,
+            buffer_size=self.chunk_size,
+            max_form_parts=request.max_form_parts,
+        )
+        try:
+            form, files = parser.parse(_LimitedReader(request.stream, max_size), boundary, content_length)
+        except BodyTooLarge:
+            raise RequestEntityTooLarge()
+        except ValueError as e:
+            raise BadRequest("failed to parse multipart body: %s" % e)
+        # 与werkzeug的Request._load_form_data相同, 之后访问request.form/files不会再解析
+        request.__dict__["form"] = form
+        request.__dict__["files"] = files
+
+    def get_source(self, *args, **kwargs):
+        if request.mimetype != "multipart/form-data":
+            return None
+        if "files" not in request.__dict__:
+            self.load_form_data()
+        return request.files
+
+    def to_upload(self, storage: FileStorage, alias: str) -> UploadFile:
+        stream = storage.stream
+        if isinstance(stream, UploadFile):
+            return stream
+        # request.form先被其他代码访问过, 文件已经按werkzeug的默认方式保存, 复制为UploadFile并检查大小
+        try:
+            return UploadFile.from_stream(
+                stream,
+                alias,
+                storage.filename,
+                storage.content_type,
+                storage.headers,
+                max_size=self.limits.get(alias),
+                spool_size=self.spool_size,
+            )
+        except BodyTooLarge:
+            raise RequestEntityTooLarge()
+
+    def get_upload(self, source, alias: str) -> UploadFile:
+        return self.to_upload(source[alias], alias)
+
+    def get_uploads(self, source, alias: str) -> List[UploadFile]:
+        return [self.to_upload(storage, alias) for storage in source.getlist(alias)]
+
+
 @flask_parser_manager_factory.register_parser
 class FlaskFormParser(BaseMultiItemParser):
+    __slots__ = ()
     param_class = Form
 
-    def parse(self):
-        data = {}
-        form = request.form
-        for field, getter in self.field_getters:
-            if field.alias in form:
-                data[field.alias] = getter(form, field.alias)
+    def get_source(self, *args, **kwargs):
+        return request.form
 
-        return data
+
+def get_json_body() -> Any:
+    """用config.codec解码的请求体, 结果缓存在request中, 视图与所有依赖的Body只解码一次; 不是json时返回None"""
+    cache = request.__dict__
+    if "_wtph_json" in cache:
+        return cache["_wtph_json"]
+    rj = None
+    if request.is_json:
+        data = request.get_data(cache=True)
+        if data:
+            try:
+                rj = config.codec.loads(data)
+            except ValueError as e:
+                raise BadRequest("failed to decode json body: %s" % e)
+    cache["_wtph_json"] = rj
+    return rj
 
 
 @flask_parser_manager_factory.register_parser
 class FlaskBodyParser(Parser):
+    __slots__ = ()
     param_class = Body
 
-    def parse(self):
+    def get_source(self, *args, **kwargs):
+        """json对象之外的请求体(数组, 标量, null)没有可以提取的字段, 返回None"""
+        rj = get_json_body()
+        return rj if isinstance(rj, dict) else None
+
+    def parse(self, *args, **kwargs):
         data = {}
-        rj = request.json
+        rj = self.get_source(*args, **kwargs)
         if rj is None:
-            return {}
+            return data
         for field in self.fields:
             if field.alias in rj:
                 data[field.alias] = rj[field.alias]
         return data
+
+
+class FlaskStreamBodyParser(Parser):
+    """增量读取请求体, 只解码声明的Body字段, 超过max_size返回413, json不合法或者超过max_depth返回400
+
+    请求体会被消费掉, 之后不能再通过request.json读取; 视图与所有依赖中的Body字段在一次扫描中解码,
+    结果缓存在request中
+    """
+    __slots__ = ("keys", "_view_keys")
+    param_class = Body
+    max_size: Optional[int] = 10 * 1024 * 1024
+    max_depth: Optional[int] = 32
+    chunk_size: int = 64 * 1024
+
+    def __init__(self, fields: List[ModelField], manager: ParserManager):
+        super().__init__(fields, manager)
+        self.keys = frozenset(field.alias for field in fields)
+        self._view_keys: Optional[frozenset] = None
+
+    def get_view_keys(self) -> frozenset:
+        """视图以及它的所有依赖中声明的Body字段, 第一次请求时计算"""
+        if self._view_keys is None:
+            manager = self.manager
+            while isinstance(manager, DependsParser):
+                manager = manager.parent
+            keys = set()
+            for item in (manager, *(step.parser for step in manager.depend_plan)):
+                for parser in item.parsers:
+                    if isinstance(parser, FlaskStreamBodyParser):
+                        keys.update(parser.keys)
+            self._view_keys = frozenset(keys)
+        return self._view_keys
+
+    def scan(self, keys: frozenset) -> Optional[dict]:
+        max_size = self.max_size
+        if max_size is not None and request.content_length is not None and request.content_length > max_size:
+            raise RequestEntityTooLarge()
+        scanner = JSONObjectScanner(
+            keys,
+            max_size=max_size,
+            max_depth=self.max_depth,
+            loads=config.codec.loads,
+        )
+        stream = request.stream
+        try:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                scanner.feed(chunk)
+            return scanner.close()
+        except BodyTooLarge:
+            raise RequestEntityTooLarge()
+        except BodyParseError as e:
+            raise BadRequest(str(e))
+
+    def get_source(self, *args, **kwargs):
+        if not request.is_json:
+            return None
+        # request.stream只能读取一次
+        cache = request.__dict__
+        if "_wtph_stream_json" not in cache:
+            cache["_wtph_stream_json"] = self.scan(self.get_view_keys())
+        return cache["_wtph_stream_json"]
+
+    def parse(self, *args, **kwargs):
+        source = self.get_source(*args, **kwargs)
+        if source is None:
+            return {}
+        return {key: value for key, value in source.items() if key in self.keys}
+
+
+def create_flask_stream_parser_manager_factory(
+        max_size: Optional[int] = FlaskStreamBodyParser.max_size,
+        max_depth: Optional[int] = FlaskStreamBodyParser.max_depth,
+        chunk_size: int = FlaskStreamBodyParser.chunk_size,
+) -> ParserManagerFactory:
+    """与flask_parser_manager_factory相同, 但是Body字段通过FlaskStreamBodyParser增量解析"""
+    parser_class = type(
+        "FlaskStreamBodyParser",
+        (FlaskStreamBodyParser,),
+        {"max_size": max_size, "max_depth": max_depth, "chunk_size": chunk_size},
+    )
+    factory = ParserManagerFactory(dict(flask_parser_manager_factory.parser_classes))
+    factory.register_parser(parser_class)
+    return factory
+
+
+flask_stream_parser_manager_factory = create_flask_stream_parser_manager_factory()
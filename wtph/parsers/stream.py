@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/23 14:05
+import json
+import re
+from typing import Callable, Iterable, Optional
+
+from ..exceptions import BodyParseError, BodyTooLarge
+
+_STRUCTURE = re.compile(rb'["{}\[\]]')
+_STRING = re.compile(rb'["\\]')
+_SCALAR_END = re.compile(rb'[,}\s]')
+_WHITESPACE = frozenset(b" \t\r\n")
+_QUOTE, _BACKSLASH = ord('"'), ord("\\")
+_OPENERS = frozenset(b"{[")
+
+_START, _KEY_OR_END, _KEY_START, _KEY, _COLON, _VALUE_START, _VALUE, _COMMA_OR_END, _DONE = range(9)
+
+
+class JSONObjectScanner(object):
+    """增量解析一个json object, 只解码keys中的顶层字段
+
+    通过feed传入请求体的分块, 没有声明的字段只做结构上的扫描(字符串, 括号的嵌套)而不会构造对象,
+    整个请求体的大小与嵌套的深度分别受max_size与max_depth限制, close返回解码后的字段
+    """
+
+    def __init__(
+            self,
+            keys: Iterable[str],
+            *,
+            max_size: Optional[int] = None,
+            max_depth: Optional[int] = None,
+            loads: Callable[[bytes], object] = json.loads,
+    ):
+        self.keys = frozenset(keys)
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.loads = loads
+        self.size = 0
+        self.result = {}
+        self._state = _START
+        self._key = bytearray()
+        self._current_key = None
+        self._value = bytearray()
+        self._capture = False
+        self._scalar = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BodyTooLarge("request body exceeds %s bytes" % self.max_size)
+        i = 0
+        n = len(chunk)
+        while i < n:
+            state = self._state
+            if state == _VALUE:
+                i = self._scan_value(chunk, i)
+                continue
+            if state == _KEY:
+                i = self._scan_key(chunk, i)
+                continue
+            c = chunk[i]
+            if c in _WHITESPACE:
+                i += 1
+                continue
+            if state == _START:
+                if c != ord("{"):
+                    raise BodyParseError("request body must be a json object")
+                self._state = _KEY_OR_END
+            elif state == _KEY_OR_END or state == _KEY_START:
+                if c == _QUOTE:
+                    self._key.clear()
+                    self._state = _KEY
+                elif c == ord("}") and state == _KEY_OR_END:
+                    self._state = _DONE
+                else:
+                    raise BodyParseError("expecting property name at byte %s" % (self.size - n + i))
+            elif state == _COLON:
+                if c != ord(":"):
+                    raise BodyParseError("expecting ':' at byte %s" % (self.size - n + i))
+                self._state = _VALUE_START
+            elif state == _VALUE_START:
+                self._capture = self._current_key in self.keys
+                self._scalar = c != _QUOTE and c not in _OPENERS
+                self._depth = 0
+                self._in_string = False
+                self._state = _VALUE
+                continue
+            elif state == _COMMA_OR_END:
+                if c == ord(","):
+                    self._state = _KEY_START
+                elif c == ord("}"):
+                    self._state = _DONE
+                else:
+                    raise BodyParseError("expecting ',' or '}' at byte %s" % (self.size - n + i))
+            else:
+                raise BodyParseError("extra data at byte %s" % (self.size - n + i))
+            i += 1
+
+    def _scan_key(self, chunk: bytes, i: int) -> int:
+        n = len(chunk)
+        key = self._key
+        while i < n:
+            if self._escape:
+                key += chunk[i:i + 1]
+                self._escape = False
+                i += 1
+                continue
+            m = _STRING.search(chunk, i)
+            if m is None:
+                key += chunk[i:]
+                return n
+            j = m.start()
+            if chunk[j] == _BACKSLASH:
+                key += chunk[i:j + 1]
+                self._escape = True
+                i = j + 1
+                continue
+            key += chunk[i:j]
+            try:
+                self._current_key = json.loads(b'"' + bytes(key) + b'"')
+            except ValueError as e:
+                raise BodyParseError("invalid property name: %s" % e)
+            self._state = _COLON
+            return j + 1
+        return n
+
+    def _scan_value(self, chunk: bytes, i: int) -> int:
+        n = len(chunk)
+        start = i
+        if self._scalar:
+            m = _SCALAR_END.search(chunk, i)
+            if m is None:
+                if self._capture:
+                    self._value += chunk[start:]
+                return n
+            if self._capture:
+                self._value += chunk[start:m.start()]
+            self._finish_value()
+            return m.start()
+        while i < n:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                m = _STRING.search(chunk, i)
+                if m is None:
+                    i = n
+                    break
+                j = m.start()
+                if chunk[j] == _BACKSLASH:
+                    i = j + 2
+                    if i > n:
+                        self._escape = True
+                        i = n
+                    continue
+                self._in_string = False
+                i = j + 1
+                if self._depth == 0:
+                    return self._end_value(chunk, start, i)
+                continue
+            m = _STRUCTURE.search(chunk, i)
+            if m is None:
+                i = n
+                break
+            j = m.start()
+            c = chunk[j]
+            i = j + 1
+            if c == _QUOTE:
+                self._in_string = True
+            elif c in _OPENERS:
+                self._depth += 1
+                # 顶层的object占一层
+                if self.max_depth is not None and self._depth + 1 > self.max_depth:
+                    raise BodyParseError("request body exceeds max depth: %s" % self.max_depth)
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._end_value(chunk, start, i)
+        if self._capture:
+            self._value += chunk[start:i]
+        return i
+
+    def _end_value(self, chunk: bytes, start: int, end: int) -> int:
+        if self._capture:
+            self._value += chunk[start:end]
+        self._finish_value()
+        return end
+
+    def _finish_value(self):
+        if self._capture:
+            try:
+                self.result[self._current_key] = self.loads(bytes(self._value))
+            except ValueError as e:
+                raise BodyParseError("invalid value of %r: %s" % (self._current_key, e))
+            self._value.clear()
+        self._state = _COMMA_OR_END
+
+    def close(self) -> Optional[dict]:
+        """结束解析, 请求体为空时返回None"""
+        if self.size == 0:
+            return None
+        if self._state != _DONE:
+            raise BodyParseError("unexpected end of request body")
+        return self.result
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/31 14:06
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from enum import Enum
+from typing import Callable, Dict, Iterable, List, Optional, TYPE_CHECKING
+
+from .exceptions import ConfigError
+
+if TYPE_CHECKING:
+    from .view import View
+
+
+class ProfileModes(Enum):
+    cprofile = "cprofile"
+    sample = "sample"
+
+
+class StackSampler(object):
+    """定时读取正在被采样的线程的调用栈, 只有存在正在执行的采样请求时才会工作"""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self._active: Dict[int, "RouteProfiler"] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def activate(self, profiler: "RouteProfiler"):
+        with self._lock:
+            self._active[threading.get_ident()] = profiler
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wtph-stack-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def deactivate(self):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._wakeup.clear()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()  # noqa
+            for thread_id, profiler in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profiler.add_stack(frame)
+
+
+stack_sampler = StackSampler()
+
+
+def format_frame(frame) -> str:
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno)
+
+
+class RouteProfiler(object):
+    """采样一个视图每every次调用中的一次
+
+    cprofile模式下所有采样的调用累计到同一个cProfile.Profile中, 导出为pstats文件;
+    sample模式下定时记录调用栈, 导出为flamegraph.pl/speedscope可以读取的collapsed stack格式.
+    同一时间只有一个调用会被采样, 其他调用不受影响, 异步视图在await期间采样到的可能是其他协程.
+    采样线程需要拿到GIL才能读取调用栈, 耗时远小于sys.getswitchinterval()的调用应该使用cprofile模式
+    """
+
+    def __init__(self, view: "View", *, every: int = 10, mode: str = "cprofile"):
+        if every < 1:
+            raise ConfigError("every must be greater than or equal to 1")
+        self.view = view
+        self.every = every
+        self.mode = ProfileModes(mode)
+        self.calls = 0
+        self.sampled = 0
+        self.started = time.time()
+        self._counter = itertools.count(1)
+        self._profile = cProfile.Profile() if self.mode is ProfileModes.cprofile else None
+        self._stacks: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def should_sample(self) -> bool:
+        self.calls = next(self._counter)
+        return self.calls % self.every == 0
+
+    def _begin(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            return False
+        self.sampled += 1
+        if self._profile is not None:
+            self._profile.enable()
+        else:
+            stack_sampler.activate(self)
+        return True
+
+    def _end(self):
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            stack_sampler.deactivate()
+        self._lock.release()
+
+    def run(self, func: Callable, *args, **kwargs):
+        if not self._begin():
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._end()
+
+    async def run_async(self, func: Callable, *args, **kwargs):
+        if not self._begin():
+            return await func(*args, **kwargs)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self._end()
+
+    def add_stack(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(format_frame(frame))
+            frame = frame.f_back
+        stack.reverse()
+        self._stacks[";".join(stack)] += 1
+
+    def get_collapsed(self) -> str:
+        return "".join("%s %d\n" % (stack, n) for stack, n in sorted(self._stacks.items()))
+
+    def get_stats_text(self, sort: str = "cumulative", limit: int = 30) -> str:
+        if self._profile is None:
+            return "".join("%s %d\n" % (stack, n) for stack, n in self._stacks.most_common(limit))
+        stream = io.StringIO()
+        try:
+            pstats.Stats(self._profile, stream=stream).sort_stats(sort).print_stats(limit)
+        except TypeError:
+            # 还没有采样到任何调用
+            return ""
+        return stream.getvalue()
+
+    def dump(self, path: str) -> str:
+        """cprofile模式写入pstats文件, sample模式写入collapsed stack文件"""
+        if self._profile is not None:
+            self._profile.dump_stats(path)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.get_collapsed())
+        return path
+
+    def default_filename(self) -> str:
+        suffix = "prof" if self._profile is not None else "collapsed"
+        return "wtph-%s-%s.%s" % (self.view.name, time.strftime("%Y%m%d-%H%M%S"), suffix)
+
+    def info(self) -> dict:
+        return {
+            "path": self.view.path,
+            "methods": sorted(self.view.methods) if self.view.methods is not None else None,
+            "name": self.view.name,
+            "mode": self.mode.value,
+            "every": self.every,
+            "calls": self.calls,
+            "sampled": self.sampled,
+            "started": self.started,
+        }
+
+
+def find_views(path: str, method: Optional[str] = None, views: Optional[Iterable["View"]] = None) -> List["View"]:
+    if views is None:
+        from .view import view_set as views
+    method = method.upper() if method else None
+    return [
+        view for view in views
+        if view.path == path and (method is None or view.methods is None or method in view.methods)
+    ]
+
+
+def start_profiling(path: str, method: Optional[str] = None, *, every: int = 10, mode: str = "cprofile"):
+    """开始采样匹配path(与method)的视图, 返回对应的RouteProfiler"""
+    views = find_views(path, method)
+    if not views:
+        raise ConfigError("no view matches: %s %s" % (method or "*", path))
+    profilers = []
+    for view in views:
+        view.profiler = RouteProfiler(view, every=every, mode=mode)
+        profilers.append(view.profiler)
+    return profilers
+
+
+def stop_profiling(
+        path: str,
+        method: Optional[str] = None,
+        *,
+        output_dir: Optional[str] = None,
+) -> List[str]:
+    """停止采样并把结果写入output_dir(默认为临时目录), 返回写入的文件"""
+    output_dir = output_dir or tempfile.gettempdir()
+    files = []
+    for view in find_views(path, method):
+        profiler = view.profiler
+        if profiler is None:
+            continue
+        view.profiler = None
+        files.append(profiler.dump(os.path.join(output_dir, profiler.default_filename())))
+    return files
+
+
+def get_profilers(views: Optional[Iterable["View"]] = None) -> List[RouteProfiler]:
+    if views is None:
+        from .view import view_set as views
+    return [view.profiler for view in list(views) if view.profiler is not None]
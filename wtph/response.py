@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/10/26 21:15
+import json
+import threading
+from typing import Any, Callable, Dict, Optional, Type
+
+from pydantic import BaseConfig, BaseModel, create_model
+from pydantic.error_wrappers import ValidationError
+from pydantic.fields import (
+    ModelField, Required,
+    SHAPE_SINGLETON, SHAPE_LIST, SHAPE_SET, SHAPE_FROZENSET, SHAPE_SEQUENCE, SHAPE_TUPLE_ELLIPSIS, SHAPE_DEQUE,
+    SHAPE_DICT, SHAPE_MAPPING, SHAPE_DEFAULTDICT,
+)
+from pydantic.utils import lenient_issubclass
+
+from .codec import JSONCodec, get_codec
+
+list_shapes = {SHAPE_LIST, SHAPE_SET, SHAPE_FROZENSET, SHAPE_SEQUENCE, SHAPE_TUPLE_ELLIPSIS, SHAPE_DEQUE}
+dict_shapes = {SHAPE_DICT, SHAPE_MAPPING, SHAPE_DEFAULTDICT}
+
+_encoders: Dict[Type[BaseModel], Callable[[Any], Any]] = {}
+_building = set()
+_lock = threading.RLock()
+# ValidationError需要一个model的config来生成错误信息
+_error_model = create_model("Response")
+
+
+def create_response_field(annotation: Any, name: str = "Response") -> ModelField:
+    return ModelField.infer(
+        name=name,
+        value=Required,
+        annotation=annotation,
+        class_validators={},
+        config=BaseConfig,
+    )
+
+
+def encode_any(value: Any) -> Any:
+    """没有声明类型时的通用转换, 只处理其中的model与容器, 其他类型交给codec"""
+    if isinstance(value, BaseModel):
+        return get_model_encoder(value.__class__)(value)
+    if isinstance(value, dict):
+        return {k: encode_any(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [encode_any(v) for v in value]
+    return value
+
+
+def _contains_model(field: ModelField) -> bool:
+    if lenient_issubclass(field.type_, BaseModel):
+        return True
+    return any(_contains_model(sub_field) for sub_field in field.sub_fields or ())
+
+
+def get_field_encoder(field: ModelField) -> Optional[Callable[[Any], Any]]:
+    """根据字段类型返回转换函数, 不包含model的字段返回None, 值直接交给codec"""
+    if not _contains_model(field):
+        return None
+    if field.shape == SHAPE_SINGLETON and not field.sub_fields and lenient_issubclass(field.type_, BaseModel):
+        return get_model_encoder(field.type_)
+    if field.shape in list_shapes and field.sub_fields:
+        item_encoder = _get_item_encoder(field.sub_fields[0])
+
+        def encode_list(value):
+            return [item_encoder(item) for item in value]
+
+        return encode_list
+    if field.shape in dict_shapes and field.sub_fields:
+        item_encoder = _get_item_encoder(field.sub_fields[0])
+
+        def encode_dict(value):
+            return {k: item_encoder(v) for k, v in value.items()}
+
+        return encode_dict
+    # Union, Tuple等情况按照实际的值转换
+    return encode_any
+
+
+def _get_item_encoder(field: ModelField) -> Callable[[Any], Any]:
+    encoder = get_field_encoder(field)
+    if encoder is None or not field.allow_none:
+        return encoder or encode_any
+
+    def encode_optional(value):
+        return None if value is None else encoder(value)
+
+    return encode_optional
+
+
+def _lazy_model_encoder(model: Type[BaseModel]) -> Callable[[Any], Any]:
+    # 自引用的model在编译完成之前就被引用了
+    def encode(obj):
+        return _encoders[model](obj)
+
+    return encode
+
+
+def get_model_encoder(model: Type[BaseModel]) -> Callable[[Any], Any]:
+    """为model生成一个直接读取实例__dict__的转换函数, 只输出声明的字段, key使用alias
+
+    与model.dict(by_alias=True)的结果相同, 但是不需要逐个字段判断类型与include/exclude
+    """
+    encoder = _encoders.get(model)
+    if encoder is not None:
+        return encoder
+    with _lock:
+        encoder = _encoders.get(model)
+        if encoder is not None:
+            return encoder
+        if model in _building:
+            return _lazy_model_encoder(model)
+        _building.add(model)
+        try:
+            encoder = _compile_model_encoder(model)
+        finally:
+            _building.discard(model)
+        _encoders[model] = encoder
+        return encoder
+
+
+def _compile_model_encoder(model: Type[BaseModel]) -> Callable[[Any], Any]:
+    if model.__config__.json_encoders:
+        # 自定义的json_encoders只有pydantic自己能处理
+        def encode_with_json_encoders(obj):
+            if isinstance(obj, dict):
+                return encode_any(obj)
+            return json.loads(obj.json(by_alias=True))
+
+        return encode_with_json_encoders
+
+    namespace = {"encode_any": encode_any}
+    items = []
+    for i, (name, field) in enumerate(model.__fields__.items()):
+        value = "values[%r]" % name
+        field_encoder = get_field_encoder(field)
+        if field_encoder is not None:
+            encoder_name = "encoder_%d" % i
+            namespace[encoder_name] = field_encoder
+            if field.allow_none:
+                value = "(%s(%s) if %s is not None else None)" % (encoder_name, value, value)
+            else:
+                value = "%s(%s)" % (encoder_name, value)
+        items.append("        %r: %s," % (field.alias, value))
+    lines = [
+        "def encode(obj):",
+        "    if isinstance(obj, dict):",
+        "        return encode_any(obj)",
+        "    values = obj.__dict__",
+        "    return {",
+        *items,
+        "    }",
+    ]
+    code = "\n".join(lines)
+    exec(compile(code, "<wtph encoder %s>" % model.__name__, "exec"), namespace)
+    func = namespace["encode"]
+    func.__source__ = code
+    return func
+
+
+class ResponseValidationError(ValidationError):
+    pass
+
+
+class ResponseSerializer(object):
+    """视图返回值的序列化, 每个视图只构建一次
+
+    :param response_model: 返回值的类型, 可以是model或者List[model]等类型注解
+    :param validate: 为False时信任视图的返回值, 不做校验直接序列化
+    """
+
+    def __init__(self, response_model: Any, *, validate: bool = True, codec: Optional[JSONCodec] = None):
+        self.response_model = response_model
+        self.validate = validate
+        self.codec = codec if codec is not None else get_codec("json")
+        self.field = create_response_field(response_model)
+        self.encoder = get_field_encoder(self.field)
+
+    def validate_value(self, value: Any) -> Any:
+        value, errors = self.field.validate(value, {}, loc=("response",))
+        if errors:
+            if not isinstance(errors, list):
+                errors = [errors]
+            raise ResponseValidationError(errors, _error_model)
+        return value
+
+    def serialize(self, value: Any) -> bytes:
+        if self.validate:
+            value = self.validate_value(value)
+        if self.encoder is not None and value is not None:
+            value = self.encoder(value)
+        return self.codec.dumps(value)
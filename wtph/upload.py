@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# @Time: 2021/11/4 20:32
+import mmap
+import shutil
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+from typing import Any, BinaryIO, Iterator, Optional, Union
+
+from .exceptions import BodyTooLarge
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class UploadFile(object):
+    """上传的文件, 小于spool_size时保存在内存中, 超过后写入临时文件
+
+    写入时检查max_size, 超过时抛出BodyTooLarge, 解析请求体时可以在读完整个文件之前拒绝请求
+    """
+
+    def __init__(
+            self,
+            name: Optional[str],
+            filename: Optional[str] = None,
+            content_type: Optional[str] = None,
+            headers=None,
+            *,
+            max_size: Optional[int] = None,
+            spool_size: int = 1024 * 1024,
+    ):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.max_size = max_size
+        self.size = 0
+        self.file: SpooledTemporaryFile = SpooledTemporaryFile(max_size=spool_size, mode="w+b")
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value: Any) -> "UploadFile":
+        if not isinstance(value, cls):
+            raise TypeError("expected an uploaded file")
+        return value
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(type="string", format="binary")
+
+    @classmethod
+    def from_stream(
+            cls,
+            stream: BinaryIO,
+            name: Optional[str],
+            filename: Optional[str] = None,
+            content_type: Optional[str] = None,
+            headers=None,
+            **kwargs,
+    ) -> "UploadFile":
+        """从已经解析好的文件(例如werkzeug的FileStorage.stream)分块复制"""
+        upload = cls(name, filename, content_type, headers, **kwargs)
+        while True:
+            chunk = stream.read(DEFAULT_CHUNK_SIZE)
+            if not chunk:
+                break
+            upload.write(chunk)
+        upload.seek(0)
+        return upload
+
+    @property
+    def in_memory(self) -> bool:
+        return not self.file._rolled  # noqa
+
+    def write(self, data: bytes) -> int:
+        size = self.size + len(data)
+        if self.max_size is not None and size > self.max_size:
+            raise BodyTooLarge("file: %s exceeds %s bytes" % (self.name, self.max_size))
+        self.size = size
+        return self.file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def iter_chunks(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        """从头开始分块读取, 不会一次性读入整个文件"""
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.iter_chunks()
+
+    @contextmanager
+    def mmap(self) -> Iterator[Union[mmap.mmap, bytes]]:
+        """以只读的mmap访问文件内容, 内存中的文件会先写入临时文件, 空文件不能mmap, 返回空的bytes"""
+        if self.size == 0:
+            yield b""
+            return
+        self.file.rollover()
+        self.file.flush()
+        mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+    def save(self, dst: Union[str, BinaryIO], chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.file.seek(0)
+        if isinstance(dst, str):
+            with open(dst, "wb") as f:
+                shutil.copyfileobj(self.file, f, chunk_size)
+        else:
+            shutil.copyfileobj(self.file, dst, chunk_size)
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.file.closed
+
+    def __repr__(self) -> str:
+        return "%s(%r, filename=%r, size=%d)" % (self.__class__.__name__, self.name, self.filename, self.size)
+
@@ -1,26 +1,31 @@
 # -*- coding: utf-8 -*-
 # @Time: 2021/8/15 16:34
+import asyncio
+import contextvars
 import dataclasses
+import functools
 import inspect
 import re
 from collections import OrderedDict
 from enum import Enum
 from typing import Type, Optional, Callable, TYPE_CHECKING, Tuple, List, Dict
 
-from pydantic import create_model, BaseConfig, BaseModel
+from pydantic import create_model, BaseConfig, BaseModel, Extra, validate_model
+from pydantic.error_wrappers import ErrorWrapper, flatten_errors
+from pydantic.errors import MissingError
 from pydantic.fields import ModelField
 from pydantic.fields import (
     SHAPE_SET, SHAPE_TUPLE, SHAPE_SEQUENCE, SHAPE_TUPLE_ELLIPSIS, SHAPE_LIST, SHAPE_SINGLETON
 )
 from pydantic.utils import lenient_issubclass
-from .params import Query, Form, Body, Depends
+from .params import Query, Path, Header, Cookie, Form, Body, BatchBody, File, Depends
 
 if TYPE_CHECKING:
     from pydantic.main import Model  # noqa
 
 _empty = inspect.Parameter.empty
 
-SUPPORT_PARAMS = {Query, Form, Body, Depends}
+SUPPORT_PARAMS = {Query, Path, Header, Cookie, Form, Body, BatchBody, File, Depends}
 
 sequence_shapes = {
     SHAPE_LIST,
@@ -39,12 +44,28 @@ def get_name(obj: Callable) -> str:
         return obj.__class__.__name__  # noqa
 
 
+def is_coroutine_callable(f: Callable) -> bool:
+    if inspect.iscoroutinefunction(f):
+        return True
+    if inspect.isclass(f):
+        return False
+    return inspect.iscoroutinefunction(getattr(f, "__call__", None))
+
+
+async def run_in_threadpool(func: Callable, *args, **kwargs):
+    """在事件循环默认的线程池中执行同步函数, 复制当前的contextvars, 函数中可以读取当前请求"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args, **kwargs))
+
+
 def generate_model_from_callable(
         f: Callable,
         skip_first_argument: bool = False,
         *,
         model_name=None,
         config: Optional[Type[BaseConfig]] = None,
+        intern: bool = True,
 ) -> Tuple[Type["Model"], Dict[str, Depends]]:
     """从解析视图函数中的参数, 生成校验的Type[BaseModel]
 
@@ -52,8 +73,11 @@ def generate_model_from_callable(
     :param skip_first_argument: 是否跳过第一个参数
     :param model_name: model名称, 可选常数字符串, 一个format的字符串, 和一个函数, 接受当前函数的参数
     :param config: 生成的model的配置
+    :param intern: 签名(参数名, 类型, Param的设置与config)相同时返回之前生成的model, 名称为第一次生成时的名称
     :return 非依赖解析的model与依赖model
     """
+    from .cache import make_model_key, model_registry
+
     sig = inspect.signature(f)
 
     if skip_first_argument:
@@ -88,15 +112,99 @@ def generate_model_from_callable(
         assert callable(model_name), "model name must None str or callable"
         model_name = model_name(f)
 
-    model = create_model(
-        model_name,
-        __config__=config,
-        __module__=f.__module__,  # noqa
-        **model_fields
-    )
+    def create():
+        return create_model(
+            model_name,
+            __config__=config,
+            __module__=f.__module__,  # noqa
+            **model_fields
+        )
+
+    if intern:
+        model = model_registry.get_or_create(make_model_key(model_fields, config, f.__module__), create)
+    else:
+        model = create()
     return model, name_depend_map
 
 
+_missing = object()
+
+
+def validate_fields(
+        model: Type[BaseModel],
+        data: dict,
+        max_errors: Optional[int] = None,
+        exclude: Optional[set] = None,
+) -> Tuple[dict, List[dict]]:
+    """逐个字段校验data, 错误数量达到max_errors时立即停止, 返回(values, errors)
+
+    只处理生成的请求model(没有root validator, 忽略多余字段), 其他model回退到pydantic的validate_model
+
+    :param exclude: 不校验的字段名称
+    """
+    config = model.__config__
+    if (
+            model.__pre_root_validators__ or model.__post_root_validators__ or
+            config.extra is not Extra.ignore or config.allow_population_by_field_name
+    ):
+        values, _, error = validate_model(model, data)
+        errors = error.errors() if error is not None else []
+        if exclude:
+            aliases = {model.__fields__[name].alias for name in exclude}
+            errors = [err for err in errors if err['loc'][0] not in aliases]
+            for name in exclude:
+                values.pop(name, None)
+        if max_errors is not None:
+            errors = errors[:max_errors]
+        return values, errors
+
+    values = {}
+    raw_errors = []
+    for name, field in model.__fields__.items():
+        if exclude and name in exclude:
+            continue
+        value = data.get(field.alias, _missing)
+        if value is _missing:
+            if field.required:
+                raw_errors.append(ErrorWrapper(MissingError(), loc=field.alias))
+            else:
+                value = field.get_default()
+                if not config.validate_all and not field.validate_always:
+                    values[name] = value
+                    continue
+        if value is not _missing:
+            v_, errors_ = field.validate(value, values, loc=field.alias, cls=model)
+            if errors_ is None:
+                values[name] = v_
+                continue
+            raw_errors.append(errors_)
+        if max_errors is not None and len(raw_errors) >= max_errors:
+            break
+
+    errors = []
+    for err in flatten_errors(raw_errors, config):
+        errors.append(err)
+        if max_errors is not None and len(errors) >= max_errors:
+            break
+    return values, errors
+
+
+def get_header_name(field: ModelField) -> str:
+    """Header字段对应的header名称, 没有指定alias时按convert_underscores转换参数名"""
+    field_info = field.field_info
+    if field.has_alias or not getattr(field_info, "convert_underscores", True):
+        return field.alias
+    return field.name.replace("_", "-")
+
+
+def get_environ_key(header_name: str) -> str:
+    """header名称在WSGI environ中的key"""
+    key = header_name.upper().replace("-", "_")
+    if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+        return key
+    return "HTTP_" + key
+
+
 # 下面的与是从FastAPI中复制过来, is_scalar_sequence_field用于检测一个ModelField是否是一个序列类型
 # 对于序列类型, 需要调用对应的getlist
 
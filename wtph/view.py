@@ -1,19 +1,111 @@
 # -*- coding: utf-8 -*-
 # @Time: 2021/9/21 14:11
 import functools
+import gc
+import inspect
+import threading
+import time
 from types import MethodType
-from typing import Callable, Optional, Type, Iterable, List
+from typing import Any, Callable, Optional, Type, Iterable, List, Dict
 
-from flask import jsonify
+try:
+    from flask import current_app
+except ImportError:  # asgi模式不需要安装flask
+    current_app = None
 
 from .parsers.base import ParserManagerFactory, generate_model_from_callable, ParserManager
-from .utils import get_name
+from .errors import ValidationErrorTemplate
+from .response import ResponseSerializer
+from .instrument import Instrumentation, Recorder
+from .profiler import RouteProfiler
+from .utils import get_name, is_coroutine_callable, run_in_threadpool
 from .config import config
+from .exceptions import ConfigError
 
-view_set = set()
+
+class ViewSet(set):
+    """记录变更次数的set, openapi文档根据version判断是否需要重新生成, freeze()之后不能再修改"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.version = 0
+        self.frozen = False
+
+    def freeze(self):
+        self.frozen = True
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise ConfigError("views can not be registered or removed after wtph.freeze()")
+
+    def add(self, view):
+        self._check_frozen()
+        if view not in self:
+            super().add(view)
+            self.version += 1
+
+    def remove(self, view):
+        self._check_frozen()
+        super().remove(view)
+        self.version += 1
+
+    def discard(self, view):
+        self._check_frozen()
+        if view in self:
+            super().discard(view)
+            self.version += 1
+
+    def pop(self):
+        self._check_frozen()
+        view = super().pop()
+        self.version += 1
+        return view
+
+    def update(self, *others):
+        for other in others:
+            for view in other:
+                self.add(view)
+
+    def clear(self):
+        self._check_frozen()
+        super().clear()
+        self.version += 1
+
+
+view_set = ViewSet()
+_build_lock = threading.Lock()
 
 
 class View(object):
+    # __dict__只保存functools.update_wrapper从endpoint复制的属性(__name__, __doc__, __wrapped__等)
+    __slots__ = (
+        "path",
+        "methods",
+        "deprecated",
+        "include_in_schema",
+        "summary",
+        "tags",
+        "description",
+        "endpoint",
+        "is_method",
+        "parser_factory",
+        "compiled",
+        "fast_validate",
+        "max_errors",
+        "response_model",
+        "validate_response",
+        "instrumentation",
+        "profiler",
+        "build_stats",
+        "name",
+        "_model",
+        "_parser_manager",
+        "_error_template",
+        "_response_serializer",
+        "__dict__",
+        "__weakref__",
+    )
+
     def __init__(
             self,
             *,
@@ -28,6 +120,13 @@ class View(object):
             parser_factory: Optional[ParserManagerFactory] = None,
             is_method: bool = False,
             description: Optional[str] = None,
+            compiled: bool = False,
+            fast_validate: bool = False,
+            max_errors: Optional[int] = None,
+            lazy: bool = False,
+            response_model: Any = None,
+            validate_response: bool = True,
+            instrument: bool = True,
     ):
         if parser_factory is None:
             assert config.parser_factory is not None
@@ -43,21 +142,21 @@ class View(object):
         self.description = description
         self.endpoint = endpoint
         self.is_method = is_method
-        model_name = "RequestValidateModel<for %s" % path
-        if self.methods is not None:
-            if len(self.methods) == 1:
-                methods = list(self.methods)[0]
-            else:
-                methods = sorted(self.methods)
-            model_name += ", methods=%s" % methods
-        model_name += ">"
-        model, depend_funcs = generate_model_from_callable(
-            endpoint,
-            is_method,
-            model_name=model_name
-        )
-        self.model = model
-        self.parser_manager: ParserManager = parser_factory(self.model, depend_funcs)
+        self.parser_factory = parser_factory
+        self.compiled = compiled
+        self.fast_validate = fast_validate
+        self.max_errors = max_errors
+        self.response_model = response_model
+        self.validate_response = validate_response
+        self.instrumentation = config.instrumentation if instrument else None
+        self.profiler: Optional[RouteProfiler] = None
+        self.build_stats: Optional[Dict[str, float]] = None
+        self._model = None
+        self._parser_manager: Optional[ParserManager] = None
+        self._error_template: Optional[ValidationErrorTemplate] = None
+        self._response_serializer: Optional[ResponseSerializer] = None
+        if not lazy:
+            self.build()
         if name is None:
             self.name = get_name(endpoint)
         else:
@@ -66,6 +165,104 @@ class View(object):
         if path is not None:
             view_set.add(self)
 
+    def get_model_name(self) -> str:
+        model_name = "RequestValidateModel<for %s" % self.path
+        if self.methods is not None:
+            if len(self.methods) == 1:
+                methods = list(self.methods)[0]
+            else:
+                methods = sorted(self.methods)
+            model_name += ", methods=%s" % methods
+        model_name += ">"
+        return model_name
+
+    @property
+    def built(self) -> bool:
+        return self._parser_manager is not None
+
+    def build(self):
+        """生成校验的model与parser, lazy模式下在第一次请求或者warm_up时调用, 线程安全"""
+        if self._parser_manager is not None:
+            return
+        with _build_lock:
+            if self._parser_manager is not None:
+                return
+            timer = time.perf_counter
+            start = timer()
+            model, depend_funcs = generate_model_from_callable(
+                self.endpoint,
+                self.is_method,
+                model_name=self.get_model_name()
+            )
+            model_end = timer()
+            parser_manager: ParserManager = self.parser_factory(
+                model,
+                depend_funcs,
+                fast_validate=self.fast_validate,
+                max_errors=self.max_errors,
+            )
+            parsers_end = timer()
+            self._model = model
+            self.check_async(parser_manager)
+            if self.compiled:
+                parser_manager.compile()
+            compile_end = timer()
+            self._error_template = ValidationErrorTemplate(parser_manager.iter_error_locations(), config.codec)
+            error_template_end = timer()
+            if self.response_model is not None:
+                self._response_serializer = ResponseSerializer(
+                    self.response_model,
+                    validate=self.validate_response,
+                    codec=config.codec,
+                )
+            self._parser_manager = parser_manager
+            end = timer()
+            self.build_stats = {
+                "model": model_end - start,
+                "parsers": parsers_end - model_end,
+                "compile": compile_end - parsers_end,
+                "error_template": error_template_end - compile_end,
+                "response": end - error_template_end,
+                "total": end - start,
+            }
+
+    def freeze(self, compile_parsers: bool = True):
+        """完成构建并编译参数提取(compile_parsers为False时不编译), 之后请求中不再有延迟的工作"""
+        self.build()
+        if compile_parsers and not self._parser_manager.compiled:
+            self._parser_manager.compile()
+            self.compiled = True
+
+    @property
+    def model(self):
+        if self._parser_manager is None:
+            self.build()
+        return self._model
+
+    @property
+    def parser_manager(self) -> ParserManager:
+        if self._parser_manager is None:
+            self.build()
+        return self._parser_manager
+
+    @property
+    def error_template(self) -> ValidationErrorTemplate:
+        if self._parser_manager is None:
+            self.build()
+        return self._error_template
+
+    @property
+    def response_serializer(self) -> Optional[ResponseSerializer]:
+        if self._parser_manager is None:
+            self.build()
+        return self._response_serializer
+
+    def check_async(self, parser_manager: ParserManager):
+        if parser_manager.has_async_dependency():
+            raise TypeError(
+                "view: %s has async dependencies, use AsyncView instead" % get_name(self.endpoint)
+            )
+
     def __get__(self, instance, owner):
         if instance is None:
             return self
@@ -78,18 +275,146 @@ class View(object):
         return hash(flag)
 
     def __call__(self, *args, **kwargs):
+        profiler = self.profiler
+        if profiler is not None and profiler.should_sample():
+            return profiler.run(self.dispatch, *args, **kwargs)
+        return self.dispatch(*args, **kwargs)
+
+    def dispatch(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if instrumentation is not None and instrumentation.enabled:
+            return self.call_instrumented(instrumentation, *args, **kwargs)
         values, errors = self.parser_manager.parse(*args, __depend_cache__={}, **kwargs)
         if errors:
             return self.validate_error_handler(errors)
         kwargs.update(values)
-        return self.endpoint(*args, **kwargs)
+        rv = self.endpoint(*args, **kwargs)
+        if self._response_serializer is not None:
+            return self.make_response(rv)
+        return rv
+
+    def call_instrumented(self, instrumentation: Instrumentation, *args, **kwargs):
+        """与__call__相同, 同时记录各阶段的耗时与计数"""
+        recorder = instrumentation.start(self)
+        timer = recorder.timer
+        values, errors = self.parser_manager.parse(*args, __depend_cache__={}, __recorder__=recorder, **kwargs)
+        if errors:
+            rv = self._handle_errors_instrumented(recorder, errors)
+        else:
+            kwargs.update(values)
+            start = timer()
+            rv = self.endpoint(*args, **kwargs)
+            recorder.add("endpoint", timer() - start)
+            rv = self._make_response_instrumented(recorder, rv)
+        return self.finish_instrumented(instrumentation, recorder, rv)
+
+    def _handle_errors_instrumented(self, recorder: Recorder, errors):
+        recorder.count("validation_failures")
+        start = recorder.timer()
+        rv = self.validate_error_handler(errors)
+        recorder.add("error", recorder.timer() - start)
+        return rv
+
+    def _make_response_instrumented(self, recorder: Recorder, rv):
+        if self._response_serializer is None:
+            return rv
+        start = recorder.timer()
+        rv = self.make_response(rv)
+        recorder.add("response", recorder.timer() - start)
+        return rv
+
+    def finish_instrumented(self, instrumentation: Instrumentation, recorder: Recorder, rv):
+        instrumentation.finish(self, recorder)
+        if instrumentation.server_timing:
+            rv = current_app.make_response(rv)
+            rv.headers["Server-Timing"] = recorder.server_timing()
+        return rv
+
+    def make_response(self, rv):
+        """使用response_model序列化视图的返回值, 支持flask的(body, status, headers)形式, 已经是Response时不处理"""
+        response_class = current_app.response_class
+        if isinstance(rv, response_class):
+            return rv
+        extra = ()
+        if isinstance(rv, tuple):
+            rv, extra = rv[0], rv[1:]
+        response = response_class(self._response_serializer.serialize(rv), mimetype="application/json")
+        if extra:
+            return (response, *extra)
+        return response
 
     def default_validate_error_handler(self, errors):  # noqa
-        return jsonify(errors)
+        return current_app.response_class(self.error_template.render(errors), mimetype="application/json")
 
     validate_error_handler = default_validate_error_handler
 
 
+class AsyncView(View):
+    """支持async视图函数与async依赖的View, 同一层中相互独立的依赖会并发执行"""
+    __slots__ = ()
+
+    def check_async(self, parser_manager: ParserManager):
+        pass
+
+    async def call_endpoint(self, *args, **kwargs):
+        """async的视图函数直接await, 同步的视图函数在线程池中执行, 不阻塞事件循环"""
+        endpoint = self.endpoint
+        if is_coroutine_callable(endpoint):
+            return await endpoint(*args, **kwargs)
+        rv = await run_in_threadpool(endpoint, *args, **kwargs)
+        if inspect.isawaitable(rv):
+            rv = await rv
+        return rv
+
+    async def __call__(self, *args, **kwargs):
+        profiler = self.profiler
+        if profiler is not None and profiler.should_sample():
+            return await profiler.run_async(self.dispatch, *args, **kwargs)
+        return await self.dispatch(*args, **kwargs)
+
+    async def dispatch(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if instrumentation is not None and instrumentation.enabled:
+            return await self.call_instrumented(instrumentation, *args, **kwargs)
+        values, errors = await self.parser_manager.parse_async(*args, __depend_cache__={}, **kwargs)
+        if errors:
+            return self.validate_error_handler(errors)
+        kwargs.update(values)
+        rv = await self.call_endpoint(*args, **kwargs)
+        if self._response_serializer is not None:
+            return self.make_response(rv)
+        return rv
+
+    async def call_instrumented(self, instrumentation: Instrumentation, *args, **kwargs):
+        recorder = instrumentation.start(self)
+        timer = recorder.timer
+        values, errors = await self.parser_manager.parse_async(
+            *args, __depend_cache__={}, __recorder__=recorder, **kwargs
+        )
+        if errors:
+            rv = self._handle_errors_instrumented(recorder, errors)
+        else:
+            kwargs.update(values)
+            start = timer()
+            rv = await self.call_endpoint(*args, **kwargs)
+            recorder.add("endpoint", timer() - start)
+            rv = self._make_response_instrumented(recorder, rv)
+        return self.finish_instrumented(instrumentation, recorder, rv)
+
+    def as_view_func(self) -> Callable:
+        """返回一个协程函数, 用于只通过inspect.iscoroutinefunction判断异步视图的框架(例如flask)"""
+        view = self
+
+        async def view_func(*args, **kwargs):
+            return await view(*args, **kwargs)
+
+        view_func.__name__ = self.__name__
+        view_func.__qualname__ = getattr(self, "__qualname__", self.__name__)
+        view_func.__doc__ = self.__doc__
+        view_func.__wrapped__ = self
+        return view_func
+
+
 def api(
         path: Optional[str] = None,
         methods: Optional[Iterable[str]] = None,
@@ -101,10 +426,24 @@ def api(
         parser_factory: Optional[ParserManagerFactory] = None,
         description: Optional[str] = None,
         include_in_schema: bool = True,
-        view_class: Type[View] = View
+        compiled: bool = False,
+        fast_validate: bool = False,
+        max_errors: Optional[int] = None,
+        lazy: bool = False,
+        view_class: Optional[Type[View]] = None,
+        response_model: Any = None,
+        validate_response: bool = True,
+        instrument: bool = True,
 ):
     def wrapper(f):
-        return view_class(
+        cls = view_class
+        if cls is None:
+            # 与注册路由时相同, 使用setup_wtph配置的视图类(例如ASGI模式下的ASGIView)
+            if is_coroutine_callable(f):
+                cls = config.async_view_class or AsyncView
+            else:
+                cls = config.view_class or View
+        return cls(
             endpoint=f,
             path=path,
             name=name,
@@ -115,7 +454,14 @@ def api(
             parser_factory=parser_factory,
             is_method=is_method,
             include_in_schema=include_in_schema,
-            description=description
+            description=description,
+            compiled=compiled,
+            fast_validate=fast_validate,
+            max_errors=max_errors,
+            lazy=lazy,
+            response_model=response_model,
+            validate_response=validate_response,
+            instrument=instrument,
         )
 
     return wrapper
@@ -124,3 +470,70 @@ def api(
 def validate_error_handler(handler):
     View.validate_error_handler = handler
     return handler
+
+
+def warm_up(views: Optional[Iterable[View]] = None, background: bool = False) -> Optional[threading.Thread]:
+    """构建所有lazy模式下还没有构建的视图
+
+    :param views: 需要构建的视图, 默认为所有注册的视图
+    :param background: 为True时在后台线程中构建并返回线程, 可以在开始处理请求之后调用
+    """
+    if views is None:
+        views = list(view_set)
+
+    def build_all():
+        for view in views:
+            view.build()
+
+    if not background:
+        build_all()
+        return None
+    thread = threading.Thread(target=build_all, name="wtph-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_build_report(views: Optional[Iterable[View]] = None) -> List[dict]:
+    """每个视图构建时各阶段的耗时(秒), 按总耗时降序排列, 还没有构建的视图排在最后"""
+    if views is None:
+        views = view_set
+    report = []
+    for view in views:
+        item = {
+            "path": view.path,
+            "methods": sorted(view.methods) if view.methods is not None else None,
+            "name": view.name,
+            "built": view.built,
+        }
+        if view.build_stats is not None:
+            item.update(view.build_stats)
+        report.append(item)
+    report.sort(key=lambda item: item.get("total", -1), reverse=True)
+    return report
+
+
+def freeze(views: Optional[Iterable[View]] = None, *, compile_parsers: bool = True, gc_freeze: bool = True) -> dict:
+    """在gunicorn --preload等预先加载应用后fork的场景中, fork之前调用, 让worker尽量共享父进程的内存页
+
+    构建并编译所有视图(compile_parsers为False时不编译), 生成openapi文档的bytes, 之后不能再注册视图;
+    gc_freeze为True时调用gc.freeze(),
+    已有的对象不再被gc遍历, 避免worker中的gc写对象头导致整页复制. 需要在注册完所有路由之后调用
+    """
+    freeze_view_set = views is None
+    if views is None:
+        views = list(view_set)
+    for view in views:
+        view.freeze(compile_parsers)
+    openapi_bytes = None
+    if config.openapi_document is not None:
+        openapi_bytes = len(config.openapi_document.get().content)
+    if freeze_view_set:
+        view_set.freeze()
+    if gc_freeze:
+        gc.collect()
+        gc.freeze()
+    return {
+        "views": len(views),
+        "openapi_bytes": openapi_bytes,
+        "gc_frozen": gc.get_freeze_count(),
+    }